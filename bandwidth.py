@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+全局带宽限制
+所有下载线程共享一个按字节计的令牌桶，限速可以在下载过程中修改，也可以按时段设置（例如白天限速、夜间不限）；
+令牌不足时按优先级放行等待的线程，优先级高的传输先拿到带宽
+"""
+
+import itertools
+import re
+import threading
+import time
+
+# 等待令牌时至少每隔这么久（秒）重新检查一次，按时段的限速在时段切换后及时生效
+SCHEDULE_CHECK = 1.0
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+_RATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)(?:I?B)?(?:/S)?$')
+_TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
+def parse_rate(text):
+    """解析每秒字节数，如 "500K"、"10M"、"1.5MB/s"；空白或0表示不限速"""
+    text = text.strip().upper()
+    if not text:
+        return 0.0
+    match = _RATE_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"无法解析带宽 '{text}'，应为数字加单位，如 500K、10M")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+def format_rate(rate):
+    """把每秒字节数显示为 KB/s、MB/s"""
+    if not rate:
+        return "不限"
+    if rate >= 1024 ** 2:
+        return f"{rate / 1024 ** 2:.1f} MB/s"
+    return f"{rate / 1024:.0f} KB/s"
+
+
+def _parse_time(text):
+    match = _TIME_PATTERN.match(text.strip())
+    if not match or int(match.group(1)) > 24 or int(match.group(2)) > 59:
+        raise ValueError(f"无法解析时间 '{text.strip()}'，应为 时:分")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def parse_bandwidth(text):
+    """
+    解析带宽设置，可以只写一个限速（如 "10M"），也可以按时段设置，多条用分号或换行分隔：
+    "09:00-18:00=2M; *=0" 表示工作时间限制为2MB/s，其余时间不限；时段可以跨过午夜，如 "22:00-06:00=50M"
+    返回 (默认限速, [(开始分钟, 结束分钟, 限速), ...])，限速为每秒字节数，0表示不限
+    """
+    rate = 0.0
+    schedule = []
+    for item in text.replace('\n', ';').split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        period, separator, value = item.rpartition('=')
+        period = period.strip()
+        if not separator or period == '*':
+            rate = parse_rate(value)
+            continue
+        start, separator, end = period.partition('-')
+        if not separator:
+            raise ValueError(f"无法解析带宽时段 '{period}'，应为 开始-结束，如 09:00-18:00")
+        schedule.append((_parse_time(start), _parse_time(end), parse_rate(value)))
+    return rate, schedule
+
+
+class BandwidthLimiter:
+    """
+    按字节计的令牌桶，容量为1秒的流量，线程安全
+    每读到一块数据调用一次consume()：桶里有令牌时立即扣除（可以透支），透支期间后来的线程等待，
+    令牌恢复后先放行优先级最高的线程
+    """
+
+    def __init__(self, rate=0, schedule=None):
+        self._condition = threading.Condition()
+        self._rate = 0.0
+        self._schedule = []
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._sequence = itertools.count()
+        # 经过限速器的总字节数
+        self.transferred = 0
+        self.set_limits(rate, schedule)
+
+    def set_limits(self, rate, schedule=None):
+        """修改限速，下载过程中也可以调用，等待中的线程按新限速重新计算"""
+        with self._condition:
+            self._rate = max(0.0, float(rate or 0))
+            self._schedule = list(schedule or [])
+            self._condition.notify_all()
+
+    def current_rate(self, now=None):
+        """当前时段的限速（每秒字节数），0表示不限"""
+        if self._schedule:
+            local = time.localtime(now)
+            minute = local.tm_hour * 60 + local.tm_min
+            for start, end, rate in self._schedule:
+                if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                    return rate
+        return self._rate
+
+    def _refill(self, rate):
+        now = time.monotonic()
+        self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def consume(self, count, priority=()):
+        """
+        记入count字节，超出限速时阻塞到令牌恢复
+        priority为可比较的值，同一个限速器的调用方需使用同一类值，大的优先
+        """
+        with self._condition:
+            self.transferred += count
+            if not self.current_rate():
+                return
+            waiter = (priority, -next(self._sequence))
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    rate = self.current_rate()
+                    if not rate:
+                        return
+                    self._refill(rate)
+                    if self._tokens >= 0 and waiter == max(self._waiters):
+                        self._tokens -= count
+                        return
+                    delay = -self._tokens / rate if self._tokens < 0 else SCHEDULE_CHECK
+                    self._condition.wait(min(delay, SCHEDULE_CHECK))
+            finally:
+                self._waiters.remove(waiter)
+                self._condition.notify_all()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+多工作簿下载队列
+一次接收多个Excel文件（或包含Excel文件的文件夹），同时下载；所有工作簿共享同一个并发名额、连接池和主机限速，
+每个工作簿仍按各自的 Excel文件名_序号 命名并使用各自的下载日志
+"""
+
+import os
+import threading
+import time
+
+from checksum import DEFAULT_ALGORITHM
+from content_store import ContentStore
+from download_engine import (
+    DEFAULT_HEDGE_DELAY, DEFAULT_SEGMENT_THRESHOLD, DEFAULT_SEGMENTS, DEFAULT_WORKERS, MAX_WORKERS
+)
+from download_job import STATUSES, WorkbookDownload
+from durability import DEFAULT_DURABILITY, DEFAULT_SYNC_EVERY, DurabilityPolicy
+from http_pool import PooledSession
+from retry_policy import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, CircuitBreaker
+from stall_watchdog import DEFAULT_MIN_RATE, DEFAULT_STALL_WINDOW
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xls')
+# 同时进行的工作簿数上限，超出的排队等待
+DEFAULT_MAX_JOBS = 8
+# 引擎被拒绝后这么久（秒）没有再申请名额，就不再算作等待中（例如已取消或没有任务了）
+WAITING_EXPIRY = 1.0
+
+# 工作簿的状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_LABELS = {
+    JOB_QUEUED: '排队中',
+    JOB_RUNNING: '下载中',
+    JOB_DONE: '完成',
+    JOB_FAILED: '出错',
+    JOB_CANCELLED: '已取消',
+}
+
+
+def find_workbooks(paths):
+    """把文件和文件夹展开为Excel文件列表；文件夹不递归，跳过Excel打开文件时留下的 ~$ 临时文件"""
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full = os.path.join(path, name)
+                if name.lower().endswith(WORKBOOK_EXTENSIONS) and not name.startswith('~$') and os.path.isfile(full):
+                    workbooks.append(full)
+        else:
+            workbooks.append(path)
+    return workbooks
+
+
+class WorkerBudget:
+    """
+    多个下载引擎共享的并发名额，不阻塞
+    名额在正在运行的引擎之间平分；其他引擎不需要时，一个引擎可以用满全部名额；
+    优先级高的引擎在等待时，优先级低的引擎拿不到新名额
+    """
+
+    def __init__(self, capacity):
+        self.capacity = min(max(1, int(capacity)), MAX_WORKERS)
+        self._lock = threading.Lock()
+        self._in_use = {}
+        self._priorities = {}
+        # 最近因名额不足被拒绝的引擎及被拒绝的时间
+        self._waiting = {}
+
+    @property
+    def in_use(self):
+        with self._lock:
+            return sum(self._in_use.values())
+
+    def register(self, owner, priority=0):
+        with self._lock:
+            self._in_use.setdefault(owner, 0)
+            self._priorities[owner] = priority
+
+    def unregister(self, owner):
+        with self._lock:
+            self._in_use.pop(owner, None)
+            self._priorities.pop(owner, None)
+            self._waiting.pop(owner, None)
+
+    def set_priority(self, owner, priority):
+        with self._lock:
+            if owner in self._priorities:
+                self._priorities[owner] = priority
+
+    def try_acquire(self, owner):
+        with self._lock:
+            now = time.monotonic()
+            priority = self._priorities.get(owner, 0)
+            waiting = [
+                self._priorities.get(other, 0)
+                for other, since in self._waiting.items()
+                if other is not owner and now - since < WAITING_EXPIRY
+            ]
+            share = max(1, self.capacity // max(1, len(self._in_use)))
+            used = self._in_use.get(owner, 0)
+            # 只和优先级相同的引擎平分名额
+            others_waiting = priority in waiting
+            if (
+                sum(self._in_use.values()) < self.capacity
+                and not any(other > priority for other in waiting)
+                and (used < share or not others_waiting)
+            ):
+                self._in_use[owner] = used + 1
+                self._waiting.pop(owner, None)
+                return True
+            self._waiting[owner] = now
+            return False
+
+    def release(self, owner):
+        with self._lock:
+            if self._in_use.get(owner):
+                self._in_use[owner] -= 1
+
+
+class BatchJob:
+    """队列中的一个工作簿"""
+
+    def __init__(self, path, priority=0):
+        self.path = path
+        self.excel_filename = os.path.splitext(os.path.basename(path))[0]
+        # 优先级，越大越先开始，运行时越优先获得并发名额和带宽
+        self.priority = priority
+        self.state = JOB_QUEUED
+        self.error = None
+        # 开始下载后为WorkbookDownload
+        self.download = None
+
+    @property
+    def finished(self):
+        return self.download.finished if self.download else 0
+
+    @property
+    def total(self):
+        """有效链接数，解析完成前为None，出错或取消的工作簿为0"""
+        if self.state in (JOB_FAILED, JOB_CANCELLED) and (self.download is None or self.download.total is None):
+            return self.finished
+        return self.download.total if self.download else None
+
+    @property
+    def counts(self):
+        return self.download.counts if self.download else dict.fromkeys(STATUSES, 0)
+
+
+class BatchQueue:
+    """
+    多工作簿下载队列
+    run() 在调用线程中运行到队列中的工作簿全部结束为止，运行期间可以在其他线程中继续add()
+    """
+
+    def __init__(self, download_folder, workers=DEFAULT_WORKERS, rate_limiter=None, dedup_content=False,
+                 parse_cache=None, max_jobs=DEFAULT_MAX_JOBS, segments=DEFAULT_SEGMENTS,
+                 segment_threshold=DEFAULT_SEGMENT_THRESHOLD, bandwidth=None, small_first=False,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), retries=DEFAULT_RETRIES,
+                 min_rate=DEFAULT_MIN_RATE, stall_window=DEFAULT_STALL_WINDOW, hedge_delay=DEFAULT_HEDGE_DELAY,
+                 checksum_algorithm=DEFAULT_ALGORITHM, durability=DEFAULT_DURABILITY, sync_every=DEFAULT_SYNC_EVERY):
+        self.download_folder = download_folder
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.parse_cache = parse_cache
+        self.max_jobs = max(1, int(max_jobs))
+        self.segments = max(1, int(segments))
+        self.segment_threshold = segment_threshold
+        # 所有工作簿共享的带宽限制（bandwidth.BandwidthLimiter），可为None
+        self.bandwidth = bandwidth
+        self.small_first = small_first
+        self.timeout = timeout
+        self.retries = retries
+        self.min_rate = min_rate
+        self.stall_window = stall_window
+        self.hedge_delay = hedge_delay
+        self.checksum_algorithm = checksum_algorithm
+        # 熔断状态由所有工作簿共享，一个主机宕机时各工作簿中它的行都很快结束
+        self.breaker = CircuitBreaker()
+        self.budget = WorkerBudget(workers)
+        # 内容去重的存储由所有工作簿共享
+        self.content_store = ContentStore(download_folder) if dedup_content else None
+        # 落盘策略由所有工作簿共享，batch策略按全部工作簿完成的文件数计批
+        self.durability = DurabilityPolicy(durability, sync_every)
+        self.session = None
+        self.jobs = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._cancelled = False
+
+    def add(self, path, priority=0):
+        """
+        加入一个工作簿，返回对应的BatchJob；队列已结束时返回None，需要新建队列
+        priority越大越先开始，运行时也优先获得并发名额和带宽
+        与已有工作簿的文件名前缀相同（下载的文件会互相覆盖）时，加入的工作簿直接标记为出错
+        """
+        with self._condition:
+            if self._closed:
+                return None
+            job = BatchJob(path, priority)
+            for other in self.jobs:
+                if other.excel_filename != job.excel_filename or other.state not in (JOB_QUEUED, JOB_RUNNING):
+                    continue
+                if os.path.abspath(other.path) == os.path.abspath(path):
+                    # 同一个文件已在队列中
+                    return other
+                job.state = JOB_FAILED
+                job.error = f"与 {other.path} 的文件名前缀相同，下载的文件会互相覆盖"
+            self.jobs.append(job)
+            self._condition.notify_all()
+            return job
+
+    def set_priority(self, job, priority):
+        """修改工作簿的优先级，排队中和进行中的工作簿都立即生效"""
+        with self._condition:
+            job.priority = priority
+            if job.download:
+                job.download.set_priority(priority)
+
+    @property
+    def finished(self):
+        return sum(job.finished for job in self.jobs)
+
+    @property
+    def total(self):
+        """全部工作簿的有效链接总数，还有工作簿未解析完成时为None"""
+        totals = [job.total for job in self.jobs]
+        return None if None in totals else sum(totals)
+
+    @property
+    def counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for job in self.jobs:
+            for status, count in job.counts.items():
+                counts[status] += count
+        return counts
+
+    def run(self, on_result=None, on_job=None):
+        """
+        下载队列中的全部工作簿，最多同时进行max_jobs个
+        on_result(job, result, status) 在工作簿的下载线程中每完成一行调用一次；on_job(job) 在工作簿开始和结束时调用
+        """
+        # 分段下载时每个名额可能同时使用多个连接
+        self.session = PooledSession(pool_size=self.budget.capacity * self.segments)
+        threads = []
+        try:
+            while True:
+                with self._condition:
+                    job = self._next_job()
+                    if job is None:
+                        # 在锁内关闭，之后add()的工作簿需要新建队列
+                        self._closed = True
+                        break
+                    job.state = JOB_RUNNING
+                thread = threading.Thread(target=self._run_job, args=(job, on_result, on_job))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        except BaseException:
+            # 例如命令行中按了Ctrl+C：不再派发新任务，等进行中的下载结束
+            self.cancel()
+            raise
+        finally:
+            with self._condition:
+                self._closed = True
+            for thread in threads:
+                thread.join()
+            self.session.close()
+        return self.counts
+
+    def _next_job(self):
+        """在锁内调用：等到有可以开始的工作簿时返回它，全部结束时返回None"""
+        while True:
+            running = sum(1 for job in self.jobs if job.state == JOB_RUNNING)
+            queued = [job for job in self.jobs if job.state == JOB_QUEUED]
+            if self._cancelled:
+                for job in queued:
+                    job.state = JOB_CANCELLED
+                queued = []
+            if queued and running < self.max_jobs:
+                # 优先级相同时按加入的顺序
+                return max(queued, key=lambda job: job.priority)
+            if not queued and not running:
+                return None
+            self._condition.wait()
+
+    def _run_job(self, job, on_result, on_job):
+        state = JOB_DONE
+        try:
+            if on_job:
+                on_job(job)
+            download = WorkbookDownload(
+                job.path, self.download_folder, workers=self.budget.capacity, rate_limiter=self.rate_limiter,
+                parse_cache=self.parse_cache, session=self.session, budget=self.budget,
+                content_store=self.content_store, segments=self.segments, segment_threshold=self.segment_threshold,
+                bandwidth=self.bandwidth, priority=job.priority, small_first=self.small_first, timeout=self.timeout,
+                retries=self.retries, breaker=self.breaker, min_rate=self.min_rate, stall_window=self.stall_window,
+                hedge_delay=self.hedge_delay, checksum_algorithm=self.checksum_algorithm, durability=self.durability
+            )
+            with self._condition:
+                # 创建期间优先级可能被修改过
+                job.download = download
+                download.set_priority(job.priority)
+            if self._cancelled:
+                job.download.cancel()
+
+            def report(result, status):
+                if on_result:
+                    on_result(job, result, status)
+
+            job.download.run(on_result=report)
+            if self._cancelled:
+                state = JOB_CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            state = JOB_FAILED
+        finally:
+            with self._condition:
+                job.state = state
+                self._condition.notify_all()
+            if on_job:
+                on_job(job)
+
+    def cancel(self):
+        """排队的工作簿不再开始，进行中的工作簿停止派发新任务"""
+        with self._condition:
+            self._cancelled = True
+            running = [job for job in self.jobs if job.state == JOB_RUNNING]
+            self._condition.notify_all()
+        for job in running:
+            if job.download:
+                job.download.cancel()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+下载吞吐量基准测试
+在本机启动模拟的HTTP源站（可设置延迟、每个连接的带宽、文件大小分布、出错比例和是否支持Range），
+生成包含指定行数链接的Excel文件，在新进程中测量解析时间、端到端的每秒行数和MB/s以及内存峰值；
+结果保存为JSON，可与之前保存的结果比较，发现性能退化；
+urllib3 2.x的响应没有readinto1，流式写入每次读取产生一个bytes对象、不复用缓冲区，结果中记录urllib3版本以便区分
+
+    python benchmark_download.py --rows 1000 10000 100000 --latency 20 --sizes lognormal:32K:1 --json bench.json
+    python benchmark_download.py --rows 1000 10000 --compare bench.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+from bandwidth import parse_rate
+from download_engine import DEFAULT_SEGMENT_THRESHOLD, DEFAULT_WORKERS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_ROWS = (1000, 10000)
+DEFAULT_LATENCY = 20.0
+DEFAULT_SIZES = 'lognormal:32K:1'
+DEFAULT_SEED = 1
+# 每个主机的请求速率不设限，最大并发与并发数一致，测量的是下载引擎本身
+BENCHMARK_HOST_RATE = 1e6
+# 与基准结果相比变差超过这个比例时视为退化
+DEFAULT_THRESHOLD = 0.1
+# 模拟源站的文件内容由这么大的一块随机数据重复而成
+BLOCK_SIZE = 64 * 1024
+# 模拟源站限速时每次发送的字节数
+SEND_CHUNK = 16 * 1024
+# 比较时各项指标越大越好（True）还是越小越好（False）
+METRICS = {
+    'rows_per_sec': True,
+    'mb_per_sec': True,
+    'parse_rows_per_sec': True,
+    'peak_rss_mb': False,
+}
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_sizes(text):
+    """
+    解析文件大小分布，返回 size(rng) 函数：
+    "64K" 固定大小；"uniform:1K:1M" 均匀分布；"lognormal:32K:1" 对数正态分布（中位数、sigma）
+    """
+    kind, _, rest = text.strip().partition(':')
+    if not rest:
+        size = max(1, int(parse_rate(kind)))
+        return lambda rng: size
+    values = rest.split(':')
+    if kind == 'uniform' and len(values) == 2:
+        low, high = (max(1, int(parse_rate(value))) for value in values)
+        return lambda rng: rng.randint(min(low, high), max(low, high))
+    if kind == 'lognormal' and len(values) == 2:
+        median, sigma = max(1, parse_rate(values[0])), float(values[1])
+        return lambda rng: max(1, int(rng.lognormvariate(math.log(median), sigma)))
+    raise ValueError(f"无法解析文件大小分布 '{text}'，应为 64K、uniform:1K:1M 或 lognormal:32K:1")
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """模拟源站：/files/序号.bin 的大小由序号和随机种子决定，内容不落盘"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分开写入，不关闭Nagle算法时会与客户端的延迟确认互相等待约40毫秒
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+
+    def do_GET(self):
+        origin = self.server.origin
+        origin.count_request()
+        match = re.match(r'^/files/(\d+)\.bin$', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        if origin.latency:
+            time.sleep(origin.latency)
+        if origin.error_rate and random.random() < origin.error_rate:
+            self.send_error(503)
+            return
+
+        size = origin.size_of(int(match.group(1)))
+        start, end = 0, size
+        header = self.headers.get('Range', '')
+        range_match = _RANGE_PATTERN.match(header.strip()) if origin.ranges else None
+        if range_match and (range_match.group(1) or range_match.group(2)):
+            first, last = range_match.groups()
+            if first:
+                start, end = int(first), min(size, int(last) + 1) if last else size
+            else:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', f'"{match.group(1)}-{size}"')
+        if origin.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        try:
+            origin.send_body(self.wfile, start, end)
+        except OSError:
+            self.close_connection = True
+
+
+class SimulatedOrigin:
+    """
+    在本机随机端口运行的模拟源站
+    latency为每个请求返回响应头前的等待秒数，bandwidth为每个连接的速度上限（字节/秒，0为不限），
+    error_rate为返回503的请求比例，ranges为False时不支持Range请求
+    """
+
+    def __init__(self, sizes=DEFAULT_SIZES, latency=0.0, bandwidth=0, error_rate=0.0, ranges=True,
+                 seed=DEFAULT_SEED):
+        self.size_function = parse_sizes(sizes)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.ranges = ranges
+        self.seed = seed
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._block = random.Random(seed).randbytes(BLOCK_SIZE)
+        self._server = None
+
+    def size_of(self, file_id):
+        return self.size_function(random.Random(self.seed * 1000003 + file_id))
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def send_body(self, wfile, start, end):
+        """发送 [start, end) 这一段内容，设置了带宽时按速度上限发送"""
+        began = time.monotonic()
+        sent = 0
+        position = start
+        while position < end:
+            offset = position % BLOCK_SIZE
+            chunk = self._block[offset:offset + min(SEND_CHUNK, end - position)]
+            wfile.write(chunk)
+            position += len(chunk)
+            sent += len(chunk)
+            if self.bandwidth:
+                delay = sent / self.bandwidth - (time.monotonic() - began)
+                if delay > 0:
+                    time.sleep(delay)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def url(self, file_id):
+        return f"{self.base_url}/files/{file_id}.bin"
+
+    def total_size(self, rows):
+        return sum(self.size_of(file_id) for file_id in range(rows))
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+        self._server.daemon_threads = True
+        self._server.origin = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def make_workbook(path, rows, origin):
+    """生成一个有rows行链接的.xlsx文件（只写模式，十万行也不占用太多内存）"""
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["序号", "名称", "URL"])
+    for file_id in range(rows):
+        sheet.append([file_id, f"文件{file_id}", origin.url(file_id)])
+    workbook.save(path)
+
+
+def peak_rss_mb():
+    """当前进程的内存峰值（MB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux的单位为KB，macOS为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(config):
+    """在子进程中执行：解析Excel并下载全部链接，返回测量结果"""
+    from download_job import STATUS_DOWNLOADED, STATUS_FAILED, WorkbookDownload
+    from excel_reader import ExcelUrlReader
+    from rate_limiter import HostLimit, HostRateLimiter
+
+    start = time.perf_counter()
+    with ExcelUrlReader(config['workbook']) as reader:
+        rows = sum(1 for _ in reader.iter_url_rows())
+    parse_seconds = time.perf_counter() - start
+
+    received = [0]
+
+    def on_result(result, status):
+        if status == STATUS_DOWNLOADED:
+            received[0] += result.size or 0
+
+    rate_limiter = HostRateLimiter(default=HostLimit(BENCHMARK_HOST_RATE, config['workers']))
+    download = WorkbookDownload(
+        config['workbook'], config['output'], workers=config['workers'], rate_limiter=rate_limiter,
+        segments=config['segments'], segment_threshold=config['segment_threshold'], retries=config['retries']
+    )
+    start = time.perf_counter()
+    counts = download.run(on_result=on_result)
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'parse_seconds': parse_seconds,
+        'parse_rows_per_sec': rows / parse_seconds if parse_seconds else None,
+        'download_seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else None,
+        'mb_per_sec': received[0] / 1024 / 1024 / seconds if seconds else None,
+        'bytes': received[0],
+        'failed': counts[STATUS_FAILED],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(rows, origin, args):
+    """生成rows行的Excel，在新进程中下载，返回测量结果；子进程失败时抛出RuntimeError"""
+    with tempfile.TemporaryDirectory() as folder:
+        workbook = os.path.join(folder, "bench.xlsx")
+        make_workbook(workbook, rows, origin)
+        config = {
+            'workbook': workbook,
+            'output': os.path.join(folder, "out"),
+            'workers': args.workers,
+            'segments': args.segments,
+            'segment_threshold': DEFAULT_SEGMENT_THRESHOLD,
+            'retries': args.retries,
+        }
+        os.makedirs(config['output'])
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+            cwd=HERE, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            lines = process.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"退出码 {process.returncode}")
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['expected_bytes'] = origin.total_size(rows)
+    return result
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    按行数与基准结果逐项比较，返回 [(行数, 指标, 基准值, 本次值, 变化比例, 是否退化), ...]
+    变化比例为正表示变好
+    """
+    previous = {scenario['rows']: scenario for scenario in baseline.get('scenarios', [])}
+    changes = []
+    for scenario in results['scenarios']:
+        before = previous.get(scenario['rows'])
+        if before is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before.get(metric), scenario.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old if higher_is_better else (old - new) / old
+            changes.append((scenario['rows'], metric, old, new, change, change < -threshold))
+    return changes
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="在本机模拟的源站上测量下载吞吐量")
+    parser.add_argument(
+        '--rows', type=int, nargs='+', default=list(DEFAULT_ROWS),
+        help=f"Excel中的链接行数，可以写多个（默认{' '.join(map(str, DEFAULT_ROWS))}）",
+    )
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_WORKERS, help="并发数")
+    parser.add_argument('--segments', type=int, default=1, help="大文件分段数（默认1，不分段）")
+    parser.add_argument('--retries', type=int, default=3, help="临时性错误的重试次数")
+    parser.add_argument(
+        '--latency', type=float, default=DEFAULT_LATENCY, help=f"源站每个请求的延迟毫秒数（默认{DEFAULT_LATENCY:g}）"
+    )
+    parser.add_argument('--bandwidth', default='0', help="源站每个连接的速度上限，如 1M（默认不限）")
+    parser.add_argument(
+        '--sizes', default=DEFAULT_SIZES,
+        help=f"文件大小分布：64K、uniform:1K:1M 或 lognormal:中位数:sigma（默认{DEFAULT_SIZES}）",
+    )
+    parser.add_argument('--error-rate', type=float, default=0.0, help="源站返回503的请求比例，如 0.01")
+    parser.add_argument('--no-range', action='store_true', help="源站不支持Range请求")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="文件大小和内容的随机种子")
+    parser.add_argument('--json', help="把结果保存为JSON文件")
+    parser.add_argument('--compare', help="与之前保存的JSON结果比较，有指标退化时退出码为1")
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help=f"变差超过这个比例视为退化（默认{DEFAULT_THRESHOLD:g}）",
+    )
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.child:
+        print(json.dumps(run_scenario(json.loads(args.child))))
+        return 0
+    if not 0 <= args.error_rate < 1:
+        parser.error("出错比例必须在0到1之间")
+    try:
+        bandwidth = parse_rate(args.bandwidth)
+        parse_sizes(args.sizes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    settings = {
+        'workers': args.workers,
+        'segments': args.segments,
+        'retries': args.retries,
+        'latency_ms': args.latency,
+        'bandwidth': bandwidth,
+        'sizes': args.sizes,
+        'error_rate': args.error_rate,
+        'ranges': not args.no_range,
+        'seed': args.seed,
+    }
+    results = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'urllib3': urllib3.__version__,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'settings': settings,
+        'scenarios': [],
+    }
+    origin = SimulatedOrigin(
+        args.sizes, latency=args.latency / 1000, bandwidth=bandwidth, error_rate=args.error_rate,
+        ranges=not args.no_range, seed=args.seed
+    )
+    with origin:
+        for rows in args.rows:
+            try:
+                scenario = measure(rows, origin, args)
+            except RuntimeError as e:
+                print(f"{rows} 行: 测量失败（{e}）", file=sys.stderr)
+                return 1
+            results['scenarios'].append(scenario)
+            rss = scenario['peak_rss_mb']
+            print(
+                f"{rows} 行: 解析 {scenario['parse_seconds']:.2f} 秒（{scenario['parse_rows_per_sec']:.0f} 行/秒），"
+                f"下载 {scenario['download_seconds']:.2f} 秒，{scenario['rows_per_sec']:.1f} 行/秒，"
+                f"{scenario['mb_per_sec']:.1f} MB/s，失败 {scenario['failed']} 行"
+                + (f"，内存峰值 {rss:.0f} MB" if rss is not None else "")
+            )
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print("注意：基准结果的测试设置与本次不同，比较结果仅供参考")
+    if baseline.get('urllib3', results['urllib3']) != results['urllib3']:
+        print(f"注意：基准结果使用urllib3 {baseline['urllib3']}，本次为 {results['urllib3']}，流式写入的读取方式可能不同")
+    changes = compare(results, baseline, args.threshold)
+    if not changes:
+        print("基准结果中没有相同行数的测量，无法比较")
+        return 0
+    print(f"\n与 {args.compare}（{baseline.get('time', '?')}）比较：")
+    for rows, metric, old, new, change, regressed in changes:
+        print(f"  {rows} 行 {metric:<20} {old:10.2f} -> {new:10.2f}  {change:+.1%}" + ("  退化" if regressed else ""))
+    return 1 if any(change[-1] for change in changes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+启动时间基准测试
+在新进程中多次测量图形界面出现第一个窗口的时间和命令行可以开始工作的时间，
+并用 python -X importtime 统计各模块的导入耗时，便于发现启动变慢的改动
+
+    python benchmark_startup.py --runs 10 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 子进程在窗口显示出来（或命令行准备好）后输出这一行
+READY_MARKER = 'READY'
+
+# 创建主窗口并完成第一次绘制
+GUI_SCRIPT = f'''
+import tkinter as tk
+import download_rename_app
+root = tk.Tk()
+download_rename_app.DownloadRenameApp(root)
+root.update()
+print({READY_MARKER!r}, flush=True)
+root.destroy()
+'''
+
+# 解析参数，准备好开始下载
+CLI_SCRIPT = f'''
+import download_rename_cli
+download_rename_cli.build_parser()
+print({READY_MARKER!r}, flush=True)
+'''
+
+DEFAULT_RUNS = 5
+# 导入耗时明细中显示的包数
+DEFAULT_TOP = 15
+
+
+def time_to_ready(script):
+    """启动一个新的解释器执行script，返回从启动到输出READY的秒数；失败时抛出RuntimeError"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', script], cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    for line in process.stdout:
+        if line.strip() == READY_MARKER:
+            elapsed = time.perf_counter() - start
+            process.wait()
+            return elapsed
+    _, stderr = process.communicate()
+    lines = stderr.strip().splitlines()
+    raise RuntimeError(lines[-1] if lines else f"退出码 {process.returncode}")
+
+
+def measure(script, runs):
+    """返回多次测量的统计结果，无法运行时（如没有显示器）返回带error的结果"""
+    samples = []
+    try:
+        for _ in range(runs):
+            samples.append(time_to_ready(script))
+    except RuntimeError as e:
+        return {'error': str(e)}
+    return {
+        'runs': runs,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'max': max(samples),
+        'samples': samples,
+    }
+
+
+def import_breakdown(module, top=DEFAULT_TOP):
+    """
+    用 -X importtime 统计导入module的耗时，按顶层包合并各模块自身的耗时
+    返回 (总耗时秒数, [(包名, 秒数), ...])，按耗时从大到小排列
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=HERE, capture_output=True, text=True,
+    )
+    # 每行格式为 "import time: 自身微秒 | 累计微秒 | 缩进的模块名"，子模块先于导入它的模块输出
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name[1:]
+        entries.append((int(self_us), int(cumulative_us), name.strip(), len(name) - len(name.lstrip(' '))))
+
+    # 解释器启动时（如site）导入的模块不计入，只取module这一行及其之前的子模块
+    end = next(i for i, entry in enumerate(entries) if entry[2] == module and entry[3] == 0)
+    begin = end
+    while begin > 0 and entries[begin - 1][3] > 0:
+        begin -= 1
+
+    packages = {}
+    for self_us, _, name, _ in entries[begin:end + 1]:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_us / 1e6
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return entries[end][1] / 1e6, ranked[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量图形界面和命令行的启动时间")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help=f"每项测量的次数（默认{DEFAULT_RUNS}）")
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help="导入耗时明细显示的包数")
+    parser.add_argument('--json', help="把结果保存为JSON文件，便于比较不同版本")
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'first_window': measure(GUI_SCRIPT, args.runs),
+        'cli_ready': measure(CLI_SCRIPT, args.runs),
+        'imports': {},
+    }
+
+    for label, key in (("图形界面出现第一个窗口", 'first_window'), ("命令行准备就绪", 'cli_ready')):
+        stats = results[key]
+        if 'error' in stats:
+            print(f"{label}: 无法测量（{stats['error']}）")
+        else:
+            print(
+                f"{label}: 中位数 {stats['median'] * 1000:.0f} ms"
+                f"（最快 {stats['min'] * 1000:.0f} ms，最慢 {stats['max'] * 1000:.0f} ms，共 {stats['runs']} 次）"
+            )
+
+    for module in ('download_rename_app', 'download_rename_cli'):
+        total, ranked = import_breakdown(module, args.top)
+        results['imports'][module] = {'total': total, 'packages': dict(ranked)}
+        print(f"\n导入 {module} 共 {total * 1000:.1f} ms，耗时最多的包：")
+        for package, seconds in ranked:
+            print(f"  {package:<24} {seconds * 1000:8.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
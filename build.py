@@ -33,7 +33,7 @@ def install_dependencies():
 def build_windows():
     """构建Windows可执行文件"""
     print("正在构建Windows可执行文件...")
-    run_command("pyinstaller --onefile --windowed --name download_rename_app download_rename_app.py")
+    run_command("pyinstaller --onefile --windowed --exclude-module pandas --exclude-module numpy --name download_rename_app download_rename_app.py")
     
     # 检查输出文件
     exe_path = "dist/download_rename_app.exe"
@@ -48,7 +48,7 @@ def build_macos():
     print("正在构建macOS应用程序包...")
     
     # 构建可执行文件
-    run_command("pyinstaller --onefile --windowed --name download_rename_app download_rename_app.py")
+    run_command("pyinstaller --onefile --windowed --exclude-module pandas --exclude-module numpy --name download_rename_app download_rename_app.py")
     
     # 创建.app包
     app_name = "download_rename_app.app"
@@ -101,7 +101,7 @@ def build_macos():
 def build_linux():
     """构建Linux可执行文件"""
     print("正在构建Linux可执行文件...")
-    run_command("pyinstaller --onefile --windowed --name download_rename_app download_rename_app.py")
+    run_command("pyinstaller --onefile --windowed --exclude-module pandas --exclude-module numpy --name download_rename_app download_rename_app.py")
     
     # 检查输出文件
     exe_path = "dist/download_rename_app"
@@ -79,7 +79,6 @@ a = Analysis(
     binaries=[],
     datas=[],
     hiddenimports=[
-        'pandas',
         'openpyxl',
         'xlrd',
         'requests',
@@ -95,7 +94,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={{}},
     runtime_hooks=[],
-    excludes=[],
+    # 程序不使用pandas/numpy，排除后单文件包更小，解压和启动更快
+    excludes=['pandas', 'numpy'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -144,7 +144,6 @@ a = Analysis(
     binaries=[],
     datas=[],
     hiddenimports=[
-        'pandas',
         'openpyxl',
         'xlrd',
         'requests',
@@ -160,7 +159,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={{}},
     runtime_hooks=[],
-    excludes=[],
+    # 程序不使用pandas/numpy，排除后单文件包更小，解压和启动更快
+    excludes=['pandas', 'numpy'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -229,7 +229,6 @@ a = Analysis(
     binaries=[],
     datas=[],
     hiddenimports=[
-        'pandas',
         'openpyxl',
         'xlrd',
         'requests',
@@ -245,7 +244,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={{}},
     runtime_hooks=[],
-    excludes=[],
+    # 程序不使用pandas/numpy，排除后单文件包更小，解压和启动更快
+    excludes=['pandas', 'numpy'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+校验和
+下载时在写文件的同一个循环中计算摘要，不需要下载完成后再读一遍文件；
+表格中有校验列时与下载内容比对，不一致的行删除已下载的内容后重试
+"""
+
+import hashlib
+import re
+
+# 默认记录的摘要算法
+DEFAULT_ALGORITHM = 'sha256'
+# 可选的摘要算法
+ALGORITHMS = ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512', 'blake2b', 'blake2s')
+# 只有十六进制值、列名也没有写明算法时，按长度判断算法
+ALGORITHMS_BY_LENGTH = {32: 'md5', 40: 'sha1', 56: 'sha224', 64: 'sha256', 96: 'sha384', 128: 'sha512'}
+# 读取已有文件计算摘要时每次读取的字节数
+READ_CHUNK = 1024 * 1024
+
+_VALUE_PATTERN = re.compile(r'^(?:([a-z0-9-]+)\s*[:=]\s*)?([0-9a-f]+)$')
+
+
+class ChecksumMismatch(Exception):
+    """下载内容与校验值不一致；属于临时性错误，会重试"""
+
+
+def normalize_algorithm(name):
+    """把 "SHA-256"、"sha_256" 等写法转换为hashlib的算法名，不是支持的算法时返回None"""
+    name = re.sub(r'[-_\s]', '', str(name).lower())
+    return name if name in ALGORITHMS else None
+
+
+def algorithm_in_name(column):
+    """列名中写明的算法（如 "SHA256校验"），没有时返回None"""
+    name = re.sub(r'[-_\s]', '', str(column).lower())
+    # 长的算法名先匹配，sha256不会被当作sha2xx以外的算法
+    for algorithm in sorted(ALGORITHMS, key=len, reverse=True):
+        if algorithm in name:
+            return algorithm
+    return None
+
+
+def parse_checksum(value, algorithm=None):
+    """
+    把校验列的值解析为 (算法, 十六进制摘要)，空白返回None
+    值可以写成 "sha256:ab12..."，也可以只写摘要，此时使用列名中的算法algorithm，没有则按长度判断；
+    无法识别的值返回 ('', 原值)，下载该行时报错
+    """
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if not text:
+        return None
+    match = _VALUE_PATTERN.match(text)
+    if not match:
+        return '', str(value).strip()
+    prefix, digest = match.groups()
+    if prefix:
+        algorithm = normalize_algorithm(prefix)
+    if not algorithm:
+        algorithm = ALGORITHMS_BY_LENGTH.get(len(digest))
+    if not algorithm or len(digest) != hashlib.new(algorithm).digest_size * 2:
+        return '', str(value).strip()
+    return algorithm, digest
+
+
+def format_digest(algorithm, digest):
+    return f"{algorithm}:{digest}"
+
+
+class Digests:
+    """同时计算多个算法的摘要，接口与hashlib的摘要对象相同（update），可直接传给stream_to_file"""
+
+    def __init__(self, algorithms):
+        self._hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms if algorithm}
+
+    def update(self, data):
+        for hasher in self._hashers.values():
+            hasher.update(data)
+
+    def update_from_file(self, path):
+        """把已有文件的内容计入摘要（续传时已下载的部分、分段下载的文件）"""
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                self.update(chunk)
+
+    def hexdigest(self, algorithm):
+        return self._hashers[algorithm].hexdigest()
+
+    def verify(self, checksum):
+        """与 (算法, 摘要) 比对，不一致时抛出ChecksumMismatch"""
+        algorithm, expected = checksum
+        actual = self.hexdigest(algorithm)
+        if actual != expected:
+            raise ChecksumMismatch(f"校验失败：{algorithm} 应为 {expected}，实际为 {actual}")
+
+
+def file_digests(path, algorithms):
+    """读取文件计算摘要，返回Digests"""
+    digests = Digests(algorithms)
+    digests.update_from_file(path)
+    return digests
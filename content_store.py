@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+按内容去重的文件存储
+下载完成的文件按SHA-256存入下载文件夹的 .objects 目录，内容相同的文件只在磁盘上保留一份（硬链接）
+"""
+
+import os
+import shutil
+import threading
+
+# 对象存储目录名，保存在下载文件夹中
+STORE_DIRNAME = '.objects'
+HASH_ALGORITHM = 'sha256'
+
+
+def link_or_copy(source, target, durability=None):
+    """
+    把source以硬链接放到target，文件系统不支持硬链接时复制；target已存在时原子替换
+    durability（durability.DurabilityPolicy）不为None时按它的落盘策略重命名
+    """
+    tmp = target + '.part'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    if durability:
+        durability.replace(tmp, target)
+    else:
+        os.replace(tmp, target)
+
+
+class ContentStore:
+    """按内容摘要保存的对象存储，同一摘要的文件都硬链接到同一个对象"""
+
+    def __init__(self, download_folder):
+        self.root = os.path.join(download_folder, STORE_DIRNAME)
+        self._lock = threading.Lock()
+        # 因内容重复而节省的字节数
+        self.saved_bytes = 0
+        self.deduplicated = 0
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def adopt(self, path, digest):
+        """
+        把刚下载的文件登记到存储中
+        已有相同内容时用指向已有对象的硬链接替换它并返回True；否则把它登记为新对象并返回False
+        """
+        obj = self.object_path(digest)
+        try:
+            with self._lock:
+                if not os.path.exists(obj):
+                    os.makedirs(os.path.dirname(obj), exist_ok=True)
+                    os.link(path, obj)
+                    return False
+                if os.path.samefile(obj, path):
+                    return False
+                size = os.path.getsize(path)
+                tmp = path + '.part'
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                os.link(obj, tmp)
+                os.replace(tmp, path)
+                self.saved_bytes += size
+                self.deduplicated += 1
+                return True
+        except OSError:
+            # 文件系统不支持硬链接时不做去重，保留原文件
+            return False
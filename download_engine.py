@@ -0,0 +1,949 @@
+#!/usr/bin/env python3
+"""
+下载引擎
+使用有界线程池并发下载链接，并按照 Excel文件名_序号 的格式重命名
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from checksum import DEFAULT_ALGORITHM, ChecksumMismatch, Digests, file_digests, format_digest
+from content_store import HASH_ALGORITHM, link_or_copy
+from durability import DurabilityPolicy
+from http_pool import PooledSession
+from rate_limiter import HostRateLimiter
+from retry_policy import (
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, CircuitBreaker, error_status, is_host_failure,
+    is_transient, retry_delay
+)
+from stall_watchdog import DEFAULT_MIN_RATE, DEFAULT_STALL_WINDOW, StallWatchdog
+from stream_writer import is_encoded, preallocate, stream_to_file
+from transfer_timing import TransferTiming
+
+# 默认并发下载数
+DEFAULT_WORKERS = 4
+# 并发下载数上限
+MAX_WORKERS = 64
+# 调度时向前查看的任务数（相对并发数的倍数），用于在某个主机受限时先派发其他主机的任务
+LOOKAHEAD_FACTOR = 8
+# 没有在途任务又无法派发时的轮询间隔（秒）
+IDLE_POLL = 0.1
+# 解析线程与下载之间队列的容量，队列满时解析线程等待
+DEFAULT_FEED_SIZE = 1000
+# 记住最近完成的这么多个URL，之后重复出现的行直接复用文件；更早的URL再出现时重新下载（有条件请求缓存时通常只是一次304），
+# 内存占用不随表格行数增长
+FINISHED_URL_LIMIT = 10000
+# 分段下载：默认不分段；超过该大小（字节）且服务器支持Range的文件分成多段并行下载
+DEFAULT_SEGMENTS = 1
+MAX_SEGMENTS = 16
+DEFAULT_SEGMENT_THRESHOLD = 64 * 1024 * 1024
+# 有镜像时，主链接超过这么多秒还没有响应就同时请求镜像（对冲请求），0表示只在主链接失败后才用镜像
+DEFAULT_HEDGE_DELAY = 2.0
+# 每一段连接中断后的重试次数，重试从该段已写入的位置继续
+SEGMENT_RETRIES = 3
+SEGMENT_RETRY_DELAY = 1.0
+
+
+def guess_extension(content_type, url):
+    """根据Content-Type或URL推断文件扩展名"""
+    if 'image' in content_type:
+        return '.jpg' if 'jpeg' in content_type else '.png'
+    if 'pdf' in content_type:
+        return '.pdf'
+    if 'zip' in content_type:
+        return '.zip'
+    if 'excel' in content_type or 'spreadsheet' in content_type:
+        return '.xlsx'
+
+    # 尝试从URL获取扩展名
+    path = urlparse(url).path
+    if '.' in path:
+        return os.path.splitext(path)[1]
+    return '.txt'
+
+
+def build_filename(excel_filename, index, ext):
+    """生成新文件名：Excel文件名_序号.扩展名"""
+    return f"{excel_filename}_{index:03d}{ext}"
+
+
+def response_validator(response):
+    """取响应的强ETag或Last-Modified，用于续传时确认文件未变化"""
+    etag = response.headers.get('etag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('last-modified', '')
+
+
+def response_length(response):
+    """响应体的字节数，压缩或未声明长度时返回None"""
+    length = response.headers.get('content-length', '')
+    if not length.isdigit() or is_encoded(response):
+        return None
+    return int(length)
+
+
+def content_range_start(response):
+    """解析206响应Content-Range的起始位置，无法解析时返回None"""
+    value = response.headers.get('content-range', '')
+    try:
+        unit, _, spec = value.partition(' ')
+        if unit.strip().lower() != 'bytes':
+            return None
+        return int(spec.split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+class DownloadTask:
+    """Excel中一行对应的下载任务"""
+
+    def __init__(self, index, url, priority=0, mirrors=(), checksum=None):
+        self.index = index
+        self.url = url
+        # 当前请求的链接和它的主机：主链接无法访问时切换为镜像，url仍用于下载日志和重复链接判断
+        self.source = url
+        self.host = urlparse(url).hostname or ''
+        # 还没有切换过去的镜像链接
+        self.mirrors = tuple(mirrors)
+        # 表格中的校验值 (算法, 十六进制摘要)，可为None
+        self.checksum = checksum
+        # 优先级，越大越先派发（Excel优先级列的值）
+        self.priority = priority
+        # 已重试的次数，以及退避结束前不再派发的时间（time.monotonic）
+        self.attempts = 0
+        self.not_before = 0.0
+
+    def fail_over(self):
+        """改用下一个镜像，没有镜像时返回False"""
+        if not self.mirrors:
+            return False
+        self.source, self.mirrors = self.mirrors[0], self.mirrors[1:]
+        self.host = urlparse(self.source).hostname or ''
+        return True
+
+
+def _is_host_down(response, error):
+    """请求结果说明主机无法正常服务（连不上、超时、5xx）"""
+    if error is not None:
+        return is_host_failure(error)
+    return response is not None and response.status_code >= 500
+
+
+class _SegmentAborted(Exception):
+    """分段下载中另一段已经失败，这一段不再继续"""
+
+
+class _Attempt:
+    """
+    一次下载实际使用的主机：对冲请求由镜像胜出时为镜像主机，镜像的在途名额记在held中，下载结束后归还
+    timing记录这次下载各阶段的耗时
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.held = []
+        self.timing = TransferTiming(host)
+
+    def finish_timing(self, task):
+        """下载结束时补全计时的主机和重试次数"""
+        self.timing.host = self.host
+        self.timing.retries = task.attempts
+        return self.timing
+
+
+class DownloadResult:
+    """单行下载结果"""
+
+    def __init__(self, task, filename=None, error=None, skipped=False, size=None, unchanged=False,
+                 duplicate_of=None, retry_after=None, timing=None, digest=None):
+        self.task = task
+        self.filename = filename
+        self.error = error
+        self.size = size
+        # 此前已经下载完成，本次跳过
+        self.skipped = skipped
+        # 服务器返回304，文件自上次下载后没有变化
+        self.unchanged = unchanged
+        # 与同一批中另一行的URL相同时为那一行的序号，文件由那一行的下载结果链接或复制而来
+        self.duplicate_of = duplicate_of
+        # 临时性错误，这么多秒后重试；引擎内部使用，报告出去的结果都为None
+        self.retry_after = retry_after
+        # 最后一次请求各阶段的耗时（transfer_timing.TransferTiming），没有发出请求的行为None
+        self.timing = timing
+        # 文件内容的摘要（"算法:十六进制"），未计算时为None
+        self.digest = digest
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+class _IterSource:
+    """把普通可迭代对象包装成与TaskFeed相同的取任务接口"""
+
+    def __init__(self, iterable):
+        self._iter = iter(iterable)
+        self.exhausted = False
+
+    def poll(self):
+        task = next(self._iter, None)
+        if task is None:
+            self.exhausted = True
+        return task
+
+
+class TaskFeed:
+    """
+    在后台线程中运行任务生成器（例如逐行解析Excel），通过有界队列把任务交给下载引擎
+    队列满时生成器暂停，内存占用不随表格行数增长；下载在解析进行中即可开始
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable, maxsize=DEFAULT_FEED_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._closed = threading.Event()
+        # 已产出的任务数；解析结束后即为任务总数
+        self.produced = 0
+        self.finished = False
+        self.exhausted = False
+        self.error = None
+        self._thread = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        self._thread.start()
+
+    @property
+    def total(self):
+        """解析结束后返回任务总数，解析中返回None"""
+        return self.produced if self.finished else None
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=IDLE_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for task in iterable:
+                if not self._put(task):
+                    return
+                self.produced += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._put(self._DONE)
+
+    def poll(self):
+        """取出一个任务，暂时没有任务时返回None；全部取完后exhausted为True"""
+        if self.exhausted:
+            return None
+        try:
+            item = self._queue.get_nowait()
+        except queue.Empty:
+            return None
+        if item is self._DONE:
+            self.exhausted = True
+            return None
+        return item
+
+    def close(self):
+        """停止解析线程"""
+        self._closed.set()
+
+
+class DownloadEngine:
+    """并发下载引擎"""
+
+    def __init__(self, download_folder, excel_filename, workers=DEFAULT_WORKERS,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), session=None, rate_limiter=None, journal=None,
+                 metadata_cache=None, content_store=None, budget=None, segments=DEFAULT_SEGMENTS,
+                 segment_threshold=DEFAULT_SEGMENT_THRESHOLD, bandwidth=None, priority=0, small_first=False,
+                 retries=DEFAULT_RETRIES, breaker=None, min_rate=DEFAULT_MIN_RATE, stall_window=DEFAULT_STALL_WINDOW,
+                 hedge_delay=DEFAULT_HEDGE_DELAY, checksum_algorithm=DEFAULT_ALGORITHM, durability=None):
+        self.download_folder = download_folder
+        self.excel_filename = excel_filename
+        self.workers = min(max(1, int(workers)), MAX_WORKERS)
+        # 秒数，或 (连接超时, 读取超时)
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        # 临时性错误的重试次数，以及按主机熔断（可与其他引擎共享）
+        self.retries = max(0, int(retries))
+        self.breaker = breaker or CircuitBreaker()
+        # 连续stall_window秒平均速度低于min_rate（字节/秒）的传输被断开重试，min_rate为0时不监测
+        self.watchdog = StallWatchdog(min_rate, stall_window)
+        self.hedge_delay = hedge_delay
+        # 下载日志（DownloadJournal），用于跳过已完成的行和断点续传，可为None
+        self.journal = journal
+        # URL元数据缓存（MetadataCache），用于条件请求，可为None
+        self.metadata_cache = metadata_cache
+        # 按内容去重的存储（ContentStore），可为None
+        self.content_store = content_store
+        # 下载时计算并记录的摘要算法，None表示只在需要校验或去重时计算
+        self.checksum_algorithm = checksum_algorithm
+        # 完成的文件重命名到位时的落盘策略（durability.DurabilityPolicy，可与其他引擎共享）
+        self.durability = durability or DurabilityPolicy()
+        # 与其他下载引擎共享的并发名额（batch_queue.WorkerBudget），可为None
+        self.budget = budget
+        # 大文件分段下载的段数，1表示不分段
+        self.segments = min(max(1, int(segments)), MAX_SEGMENTS)
+        self.segment_threshold = segment_threshold
+        # 全局带宽限制（bandwidth.BandwidthLimiter），可为None
+        self.bandwidth = bandwidth
+        # 工作簿的优先级，与其他引擎共享并发名额和带宽时越大越优先，可在运行中修改
+        self.priority = priority
+        # 带宽受限时先传输剩余字节少的文件
+        self.small_first = small_first
+        # 未传入共享会话时自建一个，连接池大小与并发数（分段时乘以段数）一致
+        self._owns_session = session is None
+        self.session = session or PooledSession(pool_size=self.workers * self.segments)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """停止派发新的下载任务，已在进行中的任务会继续完成"""
+        self._cancel.set()
+
+    def set_priority(self, priority):
+        """修改工作簿优先级，正在运行时对之后的并发名额分配和带宽分配生效"""
+        self.priority = priority
+        if self.budget:
+            self.budget.set_priority(self, priority)
+
+    def download_one(self, task):
+        """
+        下载单个文件，出错时返回带错误信息的结果而不抛出异常；临时性错误还有重试次数时返回带retry_after的结果
+        调用前必须已通过rate_limiter为任务的主机占用名额，结束时在这里归还
+        """
+        host = task.host
+        attempt = _Attempt(host)
+        try:
+            result = self._fetch(task, attempt)
+            self.breaker.record_success(attempt.host)
+            if self.journal:
+                self.journal.mark_done(task.index, task.url, result.filename, result.size, result.digest)
+            result.timing = attempt.finish_timing(task)
+            return result
+
+        except Exception as e:
+            if is_host_failure(e):
+                self.breaker.record_failure(attempt.host)
+            elif error_status(e) is not None:
+                # 主机有响应（如404），说明主机本身正常
+                self.breaker.record_success(attempt.host)
+            if (is_transient(e) or error_status(e) is not None) and task.fail_over():
+                # 还有镜像：立即改用镜像重新排队，不计入重试次数
+                return DownloadResult(task, error=str(e), retry_after=0.0)
+            if task.attempts < self.retries and is_transient(e):
+                # 已下载的部分保留在 .part 文件中，重试时续传
+                delay = retry_delay(e, task.attempts + 1)
+                task.attempts += 1
+                task.not_before = time.monotonic() + delay
+                return DownloadResult(task, error=str(e), retry_after=delay)
+            result = self._fail(task, str(e) + (f"（已重试 {task.attempts} 次）" if task.attempts else ""))
+            result.timing = attempt.finish_timing(task)
+            return result
+
+        finally:
+            self.rate_limiter.release(host)
+            for held in attempt.held:
+                self.rate_limiter.release(held)
+            if self.budget:
+                self.budget.release(self)
+
+    def _fail(self, task, error):
+        if self.journal:
+            self.journal.mark_failed(task.index, task.url, error)
+        return DownloadResult(task, error=error)
+
+    def _open(self, url, offset, validator, cached=None):
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if validator:
+                # 文件已变化时服务器会返回完整的200响应而不是206
+                headers['If-Range'] = validator
+        elif cached is not None:
+            # 文件未变化时服务器返回304，不需要重新传输
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        return self.session.get(url, stream=True, timeout=self.timeout, headers=headers)
+
+    def _open_hedged(self, task, attempt, cached):
+        """
+        请求task.source；有镜像时，超过hedge_delay秒还没有收到响应头或者请求失败，就同时请求下一个镜像，
+        先收到正常响应的胜出，其余请求的响应到达后直接关闭；都失败时按主链接的结果报错
+        """
+        if not task.mirrors or not self.hedge_delay:
+            return self._open(task.source, 0, None, cached)
+
+        outcomes = queue.Queue()
+        lock = threading.Lock()
+        decided = []
+
+        def discard(mirror, url, host, response, error):
+            if response is not None:
+                response.close()
+            if mirror:
+                # 镜像请求自己占用的名额
+                self.rate_limiter.release(host)
+
+        def request(mirror, url, host):
+            try:
+                outcome = (mirror, url, host, self._open(url, 0, None, cached), None)
+            except Exception as e:
+                outcome = (mirror, url, host, None, e)
+            with lock:
+                if not decided:
+                    outcomes.put(outcome)
+                    return
+            # 已有请求胜出：落败的请求到达后关闭，不读取响应体
+            discard(*outcome)
+
+        def start_mirror():
+            """向下一个可用的镜像发出请求，跳过已熔断的镜像；镜像主机名额用满时这次不发出，返回0"""
+            while mirrors:
+                host = urlparse(mirrors[0]).hostname or ''
+                if not self.breaker.allow(host):
+                    mirrors.pop(0)
+                    continue
+                if not self.rate_limiter.try_acquire(host)[0]:
+                    self.breaker.cancel_probe(host)
+                    return 0
+                threading.Thread(target=request, args=(True, mirrors.pop(0), host), daemon=True).start()
+                return 1
+            return 0
+
+        mirrors = list(task.mirrors)
+        threading.Thread(target=request, args=(False, task.source, task.host), daemon=True).start()
+        running = 1
+        primary = None
+        winner = None
+        deadline = time.monotonic() + self.hedge_delay
+        while running:
+            try:
+                outcome = outcomes.get(timeout=max(0.0, deadline - time.monotonic()) if mirrors else None)
+            except queue.Empty:
+                # 主链接在等待时间内没有响应：对冲请求镜像
+                running += start_mirror()
+                deadline = time.monotonic() + self.hedge_delay
+                continue
+            running -= 1
+            mirror, url, host, response, error = outcome
+            if response is not None and response.ok:
+                winner = outcome
+                break
+            if not mirror:
+                primary = outcome
+            else:
+                if _is_host_down(response, error):
+                    self.breaker.record_failure(host)
+                discard(*outcome)
+            # 请求失败：不再等待，立即请求下一个镜像
+            running += start_mirror()
+            deadline = time.monotonic() + self.hedge_delay
+
+        with lock:
+            decided.append(True)
+        while not outcomes.empty():
+            discard(*outcomes.get_nowait())
+
+        if winner is None:
+            # 已经请求过的镜像不再切换过去
+            task.mirrors = tuple(mirrors)
+            mirror, url, host, response, error = primary
+            if error is not None:
+                raise error
+            return response
+        mirror, url, host, response, error = winner
+        if mirror:
+            # 镜像胜出：下载计入镜像主机，名额在下载结束后归还，中断后从这个镜像续传；主链接已失败时计入熔断
+            attempt.host = host
+            attempt.held.append(host)
+            if primary is not None:
+                if _is_host_down(*primary[3:]):
+                    self.breaker.record_failure(task.host)
+                if primary[3] is not None:
+                    primary[3].close()
+            task.source, task.host = url, host
+            task.mirrors = tuple(m for m in task.mirrors if m != url)
+        return response
+
+    def _fetch(self, task, attempt):
+        """
+        下载到 .part 临时文件，完成后重命名为最终文件名
+        日志中有同一URL的未完成记录时用Range请求从断点继续；URL下载过且本地文件仍在时先发条件请求
+        """
+        if task.checksum and not task.checksum[0]:
+            raise ValueError(f"无法识别校验值 '{task.checksum[1]}'")
+        part_path = os.path.join(self.download_folder, build_filename(self.excel_filename, task.index, '.part'))
+        offset = 0
+        validator = None
+        if os.path.exists(part_path):
+            validator = self.journal.partial_validator(task.index, task.url) if self.journal else None
+            if validator is None:
+                os.remove(part_path)
+            else:
+                offset = os.path.getsize(part_path)
+
+        cached = None
+        if not offset and self.metadata_cache:
+            cached = self.metadata_cache.get(task.url)
+
+        if offset:
+            response = self._open(task.source, offset, validator)
+        else:
+            response = self._open_hedged(task, attempt, cached)
+        if offset and response.status_code == 416:
+            # 服务器不接受断点位置，从头下载
+            response.close()
+            offset = 0
+            response = self._open(task.source, 0, None)
+        timing = attempt.timing
+        timing.record_response(response)
+
+        # 使用with确保连接在出错时也能归还连接池
+        with response:
+            if cached is not None and response.status_code == 304:
+                return self._reuse_cached(task, cached, part_path)
+            response.raise_for_status()
+
+            resumed = bool(offset) and response.status_code == 206 and content_range_start(response) == offset
+            if not resumed:
+                offset = 0
+                if self.journal:
+                    self.journal.mark_started(task.index, task.url, response_validator(response))
+
+            ext = guess_extension(response.headers.get('content-type', ''), task.url)
+            new_filename = build_filename(self.excel_filename, task.index, ext)
+
+            segments = 1 if resumed else self._segment_count(attempt.host, response)
+            # 第一段使用本次下载已占用的名额，其余各段另外占用该主机的名额，名额不够时减少段数
+            extra = self._acquire_slots(attempt.host, segments - 1)
+            if extra:
+                # 大文件：放弃这个响应，改为多个连接并行下载各段（请求实际响应的链接）
+                response.close()
+                size = int(response.headers['content-length'])
+                began = time.perf_counter()
+                try:
+                    self._fetch_segments(
+                        task, response.url, part_path, size, 1 + extra, response_validator(response), timing
+                    )
+                finally:
+                    for _ in range(extra):
+                        self.rate_limiter.release(attempt.host)
+                timing.add('transfer', time.perf_counter() - began)
+                timing.bytes = size
+                # 各段不是按顺序到达的，下载完成后读取文件计算摘要
+                digests = self._new_digests(task, part_path)
+            else:
+                digests = self._new_digests(task, part_path if resumed else None)
+                # 保存文件：续传时从断点位置继续写（不用追加模式，预分配的空间不会被跳过）
+                with self.watchdog.watch(response) as transfer, open(part_path, 'r+b' if resumed else 'wb') as f:
+                    f.seek(offset)
+                    on_read = self._on_read(task, transfer, response_length(response))
+                    began = time.perf_counter()
+                    disk = timing.phases['disk']
+                    try:
+                        size = offset + stream_to_file(response, f, digests, on_read=on_read, timing=timing)
+                    finally:
+                        # 传输时间不含写文件和等待带宽的时间
+                        elapsed = time.perf_counter() - began
+                        timing.add('throttle', transfer.throttled)
+                        timing.add('transfer', elapsed - transfer.throttled - (timing.phases['disk'] - disk))
+                        timing.bytes = f.tell() - offset
+
+            etag = response.headers.get('etag', '')
+            last_modified = response.headers.get('last-modified', '')
+
+        if task.checksum:
+            try:
+                digests.verify(task.checksum)
+            except ChecksumMismatch:
+                # 内容有误，不能续传，重试时重新下载
+                os.remove(part_path)
+                raise
+        digest = self._digest(digests)
+
+        file_path = os.path.join(self.download_folder, new_filename)
+        began = time.perf_counter()
+        # 写完后才原子重命名为最终文件名，写磁盘的时间包含落盘策略要求的fsync
+        self.durability.replace(part_path, file_path)
+        timing.add('disk', time.perf_counter() - began)
+        if self.content_store:
+            self.content_store.adopt(file_path, digests.hexdigest(HASH_ALGORITHM))
+        if self.metadata_cache:
+            self.metadata_cache.store(task.url, etag, last_modified, size, new_filename, digest)
+        return DownloadResult(task, filename=new_filename, size=size, digest=digest)
+
+    def _segment_count(self, host, response):
+        """
+        返回分段数，不分段时为1
+        只对超过阈值、长度已知、未压缩且声明 Accept-Ranges: bytes 的完整响应分段；
+        段数不超过该主机的最大并发数，实际段数还取决于下载时该主机空闲的名额（见_acquire_slots）
+        """
+        if self.segments < 2 or response.status_code != 200 or is_encoded(response):
+            return 1
+        if response.headers.get('accept-ranges', '').lower() != 'bytes':
+            return 1
+        length = response.headers.get('content-length', '')
+        if not length.isdigit() or int(length) < self.segment_threshold:
+            return 1
+        return min(self.segments, self.rate_limiter.limit_for(host).max_in_flight)
+
+    def _acquire_slots(self, host, count):
+        """为分段下载的其余各段向主机限速器占用最多count个名额（不等待），返回占用到的个数"""
+        acquired = 0
+        while acquired < count and self.rate_limiter.try_acquire(host)[0]:
+            acquired += 1
+        return acquired
+
+    def _fetch_segments(self, task, url, part_path, length, count, validator, timing=None):
+        """
+        把文件分成count段并行下载，各段写入 .part 文件中各自的位置；失败时删除不完整的 .part 文件
+        一段失败时其余各段立即停止、未开始的不再开始，不必等它们下载完各自的范围
+        """
+        bounds = [(i * length // count, (i + 1) * length // count) for i in range(count)]
+        abort = threading.Event()
+        try:
+            with open(part_path, 'wb') as f:
+                preallocate(f, length)
+                f.truncate(length)
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                futures = [
+                    pool.submit(self._fetch_segment, task, url, part_path, start, end, validator, timing, abort)
+                    for start, end in bounds
+                ]
+                done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                if pending:
+                    abort.set()
+                    for future in pending:
+                        future.cancel()
+                # 停止前已经失败的段抛出的才是真正的原因
+                for future in done:
+                    future.result()
+        except BaseException:
+            # 各段之间有空洞，不能按文件大小续传
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def _fetch_segment(self, task, url, part_path, start, end, validator, timing=None, abort=None):
+        """下载 [start, end) 这一段，连接出错时从这一段已写入的位置重试；abort被设置时抛出_SegmentAborted"""
+        abort = abort or threading.Event()
+        position = start
+        failures = 0
+        while position < end:
+            if abort.is_set():
+                raise _SegmentAborted()
+            headers = {'Range': f'bytes={position}-{end - 1}'}
+            if validator:
+                # 文件在下载过程中变化时服务器返回200，不会把新旧内容拼在一起
+                headers['If-Range'] = validator
+            error = None
+            progressed = False
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+                    if response.status_code != 206 or content_range_start(response) != position:
+                        raise ValueError(f"分段下载失败：服务器对Range请求返回 {response.status_code}")
+                    with self.watchdog.watch(response) as transfer, open(part_path, 'r+b') as f:
+                        f.seek(position)
+                        try:
+                            on_read = self._on_read(task, transfer, end - position, abort)
+                            stream_to_file(response, f, truncate=False, on_read=on_read, timing=timing)
+                        finally:
+                            progressed = f.tell() > position
+                            position = f.tell()
+                            if timing:
+                                timing.add('throttle', transfer.throttled)
+            except ValueError:
+                raise
+            except Exception as e:
+                error = e
+            if abort.is_set():
+                raise _SegmentAborted()
+            if position < end and not progressed:
+                failures += 1
+                if failures > SEGMENT_RETRIES:
+                    raise error or ValueError("分段下载失败：连接提前结束")
+                abort.wait(SEGMENT_RETRY_DELAY * failures)
+
+    def _on_read(self, task, transfer, length=None, abort=None):
+        """
+        返回传给stream_to_file的回调：记录收到的字节数供停滞监测，设置了带宽限制时等待带宽（等待时间不计入速度）
+        等待带宽时依次比较工作簿优先级、行优先级，优先小文件时再比较剩余字节数（长度未知的排在最后）
+        abort不为None时，它被设置后下一次回调抛出_SegmentAborted，中止这次读取
+        """
+        remaining = [length]
+
+        def on_read(count):
+            if abort is not None and abort.is_set():
+                raise _SegmentAborted()
+            transfer.add(count)
+            if not self.bandwidth:
+                return
+            if remaining[0] is not None:
+                remaining[0] -= count
+            size_rank = 0
+            if self.small_first:
+                size_rank = float('-inf') if remaining[0] is None else -remaining[0]
+            transfer.begin_wait()
+            try:
+                self.bandwidth.consume(count, (self.priority, task.priority, size_rank))
+            finally:
+                transfer.end_wait()
+
+        return on_read
+
+    def _reuse_cached(self, task, cached, part_path):
+        """URL未变化：沿用上次下载的文件，上次保存的文件名与本行不同时复制一份"""
+        digest = cached.digest
+        if task.checksum:
+            try:
+                digest = self._verify_file(task, cached.filename, digest)
+            except ChecksumMismatch:
+                # 本地文件与校验值不符：不再信任缓存，重试时完整下载
+                self.metadata_cache.forget(task.url)
+                raise
+        new_filename = build_filename(self.excel_filename, task.index, os.path.splitext(cached.filename)[1])
+        if new_filename != cached.filename:
+            link_or_copy(
+                os.path.join(self.download_folder, cached.filename), os.path.join(self.download_folder, new_filename),
+                self.durability,
+            )
+            self.metadata_cache.forget_file(new_filename)
+        return DownloadResult(task, filename=new_filename, size=cached.size, unchanged=True, digest=digest)
+
+    def _new_digests(self, task, existing_path=None):
+        """
+        返回计算本行所需摘要的Digests：记录用的算法、校验值的算法、内容去重用的算法，都不需要时返回None
+        续传时先把已下载的部分计入摘要
+        """
+        algorithms = {self.checksum_algorithm, task.checksum[0] if task.checksum else None}
+        if self.content_store:
+            algorithms.add(HASH_ALGORITHM)
+        algorithms.discard(None)
+        if not algorithms:
+            return None
+        digests = Digests(algorithms)
+        if existing_path:
+            digests.update_from_file(existing_path)
+        return digests
+
+    def _digest(self, digests):
+        """记录在结果和下载日志中的摘要"""
+        if not self.checksum_algorithm:
+            return None
+        return format_digest(self.checksum_algorithm, digests.hexdigest(self.checksum_algorithm))
+
+    def _verify_file(self, task, filename, digest):
+        """
+        检查已有文件与本行的校验值是否一致，不一致时抛出ChecksumMismatch；返回文件的摘要
+        已知的摘要digest与校验值的算法相同时直接比较，否则读取文件计算
+        """
+        algorithm, expected = task.checksum
+        if digest and digest == format_digest(algorithm, expected):
+            return digest
+        if digest and digest.startswith(algorithm + ':'):
+            raise ChecksumMismatch(f"校验失败：{algorithm} 应为 {expected}，实际为 {digest.split(':', 1)[1]}")
+        algorithms = {algorithm, self.checksum_algorithm} - {None}
+        digests = file_digests(os.path.join(self.download_folder, filename), algorithms)
+        digests.verify(task.checksum)
+        return self._digest(digests) or digest
+
+    def _follow(self, task, leader):
+        """
+        URL与已下载的行相同：把那一行的文件链接或复制为本行的文件名；本行有校验值时检查那一行的文件
+        leader为那一行的 (序号, 文件名, 大小, 摘要)
+        """
+        index, filename, size, digest = leader
+        new_filename = build_filename(self.excel_filename, task.index, os.path.splitext(filename)[1])
+        try:
+            if task.checksum:
+                digest = self._verify_file(task, filename, digest)
+            if new_filename != filename:
+                link_or_copy(
+                    os.path.join(self.download_folder, filename),
+                    os.path.join(self.download_folder, new_filename),
+                    self.durability,
+                )
+                if self.metadata_cache:
+                    # 这个文件原来可能是别的URL下载的
+                    self.metadata_cache.forget_file(new_filename)
+        except (OSError, ChecksumMismatch) as e:
+            return DownloadResult(task, error=str(e), duplicate_of=index)
+        if self.journal:
+            self.journal.mark_done(task.index, task.url, new_filename, size, digest)
+        return DownloadResult(task, filename=new_filename, size=size, duplicate_of=index, digest=digest)
+
+    def run(self, tasks, on_result=None, collect_results=True):
+        """
+        并发执行下载任务，tasks可以是任务列表、生成器或TaskFeed
+        每完成一行就在调用线程中通过on_result回调报告结果；collect_results为True时返回全部结果列表，
+        处理大表格时可设为False，只通过回调统计，结果不在内存中累积
+        """
+        results = [] if collect_results else None
+        pending = set()
+        backlog = deque()
+        source = tasks if isinstance(tasks, TaskFeed) else _IterSource(tasks)
+        lookahead = self.workers * LOOKAHEAD_FACTOR
+        # 同一批中重复的URL只下载一次：waiting记录尚未完成的URL及等待它的行，
+        # finished按最近使用的顺序记录最近完成的FINISHED_URL_LIMIT个URL的 (序号, 文件名, 大小, 摘要)
+        waiting = {}
+        finished = OrderedDict()
+
+        def remember(result):
+            finished[result.task.url] = (result.task.index, result.filename, result.size, result.digest)
+            if len(finished) > FINISHED_URL_LIMIT:
+                finished.popitem(last=False)
+
+        def complete(result):
+            self._report(result, results, on_result)
+            if result.success:
+                remember(result)
+            for follower in waiting.pop(result.task.url, []):
+                if result.success:
+                    follow = self._follow(follower, finished[result.task.url])
+                else:
+                    follow = DownloadResult(follower, error=result.error, duplicate_of=result.task.index)
+                self._report(follow, results, on_result)
+
+        if self.budget:
+            self.budget.register(self, self.priority)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    while not source.exhausted and len(backlog) < lookahead:
+                        task = source.poll()
+                        if task is None:
+                            # 任务已取完，或者解析线程暂时还没有产出新任务
+                            break
+                        completed = self.journal.completed(task.index, task.url) if self.journal else None
+                        if completed:
+                            # 上次运行已完成的行直接跳过
+                            filename, digest = completed
+                            result = DownloadResult(task, filename=filename, skipped=True, digest=digest)
+                            if task.url not in finished:
+                                remember(result)
+                            self._report(result, results, on_result)
+                        elif task.url in finished:
+                            finished.move_to_end(task.url)
+                            self._report(self._follow(task, finished[task.url]), results, on_result)
+                        elif task.url in waiting:
+                            waiting[task.url].append(task)
+                        else:
+                            waiting[task.url] = []
+                            backlog.append(task)
+
+                    retry_after = None
+                    rejected = []
+                    if not self._cancel.is_set():
+                        retry_after = self._dispatch(backlog, executor, pending, rejected)
+                    for task in rejected:
+                        complete(self._fail(
+                            task, f"主机 {task.host} 连续 {self.breaker.failures(task.host)} 次失败，暂停访问"
+                        ))
+
+                    if not pending and (self._cancel.is_set() or (not backlog and source.exhausted)):
+                        break
+                    if retry_after is None and (not pending or (not source.exhausted and len(pending) < self.workers)):
+                        # 还有空闲线程时定期回来查看是否有新解析出的任务
+                        retry_after = IDLE_POLL
+
+                    if not pending:
+                        # 没有在途任务时wait()会立即返回，在这里等待受限主机的令牌或退避结束
+                        self._cancel.wait(retry_after)
+                        continue
+                    # 等待有任务完成，或者受限主机的下一个令牌可用
+                    done, pending = wait(pending, timeout=retry_after, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        if result.retry_after is not None:
+                            # 临时性错误或改用镜像：重新排队，退避结束前不会派发；同一URL的其他行继续等待
+                            backlog.append(result.task)
+                            continue
+                        complete(result)
+
+            if isinstance(source, TaskFeed) and source.error is not None:
+                # 解析中途出错，本批没有完整执行
+                raise source.error
+            if self.journal and not self._cancel.is_set():
+                # 整批正常结束，下次运行重新检查每一行
+                self.journal.finish()
+        finally:
+            # 中断或出错时也同步已完成的文件
+            self.durability.flush()
+            if self.budget:
+                self.budget.unregister(self)
+            if isinstance(source, TaskFeed):
+                source.close()
+            if self._owns_session:
+                self.session.close()
+
+        return results
+
+    def _report(self, result, results, on_result):
+        if results is not None:
+            results.append(result)
+        if on_result:
+            on_result(result)
+
+    def _dispatch(self, backlog, executor, pending, rejected):
+        """
+        按优先级（相同时按行的顺序）派发主机有空闲名额的任务，每个任务提交时都有空闲线程可立即执行
+        已熔断主机的任务移入rejected，由调用方直接判为失败
+        返回受限主机或退避中的任务最早可重试的秒数，没有则为None
+        """
+        retry_after = None
+        blocked = set()
+        now = time.monotonic()
+        for task in sorted(backlog, key=lambda task: -task.priority):
+            if len(pending) >= self.workers:
+                break
+            if task.not_before > now:
+                # 重试前的退避还没有结束
+                delay = task.not_before - now
+                retry_after = delay if retry_after is None else min(retry_after, delay)
+                continue
+            allowed = self.breaker.allow(task.host)
+            while not allowed and task.fail_over():
+                # 主机已熔断，改用镜像
+                allowed = self.breaker.allow(task.host)
+            if not allowed:
+                backlog.remove(task)
+                rejected.append(task)
+                continue
+            if task.host in blocked:
+                self.breaker.cancel_probe(task.host)
+                continue
+            if self.budget and not self.budget.try_acquire(self):
+                # 共享名额已用完，稍后再看其他任务是否释放了名额
+                self.breaker.cancel_probe(task.host)
+                retry_after = IDLE_POLL if retry_after is None else min(retry_after, IDLE_POLL)
+                break
+            acquired, delay = self.rate_limiter.try_acquire(task.host)
+            if acquired:
+                backlog.remove(task)
+                pending.add(executor.submit(self.download_one, task))
+                continue
+            self.breaker.cancel_probe(task.host)
+            if self.budget:
+                self.budget.release(self)
+            blocked.add(task.host)
+            if delay is not None:
+                retry_after = delay if retry_after is None else min(retry_after, delay)
+        return retry_after
+
+    def connection_stats(self):
+        """返回连接复用统计，见PooledSession.stats"""
+        return self.session.stats()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+单个工作簿的下载任务
+读取Excel中的URL列，边解析边下载并按 Excel文件名_序号 重命名；不依赖图形界面，图形界面和命令行共用
+"""
+
+import os
+
+from checksum import DEFAULT_ALGORITHM
+from content_store import ContentStore
+from download_engine import (
+    DEFAULT_HEDGE_DELAY, DEFAULT_SEGMENT_THRESHOLD, DEFAULT_SEGMENTS, DEFAULT_WORKERS, DownloadEngine, DownloadTask,
+    TaskFeed
+)
+from download_journal import DownloadJournal, MetadataCache
+from excel_reader import ExcelUrlReader
+from parse_cache import MAX_CACHED_ROWS, ParseCache
+from retry_policy import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES
+from stall_watchdog import DEFAULT_MIN_RATE, DEFAULT_STALL_WINDOW
+
+# 每一行的结果状态
+STATUS_DOWNLOADED = 'downloaded'
+STATUS_SKIPPED = 'skipped'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_FAILED = 'failed'
+STATUSES = (STATUS_DOWNLOADED, STATUS_SKIPPED, STATUS_DUPLICATE, STATUS_UNCHANGED, STATUS_FAILED)
+# 输出给用户看的状态名称
+STATUS_LABELS = {
+    STATUS_DOWNLOADED: '已下载',
+    STATUS_SKIPPED: '此前已完成',
+    STATUS_DUPLICATE: '重复链接',
+    STATUS_UNCHANGED: '未变化',
+    STATUS_FAILED: '失败',
+}
+
+
+def result_status(result):
+    """把DownloadResult归为上面的一种状态"""
+    if result.skipped:
+        return STATUS_SKIPPED
+    if result.duplicate_of is not None and result.success:
+        return STATUS_DUPLICATE
+    if result.unchanged:
+        return STATUS_UNCHANGED
+    if result.success:
+        return STATUS_DOWNLOADED
+    return STATUS_FAILED
+
+
+class WorkbookDownload:
+    """
+    下载一个工作簿中的全部链接
+    创建时读取表头，找不到URL列时抛出ValueError；run() 在调用线程中执行下载，可在其他线程中调用cancel()
+    """
+
+    def __init__(self, path, download_folder, workers=DEFAULT_WORKERS, rate_limiter=None, dedup_content=False,
+                 parse_cache=None, session=None, budget=None, content_store=None, segments=DEFAULT_SEGMENTS,
+                 segment_threshold=DEFAULT_SEGMENT_THRESHOLD, bandwidth=None, priority=0, small_first=False,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), retries=DEFAULT_RETRIES, breaker=None,
+                 min_rate=DEFAULT_MIN_RATE, stall_window=DEFAULT_STALL_WINDOW, hedge_delay=DEFAULT_HEDGE_DELAY,
+                 checksum_algorithm=DEFAULT_ALGORITHM, durability=None):
+        self.path = path
+        self.download_folder = download_folder
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.dedup_content = dedup_content
+        self.parse_cache = parse_cache
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        # 带宽限制和优先级，见DownloadEngine
+        self.bandwidth = bandwidth
+        self.priority = priority
+        self.small_first = small_first
+        # 超时、重试次数、按主机熔断、停滞监测、镜像对冲和摘要算法，见DownloadEngine
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker
+        self.min_rate = min_rate
+        self.stall_window = stall_window
+        self.hedge_delay = hedge_delay
+        self.checksum_algorithm = checksum_algorithm
+        # 批量下载时多个工作簿共享的连接池、并发名额、内容存储和落盘策略，单独下载时为None
+        self.session = session
+        self.budget = budget
+        self.content_store = content_store
+        self.durability = durability
+        # 获取Excel文件名（不含扩展名）
+        self.excel_filename = os.path.splitext(os.path.basename(path))[0]
+        self.counts = dict.fromkeys(STATUSES, 0)
+        self.finished = 0
+        self.feed = None
+        self.engine = None
+        self._cancelled = False
+
+        # 未修改的文件直接使用缓存的URL列，否则流式读取Excel文件，只取URL列
+        self._key = ParseCache.key(path)
+        cached = parse_cache.get(self._key, 'urls') if parse_cache else None
+        self._reader = None
+        if cached is None:
+            self._reader = ExcelUrlReader(path)
+            self.url_column = self._reader.url_column
+        else:
+            self.url_column, self._cached_rows = cached
+        if self.url_column is None:
+            self.close()
+            raise ValueError("未找到包含URL的列，请确保Excel文件中有URL列")
+
+    @property
+    def total(self):
+        """有效链接总数，解析完成前为None"""
+        return self.feed.total if self.feed else None
+
+    def _iter_tasks(self):
+        if self._reader is None:
+            # 有优先级列、镜像列或校验列时缓存的行为 (行号, URL, 优先级, 镜像, 校验值)
+            for index, url, *extra in self._cached_rows:
+                yield DownloadTask(index, url, *extra)
+            return
+
+        # 边解析边记录URL行，完整解析后放入缓存
+        rows = [] if self.parse_cache else None
+        with self._reader:
+            for row in self._reader.iter_url_rows():
+                index, url, priority, mirrors, checksum = row
+                if rows is not None:
+                    rows.append(row if priority or mirrors or checksum else (index, url))
+                    if len(rows) > MAX_CACHED_ROWS:
+                        rows = None
+                yield DownloadTask(*row)
+        if rows is not None:
+            self.parse_cache.put(self._key, 'urls', (self.url_column, rows))
+
+    def run(self, on_result=None):
+        """执行下载，每完成一行调用 on_result(result, status)；返回各状态的数量"""
+        # 解析与下载流水线进行：后台线程边解析边把任务放入有界队列，下载立即开始
+        self.feed = TaskFeed(self._iter_tasks())
+        # 下载日志记录已完成的行，中断后重新运行会跳过它们并续传未完成的文件
+        journal = DownloadJournal(self.download_folder, self.excel_filename)
+        # URL元数据缓存，再次下载时未变化的文件通过条件请求跳过
+        metadata_cache = MetadataCache(self.download_folder)
+        if self.content_store is None and self.dedup_content:
+            self.content_store = ContentStore(self.download_folder)
+        self.engine = DownloadEngine(
+            self.download_folder, self.excel_filename, workers=self.workers, rate_limiter=self.rate_limiter,
+            journal=journal, metadata_cache=metadata_cache, content_store=self.content_store,
+            session=self.session, budget=self.budget, segments=self.segments, segment_threshold=self.segment_threshold,
+            bandwidth=self.bandwidth, priority=self.priority, small_first=self.small_first, timeout=self.timeout,
+            retries=self.retries, breaker=self.breaker, min_rate=self.min_rate, stall_window=self.stall_window,
+            hedge_delay=self.hedge_delay, checksum_algorithm=self.checksum_algorithm, durability=self.durability
+        )
+        if self._cancelled:
+            self.engine.cancel()
+
+        def report(result):
+            status = result_status(result)
+            self.counts[status] += 1
+            self.finished += 1
+            if on_result:
+                on_result(result, status)
+
+        try:
+            self.engine.run(self.feed, on_result=report, collect_results=False)
+        finally:
+            journal.close()
+            metadata_cache.close()
+        return self.counts
+
+    def cancel(self):
+        self._cancelled = True
+        if self.engine:
+            self.engine.cancel()
+
+    def set_priority(self, priority):
+        self.priority = priority
+        if self.engine:
+            self.engine.set_priority(priority)
+
+    def connection_stats(self):
+        return self.engine.connection_stats()
+
+    def close(self):
+        """创建后不执行run()时调用，释放打开的Excel文件"""
+        if self._reader:
+            self._reader.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+下载日志
+在下载文件夹中用SQLite记录每个工作簿各行的下载状态，程序中断后重新运行可以跳过已完成的行并续传未完成的文件；
+同一个数据库中还按URL缓存ETag/Last-Modified，用于再次运行时的条件请求
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# 日志数据库文件名，保存在下载文件夹中
+JOURNAL_FILENAME = '.download_rename.sqlite'
+
+STATUS_PARTIAL = 'partial'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def _connect(path):
+    # 自动提交，每条记录写入即生效；WAL模式下进程崩溃不会损坏数据库
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _add_column(conn, table, column, definition):
+    """旧版本创建的表没有这一列时添加"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+class DownloadJournal:
+    """单个工作簿的下载日志，按 (工作簿, 行号) 记录状态，可在多个下载线程间共享"""
+
+    def __init__(self, download_folder, workbook):
+        self.download_folder = download_folder
+        self.workbook = workbook
+        self.path = os.path.join(download_folder, JOURNAL_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = _connect(self.path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rows ('
+            ' workbook TEXT NOT NULL,'
+            ' row_index INTEGER NOT NULL,'
+            ' url TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' filename TEXT,'
+            ' size INTEGER,'
+            ' validator TEXT,'
+            ' error TEXT,'
+            ' updated REAL NOT NULL,'
+            ' digest TEXT,'
+            ' PRIMARY KEY (workbook, row_index))'
+        )
+        _add_column(self._conn, 'rows', 'digest', 'TEXT')
+
+    def _get(self, index):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT url, status, filename, validator, digest, size FROM rows WHERE workbook = ? AND row_index = ?',
+                (self.workbook, index),
+            ).fetchone()
+
+    def _put(self, index, url, status, filename=None, size=None, validator=None, error=None, digest=None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO rows'
+                ' (workbook, row_index, url, status, filename, size, validator, error, updated, digest)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.workbook, index, url, status, filename, size, validator, error, time.time(), digest),
+            )
+
+    def completed(self, index, url):
+        """
+        该行已用相同URL下载完成、文件仍在且大小与记录相同时返回 (文件名, 摘要)，否则返回None
+        大小不符说明文件被改动过，或在落盘前断电（见durability），需要重新下载
+        """
+        row = self._get(index)
+        if row is None:
+            return None
+        row_url, status, filename, _, digest, size = row
+        if status != STATUS_DONE or row_url != url or not filename:
+            return None
+        try:
+            actual = os.path.getsize(os.path.join(self.download_folder, filename))
+        except OSError:
+            return None
+        if size is not None and actual != size:
+            return None
+        return filename, digest
+
+    def completed_filename(self, index, url):
+        """该行已用相同URL下载完成且文件仍在时返回文件名，否则返回None"""
+        completed = self.completed(index, url)
+        return completed[0] if completed else None
+
+    def partial_validator(self, index, url):
+        """
+        返回未完成下载的校验值（ETag或Last-Modified），用于续传时的If-Range
+        没有可续传记录时返回None，URL已变化的记录也视为不可续传
+        """
+        row = self._get(index)
+        if row is None:
+            return None
+        row_url, status, _, validator, _, _ = row
+        if status != STATUS_PARTIAL or row_url != url:
+            return None
+        return validator or ''
+
+    def mark_started(self, index, url, validator=''):
+        self._put(index, url, STATUS_PARTIAL, validator=validator)
+
+    def mark_done(self, index, url, filename, size, digest=None):
+        self._put(index, url, STATUS_DONE, filename=filename, size=size, digest=digest)
+
+    def mark_failed(self, index, url, error):
+        # 保留续传信息，失败的行下次仍可从断点继续
+        row = self._get(index)
+        if row is not None and row[0] == url and row[1] == STATUS_PARTIAL:
+            self._put(index, url, STATUS_PARTIAL, validator=row[3], error=error)
+        else:
+            self._put(index, url, STATUS_FAILED, error=error)
+
+    def finish(self):
+        """
+        整批下载正常结束后清除已完成记录，下次运行视为新的一批，通过条件请求检查文件是否有更新
+        未完成和失败的记录保留，以便继续续传
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM rows WHERE workbook = ? AND status = ?', (self.workbook, STATUS_DONE))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEntry:
+    """URL上次下载时的响应信息"""
+
+    def __init__(self, url, etag, last_modified, size, filename, digest=None):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.filename = filename
+        # 下载时计算的摘要（"算法:十六进制"），旧版本记录的为None
+        self.digest = digest
+
+
+class MetadataCache:
+    """
+    按URL缓存的元数据：ETag、Last-Modified、大小、摘要和保存的文件名
+    再次下载同一URL时发送If-None-Match/If-Modified-Since，收到304即可跳过下载
+    """
+
+    def __init__(self, download_folder):
+        self.download_folder = download_folder
+        self.path = os.path.join(download_folder, JOURNAL_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = _connect(self.path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS url_cache ('
+            ' url TEXT PRIMARY KEY,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' size INTEGER NOT NULL,'
+            ' filename TEXT NOT NULL,'
+            ' updated REAL NOT NULL,'
+            ' digest TEXT)'
+        )
+        _add_column(self._conn, 'url_cache', 'digest', 'TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS url_cache_filename ON url_cache (filename)')
+
+    def get(self, url):
+        """返回URL的缓存信息，本地文件已丢失或大小不符时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT etag, last_modified, size, filename, digest FROM url_cache WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = CachedEntry(url, *row)
+        try:
+            if os.path.getsize(os.path.join(self.download_folder, entry.filename)) != entry.size:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def store(self, url, etag, last_modified, size, filename, digest=None):
+        # 文件已被这个URL的内容覆盖，指向同一文件的其他URL的记录不能再用于条件请求
+        self.forget_file(filename, except_url=url)
+        if not etag and not last_modified:
+            # 没有校验信息的响应无法做条件请求
+            self.forget(url)
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO url_cache (url, etag, last_modified, size, filename, updated, digest)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, size, filename, time.time(), digest),
+            )
+
+    def forget(self, url):
+        with self._lock:
+            self._conn.execute('DELETE FROM url_cache WHERE url = ?', (url,))
+
+    def forget_file(self, filename, except_url=None):
+        """filename被其他内容覆盖（如同一行换了URL、重复链接的行复制了别的文件）时，删除指向它的记录"""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM url_cache WHERE filename = ? AND url IS NOT ?', (filename, except_url)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,11 +1,40 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import pandas as pd
-import requests
 import os
 import threading
-from urllib.parse import urlparse
-import time
+
+from bandwidth import BandwidthLimiter, format_rate, parse_bandwidth
+from batch_queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, BatchQueue, find_workbooks
+from download_engine import DEFAULT_SEGMENT_THRESHOLD, DEFAULT_SEGMENTS, DEFAULT_WORKERS, MAX_SEGMENTS, MAX_WORKERS
+from download_job import STATUS_DUPLICATE, STATUS_FAILED, STATUS_SKIPPED, STATUS_UNCHANGED
+from download_report import result_record, write_report
+from excel_reader import ExcelUrlReader, normalize_url
+from parse_cache import MAX_CACHED_CELLS, ParseCache, default_cache_dir
+from rate_limiter import DEFAULT_MAX_IN_FLIGHT, DEFAULT_RATE, HostRateLimiter, parse_host_limits
+from ui_events import UiEventChannel
+from virtual_table import VirtualTable
+
+# 预览时先读取并立即显示的行数
+PREVIEW_HEAD_ROWS = 200
+# 预览后台加载时每读取多少行刷新一次行数
+PREVIEW_PROGRESS_ROWS = 5000
+# 输入框中多个Excel文件之间的分隔符
+EXCEL_PATH_SEPARATOR = ';'
+# 状态栏中最多列出的进行中工作簿数
+STATUS_JOB_LIMIT = 3
+# 完成对话框中最多列出的失败行数，全部失败的行写入下载文件夹中的报告
+FAILURE_LIST_LIMIT = 10
+FAILURE_REPORT_FILENAME = 'download_failures.csv'
+
+def describe_failures(records, limit=FAILURE_LIST_LIMIT):
+    """失败行的列表，每行为 "Excel文件名 第N行: URL - 错误"，超过limit行时只列出前limit行"""
+    lines = [
+        f"{os.path.basename(record['workbook'])} 第{record['row']}行: {record['url']} - {record['error']}"
+        for record in records[:limit]
+    ]
+    if len(records) > limit:
+        lines.append(f"……另有 {len(records) - limit} 行")
+    return "\n".join(lines)
 
 class DownloadRenameApp:
     def __init__(self, root):
@@ -16,10 +45,36 @@ class DownloadRenameApp:
         # 变量
         self.excel_file_path = tk.StringVar()
         self.download_folder = tk.StringVar()
+        self.workers = tk.IntVar(value=DEFAULT_WORKERS)
+        self.segments = tk.IntVar(value=DEFAULT_SEGMENTS)
+        self.host_limits = tk.StringVar(value=f"*={DEFAULT_RATE:g}/{DEFAULT_MAX_IN_FLIGHT}")
+        self.rate_limiter = None
+        # 带宽上限在下载过程中修改后立即生效，所有下载共用同一个限速器
+        self.bandwidth_text = tk.StringVar()
+        self.bandwidth = BandwidthLimiter()
+        self.small_first = tk.BooleanVar(value=False)
+        self.dedup_content = tk.BooleanVar(value=False)
+        self.disk_parse_cache = tk.BooleanVar(value=True)
+        self.show_column_summary = tk.BooleanVar(value=False)
+        
+        # 预览数据，由后台线程加载
+        self.preview_columns = []
+        self.preview_rows = []
+        self.preview_stats = None
+        self.preview_generation = 0
+        self.preview_cancel = None
+        # 预览和下载共用的解析缓存
+        self.parse_cache = ParseCache(default_cache_dir())
         self.download_list = []
         self.is_downloading = False
+        # 正在进行的下载队列，下载过程中选择的其他Excel文件加入这个队列
+        self.batch = None
+        
+        # 后台线程通过事件通道更新界面，状态和进度每一帧只更新一次
+        self.ui_events = UiEventChannel(coalesce=('status', 'progress'))
         
         self.setup_ui()
+        self.ui_events.attach(self.root, self.handle_ui_event)
         
     def setup_ui(self):
         # 主框架
@@ -35,93 +90,309 @@ class DownloadRenameApp:
         ttk.Label(main_frame, text="Excel文件:").grid(row=0, column=0, sticky=tk.W, pady=5)
         ttk.Entry(main_frame, textvariable=self.excel_file_path, width=50).grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
         ttk.Button(main_frame, text="浏览", command=self.browse_excel_file).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Button(main_frame, text="文件夹", command=self.browse_excel_folder).grid(row=0, column=3, padx=5, pady=5)
         
         # 下载文件夹选择
         ttk.Label(main_frame, text="下载文件夹:").grid(row=1, column=0, sticky=tk.W, pady=5)
         ttk.Entry(main_frame, textvariable=self.download_folder, width=50).grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
         ttk.Button(main_frame, text="浏览", command=self.browse_download_folder).grid(row=1, column=2, padx=5, pady=5)
         
+        # 下载设置
+        settings_frame = ttk.LabelFrame(main_frame, text="下载设置", padding="5")
+        settings_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
+        settings_frame.columnconfigure(1, weight=1)
+        
+        ttk.Label(settings_frame, text="并发数:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        ttk.Spinbox(settings_frame, from_=1, to=MAX_WORKERS, textvariable=self.workers, width=5).grid(row=0, column=1, sticky=tk.W, padx=5, pady=2)
+        
+        ttk.Label(settings_frame, text="主机限速:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        ttk.Entry(settings_frame, textvariable=self.host_limits).grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=2)
+        ttk.Label(settings_frame, text="格式: 域名=每秒请求数/最大并发，用分号分隔，* 为默认").grid(row=2, column=1, sticky=tk.W, padx=5)
+        
+        ttk.Checkbutton(
+            settings_frame, text="按内容去重（内容相同的文件在磁盘上只保留一份）", variable=self.dedup_content
+        ).grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        ttk.Checkbutton(
+            settings_frame, text="缓存Excel解析结果到磁盘（再次打开未修改的文件时无需重新解析）",
+            variable=self.disk_parse_cache, command=self.update_parse_cache
+        ).grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
+        ttk.Label(settings_frame, text="大文件分段:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        segments_frame = ttk.Frame(settings_frame)
+        segments_frame.grid(row=5, column=1, sticky=tk.W, padx=5, pady=2)
+        ttk.Spinbox(segments_frame, from_=1, to=MAX_SEGMENTS, textvariable=self.segments, width=5).grid(row=0, column=0)
+        ttk.Label(
+            segments_frame, text=f"超过 {DEFAULT_SEGMENT_THRESHOLD // 1024 // 1024} MB 的文件分成多段并行下载，1为不分段"
+        ).grid(row=0, column=1, sticky=tk.W, padx=5)
+        
+        ttk.Label(settings_frame, text="带宽上限:").grid(row=6, column=0, sticky=tk.W, pady=2)
+        bandwidth_entry = ttk.Entry(settings_frame, textvariable=self.bandwidth_text)
+        bandwidth_entry.grid(row=6, column=1, sticky=(tk.W, tk.E), padx=5, pady=2)
+        bandwidth_entry.bind('<Return>', lambda event: self.apply_bandwidth())
+        ttk.Label(
+            settings_frame, text="如 10M，或按时段: 09:00-18:00=2M; *=0（空白或0为不限），按回车后下载中也立即生效"
+        ).grid(row=7, column=1, sticky=tk.W, padx=5)
+        ttk.Checkbutton(
+            settings_frame, text="带宽受限时优先传输小文件", variable=self.small_first
+        ).grid(row=8, column=0, columnspan=2, sticky=tk.W, pady=2)
+        
         # 预览按钮
-        ttk.Button(main_frame, text="预览Excel内容", command=self.preview_excel).grid(row=2, column=1, pady=10)
+        ttk.Button(main_frame, text="预览Excel内容", command=self.preview_excel).grid(row=3, column=1, pady=10)
         
         # 下载按钮
-        ttk.Button(main_frame, text="开始下载", command=self.start_download).grid(row=2, column=2, pady=10)
+        ttk.Button(main_frame, text="开始下载", command=self.start_download).grid(row=3, column=2, pady=10)
         
         # 进度条
         self.progress = ttk.Progressbar(main_frame, mode='determinate')
-        self.progress.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
+        self.progress.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
         
         # 状态标签
         self.status_label = ttk.Label(main_frame, text="就绪")
-        self.status_label.grid(row=4, column=0, columnspan=3, pady=5)
+        self.status_label.grid(row=5, column=0, columnspan=3, pady=5)
         
         # 预览表格
-        ttk.Label(main_frame, text="Excel内容预览:").grid(row=5, column=0, sticky=tk.W, pady=(20, 5))
+        ttk.Label(main_frame, text="Excel内容预览:").grid(row=6, column=0, sticky=tk.W, pady=(20, 5))
+        self.preview_summary = ttk.Label(main_frame, text="")
+        self.preview_summary.grid(row=6, column=1, sticky=tk.W, pady=(20, 5))
+        ttk.Checkbutton(
+            main_frame, text="显示列统计", variable=self.show_column_summary, command=self.update_preview_headings
+        ).grid(row=6, column=2, sticky=tk.E, pady=(20, 5))
         
-        # 创建Treeview用于显示Excel内容
-        self.tree = ttk.Treeview(main_frame, height=15)
-        self.tree.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        # 虚拟化表格：只创建可见的行，滚动时按页加载，大表格也能立即显示
+        self.table = VirtualTable(main_frame, height=15)
+        self.tree = self.table.tree
+        self.tree.grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
         # 滚动条
-        scrollbar_y = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        scrollbar_y.grid(row=6, column=3, sticky=(tk.N, tk.S))
-        self.tree.configure(yscrollcommand=scrollbar_y.set)
+        self.table.scrollbar.grid(row=7, column=3, sticky=(tk.N, tk.S))
         
         scrollbar_x = ttk.Scrollbar(main_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        scrollbar_x.grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        scrollbar_x.grid(row=8, column=0, columnspan=3, sticky=(tk.W, tk.E))
         self.tree.configure(xscrollcommand=scrollbar_x.set)
         
         # 配置行权重
-        main_frame.rowconfigure(6, weight=1)
+        main_frame.rowconfigure(7, weight=1)
+        
+    def apply_bandwidth(self):
+        """把带宽设置应用到限速器，返回是否成功"""
+        try:
+            rate, schedule = parse_bandwidth(self.bandwidth_text.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return False
+        self.bandwidth.set_limits(rate, schedule)
+        if self.is_downloading:
+            self.status_label.config(text=f"带宽上限已修改，当前 {format_rate(self.bandwidth.current_rate())}")
+        return True
+        
+    def update_parse_cache(self):
+        self.parse_cache.cache_dir = default_cache_dir() if self.disk_parse_cache.get() else None
         
     def browse_excel_file(self):
-        filename = filedialog.askopenfilename(
+        # 可以选择多个文件，一起下载
+        filenames = filedialog.askopenfilenames(
             title="选择Excel文件",
             filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
         )
-        if filename:
-            self.excel_file_path.set(filename)
+        if filenames:
+            # 换了文件，正在进行的预览不再需要
+            self.cancel_preview()
+            self.excel_file_path.set(f"{EXCEL_PATH_SEPARATOR} ".join(filenames))
+            
+    def browse_excel_folder(self):
+        # 下载文件夹中的全部Excel文件
+        folder = filedialog.askdirectory(title="选择包含Excel文件的文件夹")
+        if folder:
+            self.cancel_preview()
+            self.excel_file_path.set(folder)
             
+    def excel_paths(self):
+        """输入框中的Excel文件，文件夹展开为其中的Excel文件"""
+        paths = [path.strip() for path in self.excel_file_path.get().split(EXCEL_PATH_SEPARATOR) if path.strip()]
+        return find_workbooks(paths)
+        
     def browse_download_folder(self):
         folder = filedialog.askdirectory(title="选择下载文件夹")
         if folder:
             self.download_folder.set(folder)
             
     def preview_excel(self):
-        if not self.excel_file_path.get():
+        paths = self.excel_paths()
+        if not paths:
             messagebox.showerror("错误", "请先选择Excel文件")
             return
             
+        # 取消仍在进行的预览
+        self.cancel_preview()
+        self.preview_generation += 1
+        
+        # 选择了多个文件时预览第一个
+        path = paths[0]
         try:
-            # 读取Excel文件
-            df = pd.read_excel(self.excel_file_path.get())
+            key = ParseCache.key(path)
+        except OSError as e:
+            messagebox.showerror("错误", f"无法读取Excel文件: {str(e)}")
+            return
             
-            # 清空现有内容
-            for item in self.tree.get_children():
-                self.tree.delete(item)
+        # 在后台线程中读取（包括读取缓存），界面保持响应
+        self.preview_cancel = threading.Event()
+        self.table.clear()
+        self.preview_summary.config(text="")
+        self.status_label.config(text="正在加载预览...")
+        preview_thread = threading.Thread(
+            target=self.load_preview, args=(path, key, self.preview_generation, self.preview_cancel)
+        )
+        preview_thread.daemon = True
+        preview_thread.start()
+        
+    def cancel_preview(self):
+        if self.preview_cancel is not None:
+            self.preview_cancel.set()
+            self.preview_cancel = None
+            
+    def load_preview(self, path, key, generation, cancel):
+        """
+        后台线程：未修改的文件直接使用缓存；否则先读取开头的行立即显示，再继续读取全部行并统计各列和URL列
+        磁盘缓存可能很大，反序列化也在这里进行，不阻塞界面
+        """
+        def post(kind, payload=None):
+            self.ui_events.post('preview', generation, kind, payload)
+            
+        try:
+            cached = self.parse_cache.get(key, 'preview')
+            if cached is not None:
+                columns, rows, stats = cached
+                post('head', (columns, rows, None))
+                post('done', (len(rows), stats))
+                return
                 
-            # 设置列
-            columns = list(df.columns)
-            self.tree['columns'] = columns
-            self.tree['show'] = 'headings'
-            
-            # 设置列标题
-            for col in columns:
-                self.tree.heading(col, text=col)
-                self.tree.column(col, width=150, minwidth=100)
+            with ExcelUrlReader(path) as reader:
+                columns = reader.columns
+                rows = []
+                non_empty = [0] * len(columns)
+                valid_urls = 0
+                distinct_urls = set()
                 
-            # 添加数据
-            for index, row in df.iterrows():
-                values = [row[col] for col in columns]
-                self.tree.insert('', 'end', values=values)
+                for row in reader.iter_rows():
+                    if cancel.is_set():
+                        return
+                    rows.append(row)
+                    for position, value in enumerate(row):
+                        if value is not None and value != '':
+                            non_empty[position] += 1
+                    if reader.url_position is not None:
+                        url = normalize_url(row[reader.url_position])
+                        if url:
+                            valid_urls += 1
+                            distinct_urls.add(url)
+                            
+                    if len(rows) == PREVIEW_HEAD_ROWS:
+                        post('head', (columns, rows, reader.estimated_rows))
+                    elif len(rows) % PREVIEW_PROGRESS_ROWS == 0:
+                        post('progress', len(rows))
+                        
+                if len(rows) < PREVIEW_HEAD_ROWS:
+                    post('head', (columns, rows, reader.estimated_rows))
+                    
+                stats = {
+                    'non_empty': non_empty,
+                    'url_column': reader.url_column,
+                    'valid_urls': valid_urls,
+                    'distinct_urls': len(distinct_urls),
+                }
                 
-            self.status_label.config(text=f"已加载 {len(df)} 行数据")
+            if len(rows) * max(1, len(columns)) <= MAX_CACHED_CELLS:
+                self.parse_cache.put(key, 'preview', (columns, rows, stats))
+            post('done', (len(rows), stats))
             
         except Exception as e:
-            messagebox.showerror("错误", f"无法读取Excel文件: {str(e)}")
+            post('error', str(e))
+            
+    def handle_ui_event(self, kind, *args):
+        """主线程处理后台线程发来的界面事件"""
+        if kind == 'status':
+            self.status_label.config(text=args[0])
+        elif kind == 'progress':
+            self.show_progress(*args)
+        elif kind == 'message':
+            level, title, text = args
+            getattr(messagebox, level)(title, text)
+        elif kind == 'preview':
+            self.handle_preview_event(*args)
+            
+    def show_progress(self, value, maximum):
+        """maximum为None表示总数未知，进度条显示为不确定模式"""
+        if maximum is None:
+            if str(self.progress['mode']) != 'indeterminate':
+                self.progress.config(mode='indeterminate')
+                self.progress.start()
+            return
+        if str(self.progress['mode']) != 'determinate':
+            self.progress.stop()
+            self.progress.config(mode='determinate')
+        self.progress.config(maximum=max(maximum, 1), value=value)
+        
+    def handle_preview_event(self, generation, kind, payload):
+        if generation != self.preview_generation:
+            # 这次预览已被新的预览取代
+            return
+            
+        if kind == 'head':
+            columns, rows, estimated = payload
+            self.show_preview(columns, rows, estimated)
+        elif kind == 'progress':
+            self.table.set_row_count(payload)
+            self.status_label.config(text=f"正在加载预览... 已读取 {payload} 行")
+        elif kind == 'done':
+            count, stats = payload
+            self.preview_cancel = None
+            self.finish_preview(count, stats)
+        elif kind == 'error':
+            self.preview_cancel = None
+            self.status_label.config(text="预览失败")
+            messagebox.showerror("错误", f"无法读取Excel文件: {payload}")
             
+    def show_preview(self, columns, rows, estimated=None):
+        """显示已读取的行，后台可以继续向rows追加"""
+        self.preview_columns = columns
+        self.preview_rows = rows
+        self.preview_stats = None
+        self.table.set_source(columns, len(rows), self.fetch_preview_rows)
+        self.update_preview_headings()
+        self.preview_summary.config(
+            text=f"{len(columns)} 列" + (f"，约 {estimated} 行" if estimated else "") + "，正在统计..."
+        )
+        
+    def finish_preview(self, count, stats):
+        self.preview_stats = stats
+        self.table.set_row_count(count)
+        self.update_preview_headings()
+        
+        summary = f"共 {count} 行 × {len(self.preview_columns)} 列"
+        if stats['url_column'] is None:
+            summary += "，未找到URL列"
+        else:
+            summary += f"，URL列「{stats['url_column']}」有效链接 {stats['valid_urls']} 个（不重复 {stats['distinct_urls']} 个）"
+        self.preview_summary.config(text=summary)
+        self.status_label.config(text=f"已加载 {count} 行数据")
+        
+    def fetch_preview_rows(self, start, stop):
+        return [['' if value is None else value for value in row] for row in self.preview_rows[start:stop]]
+        
+    def update_preview_headings(self):
+        """勾选"显示列统计"时在列标题中显示每列的非空值数量（加载完成后）"""
+        if self.show_column_summary.get() and self.preview_stats is not None:
+            headings = [
+                f"{col} (非空 {count})" for col, count in zip(self.preview_columns, self.preview_stats['non_empty'])
+            ]
+        else:
+            headings = self.preview_columns
+        self.table.set_headings(headings)
+        
     def start_download(self):
-        if not self.excel_file_path.get():
+        paths = self.excel_paths()
+        if not paths:
             messagebox.showerror("错误", "请先选择Excel文件")
             return
             
@@ -130,113 +401,144 @@ class DownloadRenameApp:
             return
             
         if self.is_downloading:
-            messagebox.showwarning("警告", "下载正在进行中，请等待完成")
+            # 下载进行中时，同一个下载文件夹的Excel文件加入当前队列一起下载
+            same_folder = os.path.abspath(self.download_folder.get()) == os.path.abspath(self.batch.download_folder)
+            if same_folder and all(self.batch.add(path) is not None for path in paths):
+                self.status_label.config(text=f"已加入下载队列: {len(paths)} 个Excel文件")
+            else:
+                messagebox.showwarning("警告", "下载正在进行中，只能把下载到同一文件夹的Excel文件加入队列")
+            return
+            
+        try:
+            limits, default = parse_host_limits(self.host_limits.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
             return
+        self.rate_limiter = HostRateLimiter(limits, default)
+        if not self.apply_bandwidth():
+            return
+        
+        try:
+            workers = self.workers.get()
+        except tk.TclError:
+            workers = DEFAULT_WORKERS
+        try:
+            segments = min(max(1, self.segments.get()), MAX_SEGMENTS)
+        except tk.TclError:
+            segments = DEFAULT_SEGMENTS
             
-        # 在新线程中开始下载
-        download_thread = threading.Thread(target=self.download_files)
+        # 所有Excel文件共享并发数和连接池，每个文件仍按各自的文件名前缀命名
+        self.batch = BatchQueue(
+            self.download_folder.get(), workers=workers, rate_limiter=self.rate_limiter,
+            dedup_content=self.dedup_content.get(), parse_cache=self.parse_cache, segments=segments,
+            bandwidth=self.bandwidth, small_first=self.small_first.get()
+        )
+        for path in paths:
+            self.batch.add(path)
+            
+        # 在新线程中开始下载，Tk变量只在主线程读取
+        self.is_downloading = True
+        download_thread = threading.Thread(target=self.download_batch, args=(self.batch,))
         download_thread.daemon = True
         download_thread.start()
         
-    def download_files(self):
+    def batch_status(self, batch):
+        """总进度和进行中的各个工作簿的进度"""
+        total = batch.total
+        text = f"总进度 {batch.finished}/{total if total is not None else '?'}"
+        if len(batch.jobs) > 1:
+            ended = sum(1 for job in batch.jobs if job.state not in (JOB_QUEUED, JOB_RUNNING))
+            text += f"，已完成 {ended}/{len(batch.jobs)} 个Excel文件"
+            running = [job for job in batch.jobs if job.state == JOB_RUNNING][:STATUS_JOB_LIMIT]
+            if running:
+                text += "｜" + "，".join(
+                    f"{job.excel_filename} {job.finished}/{job.total if job.total is not None else '?'}"
+                    for job in running
+                )
+        rate = self.bandwidth.current_rate()
+        if rate:
+            text += f"｜带宽上限 {format_rate(rate)}"
+        return text
+        
+    def report_failures(self, batch, failures):
+        """把失败的行写入下载文件夹中的CSV报告，返回完成对话框中列出失败行的文字，没有失败的行时返回空字符串"""
+        path = os.path.join(batch.download_folder, FAILURE_REPORT_FILENAME)
+        if not failures:
+            # 上次运行留下的报告已不再适用
+            if os.path.exists(path):
+                os.remove(path)
+            return ""
+        failures.sort(key=lambda record: (record['workbook'], record['row']))
+        text = "\n\n下载失败的行：\n" + describe_failures(failures)
         try:
-            self.is_downloading = True
-            self.status_label.config(text="正在读取Excel文件...")
-            
-            # 读取Excel文件
-            df = pd.read_excel(self.excel_file_path.get())
-            
-            # 查找URL列
-            url_column = None
-            for col in df.columns:
-                if 'url' in col.lower() or '链接' in col or '地址' in col:
-                    url_column = col
-                    break
-                    
-            if url_column is None:
-                messagebox.showerror("错误", "未找到包含URL的列，请确保Excel文件中有URL列")
-                self.is_downloading = False
-                return
-                
-            # 获取Excel文件名（不含扩展名）
-            excel_filename = os.path.splitext(os.path.basename(self.excel_file_path.get()))[0]
-            
-            # 过滤有效的URL
-            valid_urls = []
-            for index, row in df.iterrows():
-                url = str(row[url_column]).strip()
-                if url and url != 'nan' and (url.startswith('http://') or url.startswith('https://')):
-                    valid_urls.append((index, url))
-                    
-            if not valid_urls:
-                messagebox.showwarning("警告", "未找到有效的下载链接")
-                self.is_downloading = False
-                return
+            write_report(path, failures, None, fmt='csv')
+        except OSError as e:
+            return text + f"\n\n无法写入失败报告: {e}"
+        return text + f"\n\n全部失败的行已保存到 {path}"
+        
+    def download_batch(self, batch):
+        # 后台线程，界面更新都通过事件通道交给主线程
+        post = self.ui_events.post
+        try:
+            # 总数未知前进度条显示为不确定模式
+            post('status', "正在解析Excel并开始下载...")
+            post('progress', 0, None)
+            
+            def report(*args):
+                post('progress', batch.finished, batch.total)
+                post('status', self.batch_status(batch))
                 
-            self.status_label.config(text=f"找到 {len(valid_urls)} 个有效链接，开始下载...")
-            self.progress['maximum'] = len(valid_urls)
-            self.progress['value'] = 0
-            
-            # 开始下载
-            for i, (index, url) in enumerate(valid_urls):
-                try:
-                    self.status_label.config(text=f"正在下载第 {i+1}/{len(valid_urls)} 个文件...")
-                    
-                    # 下载文件
-                    response = requests.get(url, stream=True, timeout=30)
-                    response.raise_for_status()
-                    
-                    # 获取文件扩展名
-                    content_type = response.headers.get('content-type', '')
-                    if 'image' in content_type:
-                        ext = '.jpg' if 'jpeg' in content_type else '.png'
-                    elif 'pdf' in content_type:
-                        ext = '.pdf'
-                    elif 'zip' in content_type:
-                        ext = '.zip'
-                    elif 'excel' in content_type or 'spreadsheet' in content_type:
-                        ext = '.xlsx'
-                    else:
-                        # 尝试从URL获取扩展名
-                        parsed_url = urlparse(url)
-                        path = parsed_url.path
-                        if '.' in path:
-                            ext = os.path.splitext(path)[1]
-                        else:
-                            ext = '.txt'
-                    
-                    # 生成新文件名
-                    new_filename = f"{excel_filename}_{index:03d}{ext}"
-                    file_path = os.path.join(self.download_folder.get(), new_filename)
-                    
-                    # 保存文件
-                    with open(file_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                
-                    self.status_label.config(text=f"已下载: {new_filename}")
-                    
-                except Exception as e:
-                    self.status_label.config(text=f"下载失败: {url} - {str(e)}")
-                    
-                # 更新进度条
-                self.progress['value'] = i + 1
-                self.root.update_idletasks()
+            # 失败的行（工作簿、行号、URL、错误），完成时列出
+            failures = []
+            
+            def on_result(job, result, status):
+                if status == STATUS_FAILED:
+                    failures.append(result_record(job.path, result, status))
+                report()
                 
-                # 短暂延迟，避免过于频繁的请求
-                time.sleep(0.5)
+            # 开始并发下载
+            counts = batch.run(on_result=on_result, on_job=report)
+            
+            failed_jobs = [job for job in batch.jobs if job.state == JOB_FAILED]
+            job_errors = "".join(f"\n{job.path}: {job.error}" for job in failed_jobs)
+            failure_text = self.report_failures(batch, failures)
+            if not any(job.state == JOB_DONE for job in batch.jobs):
+                post('status', "下载失败")
+                post('message', 'showerror', "错误", "下载失败：" + job_errors + failure_text)
+                return
+            if batch.total == 0 and not failed_jobs:
+                post('message', 'showwarning', "警告", "未找到有效的下载链接")
+                return
                 
-            self.status_label.config(text="下载完成！")
-            messagebox.showinfo("完成", f"下载完成！共下载 {len(valid_urls)} 个文件到 {self.download_folder.get()}")
+            stats = batch.session.stats()
+            
+            post(
+                'status',
+                f"下载完成！连接复用率 {stats['reuse_rate']:.0%}（{stats['requests']} 次请求，新建 {stats['connections']} 个连接）"
+            )
+            content_store = batch.content_store
+            post(
+                'message', 'showinfo', "完成",
+                f"下载完成！共下载 {batch.finished - counts[STATUS_FAILED]}/{batch.total} 个文件到 {batch.download_folder}"
+                + (f"，其中 {counts[STATUS_SKIPPED]} 个此前已完成" if counts[STATUS_SKIPPED] else "")
+                + (f"，{counts[STATUS_UNCHANGED]} 个未变化" if counts[STATUS_UNCHANGED] else "")
+                + (f"，{counts[STATUS_DUPLICATE]} 个重复链接只下载了一次" if counts[STATUS_DUPLICATE] else "")
+                + (
+                    f"，内容去重节省 {content_store.saved_bytes / 1024 / 1024:.1f} MB"
+                    if content_store and content_store.deduplicated else ""
+                )
+                + (f"，失败 {counts[STATUS_FAILED]} 个" if counts[STATUS_FAILED] else "")
+                + (f"\n\n以下Excel文件出错：{job_errors}" if failed_jobs else "")
+                + failure_text
+            )
             
         except Exception as e:
-            messagebox.showerror("错误", f"下载过程中出现错误: {str(e)}")
-            self.status_label.config(text="下载失败")
+            post('status', "下载失败")
+            post('message', 'showerror', "错误", f"下载过程中出现错误: {str(e)}")
             
         finally:
             self.is_downloading = False
-            self.progress['value'] = 0
+            post('progress', 0, 0)
 
 def main():
     root = tk.Tk()
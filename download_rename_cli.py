@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+命令行批量下载
+不加载图形界面（不导入tkinter），可在无显示器的服务器和定时任务中运行：
+
+    python download_rename_cli.py 表格1.xlsx 表格2.xls 表格文件夹/ -o 下载目录 -j 16 --report report.json
+"""
+
+import argparse
+import os
+import sys
+
+from bandwidth import BandwidthLimiter, format_rate, parse_bandwidth, parse_rate
+from checksum import ALGORITHMS, DEFAULT_ALGORITHM
+from batch_queue import DEFAULT_MAX_JOBS, JOB_DONE, JOB_FAILED, JOB_LABELS, JOB_RUNNING, BatchQueue, find_workbooks
+from download_engine import (
+    DEFAULT_HEDGE_DELAY, DEFAULT_SEGMENT_THRESHOLD, DEFAULT_SEGMENTS, DEFAULT_WORKERS, MAX_SEGMENTS, MAX_WORKERS
+)
+from download_job import STATUS_FAILED, STATUS_LABELS, STATUSES
+from download_report import REPORT_FORMATS, result_record, write_report, write_timing_report
+from durability import DEFAULT_DURABILITY, DEFAULT_SYNC_EVERY, DURABILITY_POLICIES
+from parse_cache import ParseCache, default_cache_dir
+from rate_limiter import DEFAULT_MAX_IN_FLIGHT, DEFAULT_RATE, HostRateLimiter, parse_host_limits
+from retry_policy import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES
+from stall_watchdog import DEFAULT_MIN_RATE, DEFAULT_STALL_WINDOW
+from transfer_timing import write_prometheus
+
+# 中断（Ctrl+C）时的退出码
+EXIT_INTERRUPTED = 130
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='download_rename_cli',
+        description="从Excel文件中读取URL，批量下载并重命名为 Excel文件名_序号（无图形界面）",
+    )
+    parser.add_argument(
+        'workbooks', nargs='+', metavar='EXCEL', help="Excel文件(.xlsx/.xls)或包含Excel文件的文件夹，可指定多个"
+    )
+    parser.add_argument('-o', '--output', required=True, help="下载文件夹，不存在时自动创建")
+    parser.add_argument(
+        '-j', '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f"同时下载的文件数，所有工作簿共享（1-{MAX_WORKERS}，默认{DEFAULT_WORKERS}）",
+    )
+    parser.add_argument(
+        '--max-jobs', type=int, default=DEFAULT_MAX_JOBS,
+        help=f"同时进行的工作簿数，其余排队（默认{DEFAULT_MAX_JOBS}）",
+    )
+    parser.add_argument(
+        '--host-limits', default=f"*={DEFAULT_RATE:g}/{DEFAULT_MAX_IN_FLIGHT}",
+        help="主机限速，格式: 域名=每秒请求数/最大并发，用分号分隔，* 为默认",
+    )
+    parser.add_argument(
+        '--segments', type=int, default=DEFAULT_SEGMENTS,
+        help=f"大文件分成几段并行下载（1-{MAX_SEGMENTS}，默认{DEFAULT_SEGMENTS}即不分段），需要服务器支持Range",
+    )
+    parser.add_argument(
+        '--segment-threshold', type=float, default=DEFAULT_SEGMENT_THRESHOLD / 1024 / 1024, metavar='MB',
+        help=f"超过该大小的文件才分段（默认{DEFAULT_SEGMENT_THRESHOLD // 1024 // 1024} MB）",
+    )
+    parser.add_argument(
+        '--bandwidth', default='',
+        help="全部下载共享的带宽上限，如 10M；可按时段设置，如 \"09:00-18:00=2M; *=0\"（0为不限，默认不限）",
+    )
+    parser.add_argument('--small-first', action='store_true', help="带宽受限时优先传输剩余字节少的文件")
+    parser.add_argument(
+        '--priority', action='append', default=[], metavar='EXCEL',
+        help="优先下载的工作簿（路径或文件名），可指定多次；表格中名为\"优先级\"/priority的列控制行的优先级",
+    )
+    parser.add_argument(
+        '--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT, metavar='SECONDS',
+        help=f"连接超时秒数（默认{DEFAULT_CONNECT_TIMEOUT}）",
+    )
+    parser.add_argument(
+        '--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT, metavar='SECONDS',
+        help=f"两次收到数据之间的最长间隔秒数（默认{DEFAULT_READ_TIMEOUT}）",
+    )
+    parser.add_argument(
+        '--retries', type=int, default=DEFAULT_RETRIES,
+        help=f"5xx、429、连接中断和超时等临时性错误的重试次数，按指数退避（默认{DEFAULT_RETRIES}）",
+    )
+    parser.add_argument(
+        '--min-speed', default=f"{DEFAULT_MIN_RATE // 1024}K",
+        help=f"速度下限，如 10K；连续 --stall-time 秒低于它的下载断开后重试（默认{DEFAULT_MIN_RATE // 1024}K，0为不监测）",
+    )
+    parser.add_argument(
+        '--stall-time', type=float, default=DEFAULT_STALL_WINDOW, metavar='SECONDS',
+        help=f"判定下载停滞的时间（默认{DEFAULT_STALL_WINDOW:g}秒）",
+    )
+    parser.add_argument(
+        '--hedge-delay', type=float, default=DEFAULT_HEDGE_DELAY, metavar='SECONDS',
+        help=f"有镜像列时，主链接这么多秒没有响应就同时请求镜像（默认{DEFAULT_HEDGE_DELAY:g}，0为主链接失败后才用镜像）",
+    )
+    parser.add_argument(
+        '--checksum', choices=ALGORITHMS, default=DEFAULT_ALGORITHM, metavar='ALGORITHM',
+        help=f"下载时计算并记录在报告中的摘要算法（默认{DEFAULT_ALGORITHM}，可选 {'、'.join(ALGORITHMS)}）；"
+             "表格中的校验列按其自身的算法校验",
+    )
+    parser.add_argument(
+        '--durability', choices=DURABILITY_POLICIES, default=DEFAULT_DURABILITY,
+        help="下载完成的文件何时同步到磁盘：file 每个文件都同步，batch 每 --sync-every 个文件同步一次，"
+             f"none 不主动同步（默认{DEFAULT_DURABILITY}）",
+    )
+    parser.add_argument(
+        '--sync-every', type=int, default=DEFAULT_SYNC_EVERY, metavar='N',
+        help=f"batch策略下每完成多少个文件同步一次（默认{DEFAULT_SYNC_EVERY}）",
+    )
+    parser.add_argument('--dedup', action='store_true', help="按内容去重，内容相同的文件在磁盘上只保留一份")
+    parser.add_argument('--no-parse-cache', action='store_true', help="不使用Excel解析结果的磁盘缓存")
+    parser.add_argument('--report', help="结果报告文件，扩展名为.csv时写CSV，否则写JSON")
+    parser.add_argument('--report-format', choices=REPORT_FORMATS, help="报告格式，默认按扩展名判断")
+    parser.add_argument(
+        '--timing-report',
+        help="按主机汇总DNS、连接、TLS、首字节、传输、写磁盘各阶段耗时的p50/p95/p99，扩展名为.csv时写CSV，否则写JSON",
+    )
+    parser.add_argument('--metrics', help="把同样的统计写成Prometheus文本格式文件，供node exporter的textfile收集器读取")
+    parser.add_argument('-q', '--quiet', action='store_true', help="只输出失败的行和汇总")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not 1 <= args.workers <= MAX_WORKERS:
+        parser.error(f"并发数必须在1到{MAX_WORKERS}之间")
+    if not 1 <= args.segments <= MAX_SEGMENTS:
+        parser.error(f"分段数必须在1到{MAX_SEGMENTS}之间")
+    if args.connect_timeout <= 0 or args.read_timeout <= 0 or args.retries < 0 or args.hedge_delay < 0:
+        parser.error("超时必须大于0，重试次数和对冲等待时间不能为负数")
+    if args.sync_every < 1:
+        parser.error("--sync-every 必须大于0")
+    try:
+        limits, default = parse_host_limits(args.host_limits)
+        rate, schedule = parse_bandwidth(args.bandwidth)
+        min_rate = parse_rate(args.min_speed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workbooks = find_workbooks(args.workbooks)
+    if not workbooks:
+        parser.error("没有找到Excel文件")
+
+    os.makedirs(args.output, exist_ok=True)
+    rate_limiter = HostRateLimiter(limits, default)
+    parse_cache = None if args.no_parse_cache else ParseCache(default_cache_dir())
+    bandwidth = BandwidthLimiter(rate, schedule) if rate or schedule else None
+    batch = BatchQueue(
+        args.output, workers=args.workers, rate_limiter=rate_limiter, dedup_content=args.dedup,
+        parse_cache=parse_cache, max_jobs=args.max_jobs, segments=args.segments,
+        segment_threshold=int(args.segment_threshold * 1024 * 1024), bandwidth=bandwidth,
+        small_first=args.small_first, timeout=(args.connect_timeout, args.read_timeout), retries=args.retries,
+        min_rate=min_rate, stall_window=args.stall_time, hedge_delay=args.hedge_delay, checksum_algorithm=args.checksum,
+        durability=args.durability, sync_every=args.sync_every
+    )
+    priority = {os.path.abspath(path) for path in args.priority} | set(args.priority)
+    for path in workbooks:
+        name = os.path.basename(path)
+        prioritized = os.path.abspath(path) in priority or name in priority or os.path.splitext(name)[0] in priority
+        batch.add(path, priority=1 if prioritized else 0)
+    if bandwidth and not args.quiet:
+        print(f"带宽上限: 当前 {format_rate(bandwidth.current_rate())}")
+
+    records = []
+    timings = []
+
+    def on_result(job, result, status):
+        records.append(result_record(job.path, result, status))
+        if result.timing:
+            timings.append(result.timing)
+        if status == STATUS_FAILED:
+            print(
+                f"{job.path} 第{result.task.index}行 下载失败: {result.task.url} - {result.error}", file=sys.stderr
+            )
+        elif not args.quiet:
+            print(f"{job.path} 第{result.task.index}行 {STATUS_LABELS[status]}: {result.filename}")
+
+    def on_job(job):
+        if job.state == JOB_RUNNING:
+            if not args.quiet:
+                print(f"{job.path}: 开始下载")
+        elif job.state == JOB_DONE:
+            counts = job.counts
+            print(
+                f"{job.path}: 共 {job.total} 个链接"
+                + "".join(f"，{STATUS_LABELS[status]} {counts[status]}" for status in STATUSES if counts[status])
+            )
+        else:
+            print(f"{job.path}: {JOB_LABELS[job.state]}" + (f" - {job.error}" if job.error else ""), file=sys.stderr)
+
+    interrupted = False
+    try:
+        batch.run(on_result=on_result, on_job=on_job)
+    except KeyboardInterrupt:
+        print("已中断，再次运行会跳过已完成的行并续传未完成的文件", file=sys.stderr)
+        interrupted = True
+
+    # 添加时就因文件名前缀冲突而出错的工作簿没有开始过
+    for job in batch.jobs:
+        if job.state == JOB_FAILED and job.download is None and job.error and not interrupted:
+            print(f"{job.path}: {JOB_LABELS[job.state]} - {job.error}", file=sys.stderr)
+
+    totals = batch.counts
+    stats = batch.session.stats()
+    if len(batch.jobs) > 1:
+        print(
+            f"全部 {len(batch.jobs)} 个工作簿: 共 {batch.finished} 行"
+            + "".join(f"，{STATUS_LABELS[status]} {totals[status]}" for status in STATUSES if totals[status])
+        )
+    print(f"连接复用率 {stats['reuse_rate']:.0%}（{stats['requests']} 次请求，新建 {stats['connections']} 个连接）")
+
+    if args.report:
+        summary = {
+            'output': args.output,
+            'workbooks': [
+                {
+                    'workbook': job.path,
+                    'state': job.state,
+                    'error': job.error,
+                    'url_column': job.download.url_column if job.download else None,
+                    'total': job.total,
+                    **job.counts,
+                }
+                for job in batch.jobs
+            ],
+            'totals': totals,
+            'connection_reuse_rate': stats['reuse_rate'],
+            'interrupted': interrupted,
+        }
+        # 按完成顺序记录，报告中按工作簿和行号排列
+        records.sort(key=lambda record: (record['workbook'], record['row']))
+        write_report(args.report, records, summary, fmt=args.report_format)
+    if args.timing_report:
+        write_timing_report(args.timing_report, timings)
+    if args.metrics:
+        write_prometheus(args.metrics, timings)
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    if totals[STATUS_FAILED] or any(job.state != JOB_DONE for job in batch.jobs):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+下载报告
+把每一行的下载结果写成JSON或CSV文件，便于批量任务结束后检查失败的行；
+各阶段耗时按主机汇总的计时报告也写成JSON或CSV
+"""
+
+import csv
+import json
+import os
+
+from transfer_timing import SUMMARY_FIELDS, TIMING_FIELDS, summarize, summary_rows
+
+# 报告中每一行的字段，计时字段见transfer_timing
+REPORT_FIELDS = (
+    'workbook', 'row', 'url', 'status', 'filename', 'size', 'digest', 'duplicate_of', 'error'
+) + TIMING_FIELDS
+REPORT_FORMATS = ('json', 'csv')
+
+
+def report_format(path, fmt=None):
+    """未指定格式时按扩展名判断，不是.csv的都按JSON写"""
+    if fmt:
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"不支持的报告格式: {fmt}")
+        return fmt
+    return 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'json'
+
+
+def result_record(workbook, result, status):
+    """一行的报告记录，跳过、重复链接等没有发出请求的行计时字段为空"""
+    timing = result.timing.as_record() if result.timing else dict.fromkeys(TIMING_FIELDS)
+    return {
+        'workbook': workbook,
+        'row': result.task.index,
+        'url': result.task.url,
+        'status': status,
+        'filename': result.filename,
+        'size': result.size,
+        'digest': result.digest,
+        'duplicate_of': result.duplicate_of,
+        'error': result.error,
+        **timing,
+    }
+
+
+def write_report(path, records, summary, fmt=None):
+    """
+    写出报告：JSON包含汇总和全部行；CSV每行一条记录，汇总不写入
+    先写临时文件再重命名，中断时不会留下不完整的报告
+    """
+    fmt = report_format(path, fmt)
+    tmp = path + '.tmp'
+    if fmt == 'csv':
+        # utf-8-sig让Excel能正确识别中文
+        with open(tmp, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'rows': records}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def write_timing_report(path, timings, fmt=None):
+    """
+    写出按主机汇总的计时报告（各阶段耗时的p50/p95/p99和最大值）
+    JSON按主机嵌套，耗时单位为秒；CSV每个主机的每个阶段一行，耗时单位为毫秒
+    """
+    fmt = report_format(path, fmt)
+    summary = summarize(timings)
+    tmp = path + '.tmp'
+    if fmt == 'csv':
+        with open(tmp, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summary_rows(summary))
+    else:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'hosts': summary}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+落盘策略
+下载的文件先写入 .part 临时文件，完成后原子重命名为最终文件名，中途失败或崩溃不会留下名字正确、内容不完整的文件；
+重命名前后是否调用fsync由策略决定：
+    file   每个文件重命名前同步内容、重命名后同步目录，断电也不丢失已完成的文件，开销最大
+    batch  每完成N个文件统一同步一次这些文件和所在目录，断电时最多丢失最近一批，重新运行时会重新下载
+    none   不调用fsync，由操作系统决定何时写入磁盘
+"""
+
+import errno
+import os
+import threading
+
+DURABILITY_FILE = 'file'
+DURABILITY_BATCH = 'batch'
+DURABILITY_NONE = 'none'
+DURABILITY_POLICIES = (DURABILITY_FILE, DURABILITY_BATCH, DURABILITY_NONE)
+DEFAULT_DURABILITY = DURABILITY_BATCH
+# batch策略下每完成这么多个文件同步一次
+DEFAULT_SYNC_EVERY = 100
+
+# 文件系统不支持fsync（如部分网络文件系统不支持同步目录）时忽略的错误
+_UNSUPPORTED = {errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def fsync_path(path, directory=False):
+    """把文件内容或目录项同步到磁盘；Windows不能打开目录，跳过目录的同步"""
+    if directory and os.name == 'nt':
+        return
+    # Windows上fsync要求可写的文件描述符
+    fd = os.open(path, os.O_RDWR if os.name == 'nt' else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+    finally:
+        os.close(fd)
+
+
+class DurabilityPolicy:
+    """按策略在重命名前后调用fsync，线程安全；批量下载时多个工作簿共享，batch策略按全部工作簿完成的文件数计批"""
+
+    def __init__(self, policy=DEFAULT_DURABILITY, sync_every=DEFAULT_SYNC_EVERY):
+        if policy not in DURABILITY_POLICIES:
+            raise ValueError(f"未知的落盘策略 '{policy}'，可选 {'、'.join(DURABILITY_POLICIES)}")
+        self.policy = policy
+        self.sync_every = max(1, int(sync_every))
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def replace(self, source, target):
+        """把写完的临时文件source原子重命名为target"""
+        if self.policy == DURABILITY_FILE:
+            # 先让内容落盘再重命名，断电后不会出现重命名已生效而内容还没写入的文件
+            fsync_path(source)
+        os.replace(source, target)
+        self.committed(target)
+
+    def committed(self, path):
+        """path已重命名到位：file策略立即同步目录，batch策略凑满一批时同步"""
+        if self.policy == DURABILITY_FILE:
+            fsync_path(os.path.dirname(os.path.abspath(path)), directory=True)
+        elif self.policy == DURABILITY_BATCH:
+            with self._lock:
+                self._pending.append(path)
+                if len(self._pending) < self.sync_every:
+                    return
+                batch, self._pending = self._pending, []
+            self._sync(batch)
+
+    def flush(self):
+        """同步batch策略下还没凑满一批的文件，一批下载结束时调用"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        self._sync(batch)
+
+    @staticmethod
+    def _sync(paths):
+        """先同步各文件的内容，再同步它们所在的目录（每个目录一次）"""
+        directories = set()
+        for path in paths:
+            try:
+                fsync_path(path)
+            except FileNotFoundError:
+                # 同步前已被删除
+                continue
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        for directory in sorted(directories):
+            fsync_path(directory, directory=True)
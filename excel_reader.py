@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+流式Excel读取
+下载时只读取表头和识别出的URL列（以及镜像列、优先级列、校验列），逐行产出 (行号, URL)，内存占用与表格宽度和行数无关；
+预览时逐行产出全部列，可以先显示开头的行再继续读取
+行号与 pd.read_excel 的默认索引一致：第一行为表头，其后的数据行从0开始编号
+"""
+
+import os
+import re
+
+from checksum import algorithm_in_name, parse_checksum
+
+# 列名包含这些关键字的列被识别为URL列
+URL_COLUMN_KEYWORDS = ('url', '链接', '地址')
+# 第一个URL列为主链接，列名包含这些关键字的列为镜像（备用链接）；其他URL列（如缩略图、商品页）不使用
+MIRROR_COLUMN_KEYWORDS = ('mirror', '镜像', '备用')
+# 列名包含这些关键字的列被识别为优先级列
+PRIORITY_COLUMN_KEYWORDS = ('priority', '优先')
+# 列名包含这些关键字、或者（忽略大小写、空格、-和_）恰好是CHECKSUM_COLUMN_NAMES之一、或者写明了摘要算法（如 "SHA256"）的列
+# 可能是校验列；"摘要"常用作说明文字列，不作为关键字
+CHECKSUM_COLUMN_KEYWORDS = ('校验', '哈希')
+CHECKSUM_COLUMN_NAMES = ('checksum', 'hash')
+# 检查可能的校验列开头这么多行的值，有不是摘要的值时不当作校验列
+CHECKSUM_SAMPLE_ROWS = 100
+# 优先级列中表示"不优先"的文字，其他非空文字按优先级1处理
+NOT_PRIORITY_VALUES = ('', '0', '否', '不', 'no', 'n', 'false')
+
+
+def is_url_column(name):
+    name = str(name).lower()
+    return any(keyword in name for keyword in URL_COLUMN_KEYWORDS)
+
+
+def is_mirror_column(name):
+    name = str(name).lower()
+    return any(keyword in name for keyword in MIRROR_COLUMN_KEYWORDS)
+
+
+def find_url_column(columns):
+    """返回第一个URL列（优先取不是镜像列的）的位置，找不到时返回None"""
+    positions = [position for position, name in enumerate(columns) if name is not None and is_url_column(name)]
+    primary = [position for position in positions if not is_mirror_column(columns[position])]
+    return (primary or positions or [None])[0]
+
+
+def find_priority_column(columns, url_position=None):
+    """返回第一个优先级列（不是URL列）的位置，找不到时返回None"""
+    for position, name in enumerate(columns):
+        if position == url_position or name is None:
+            continue
+        if any(keyword in str(name).lower() for keyword in PRIORITY_COLUMN_KEYWORDS):
+            return position
+    return None
+
+
+def is_checksum_column(name):
+    lowered = str(name).lower()
+    if any(keyword in lowered for keyword in CHECKSUM_COLUMN_KEYWORDS):
+        return True
+    return re.sub(r'[-_\s]', '', lowered) in CHECKSUM_COLUMN_NAMES or algorithm_in_name(name) is not None
+
+
+def looks_like_checksums(values, algorithm=None):
+    """values中非空的值都能解析为摘要时返回True"""
+    for value in values:
+        checksum = parse_checksum(value, algorithm)
+        if checksum is not None and not checksum[0]:
+            return False
+    return True
+
+
+def find_checksum_column(columns, excluded=(), sample=None):
+    """
+    返回第一个校验列（不在excluded中）的位置，找不到时返回None
+    sample不为None时用 sample(位置) 取该列开头的一些值，其中有不是摘要的值时不是校验列，继续查找
+    """
+    for position, name in enumerate(columns):
+        if position in excluded or name is None or not is_checksum_column(name):
+            continue
+        if sample is None or looks_like_checksums(sample(position), algorithm_in_name(name)):
+            return position
+    return None
+
+
+def find_mirror_columns(columns, url_position, priority_position=None):
+    """
+    返回主URL列之外的镜像列的位置
+    只有列名写明是镜像的列才算：表格中常有其他不相关的URL列，不能把它们的链接当作同一个文件下载
+    """
+    return [
+        position for position, name in enumerate(columns)
+        if position not in (url_position, priority_position) and name is not None and is_mirror_column(name)
+    ]
+
+
+def parse_priority(value):
+    """把优先级列的值转换为数字，越大越优先：数字按原值，"是"、"x" 等标记为1，空白和"否"为0"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().lower()
+    try:
+        return float(text)
+    except ValueError:
+        return 0 if text in NOT_PRIORITY_VALUES else 1
+
+
+def normalize_url(value):
+    """把单元格的值转换为URL，不是有效的http(s)链接时返回None"""
+    if value is None:
+        return None
+    url = str(value).strip()
+    if url.startswith('http://') or url.startswith('https://'):
+        return url
+    return None
+
+
+class ExcelUrlReader:
+    """
+    按列读取Excel中的URL
+    .xlsx 使用openpyxl只读模式流式解析；.xls 使用xlrd按需加载，只取URL列
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._workbook = None
+        self._sheet = None
+        self._xls = False
+        self.columns = []
+        self.url_column = None
+        self.url_position = None
+        self.priority_position = None
+        self.mirror_positions = []
+        self.checksum_position = None
+        # 校验列列名中写明的摘要算法，没有时按值的长度判断
+        self.checksum_algorithm = None
+        self._open()
+
+    def _open(self):
+        self._xls = os.path.splitext(self.path)[1].lower() == '.xls'
+        if self._xls:
+            import xlrd
+
+            self._workbook = xlrd.open_workbook(self.path, on_demand=True)
+            self._sheet = self._workbook.sheet_by_index(0)
+            header = self._sheet.row_values(0) if self._sheet.nrows else []
+        else:
+            import openpyxl
+
+            self._workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+            self._sheet = self._workbook.worksheets[0]
+            header = next(self._sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+
+        # 与pandas一致，空表头显示为 Unnamed: 序号
+        self.columns = [
+            f"Unnamed: {position}" if value is None or value == '' else str(value)
+            for position, value in enumerate(header)
+        ]
+        self.url_position = find_url_column(self.columns)
+        if self.url_position is not None:
+            self.url_column = self.columns[self.url_position]
+            self.priority_position = find_priority_column(self.columns, self.url_position)
+            self.mirror_positions = find_mirror_columns(self.columns, self.url_position, self.priority_position)
+            self.checksum_position = find_checksum_column(
+                self.columns, [self.url_position, self.priority_position] + self.mirror_positions, self._sample_column
+            )
+            if self.checksum_position is not None:
+                self.checksum_algorithm = algorithm_in_name(self.columns[self.checksum_position])
+
+    def _sample_column(self, position):
+        """返回position这一列开头CHECKSUM_SAMPLE_ROWS行（不含表头）的值"""
+        if self._xls:
+            end = min(self._sheet.nrows, 1 + CHECKSUM_SAMPLE_ROWS)
+            return self._sheet.col_values(position, start_rowx=1, end_rowx=end) if end > 1 else []
+        column = position + 1
+        rows = self._sheet.iter_rows(
+            min_row=2, max_row=1 + CHECKSUM_SAMPLE_ROWS, min_col=column, max_col=column, values_only=True
+        )
+        return [row[0] if row else None for row in rows]
+
+    @property
+    def estimated_rows(self):
+        """工作表声明的数据行数（不含表头），读取前即可得到，未声明时返回None"""
+        if self._xls:
+            return max(0, self._sheet.nrows - 1)
+        max_row = self._sheet.max_row
+        return max(0, max_row - 1) if max_row else None
+
+    def iter_rows(self):
+        """逐行产出全部列的值（不含表头），行宽与表头一致"""
+        width = len(self.columns)
+        if self._xls:
+            rows = (self._sheet.row_values(i) for i in range(1, self._sheet.nrows))
+        else:
+            rows = self._sheet.iter_rows(min_row=2, values_only=True)
+        for row in rows:
+            row = tuple(row[:width])
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            yield row
+
+    def iter_cells(self):
+        """逐行产出 (行号, URL列的原始值)，包括空行"""
+        if self.url_position is None:
+            return
+        if self._xls:
+            for index, value in enumerate(self._sheet.col_values(self.url_position, start_rowx=1)):
+                yield index, value
+        else:
+            column = self.url_position + 1
+            rows = self._sheet.iter_rows(min_row=2, min_col=column, max_col=column, values_only=True)
+            for index, row in enumerate(rows):
+                yield index, row[0] if row else None
+
+    def iter_urls(self):
+        """逐行产出 (行号, URL)，跳过空值和无效链接"""
+        for index, value in self.iter_cells():
+            url = normalize_url(value)
+            if url:
+                yield index, url
+
+    def _iter_columns(self, positions):
+        """逐行产出positions这几列的值（元组）"""
+        if self._xls:
+            yield from zip(*(self._sheet.col_values(position, start_rowx=1) for position in positions))
+            return
+        # 只读取这几列之间的列
+        first, last = min(positions), max(positions)
+        rows = self._sheet.iter_rows(min_row=2, min_col=first + 1, max_col=last + 1, values_only=True)
+        for row in rows:
+            yield tuple(row[position - first] if len(row) > position - first else None for position in positions)
+
+    def iter_url_rows(self):
+        """
+        逐行产出 (行号, URL, 优先级, 镜像URL元组, 校验值)，没有优先级列时优先级为0，
+        校验值为 (算法, 十六进制摘要)，没有校验列或该行为空时为None
+        主URL为空或无效而镜像列有效时，第一个有效的镜像作为这一行的URL
+        """
+        if self.priority_position is None and not self.mirror_positions and self.checksum_position is None:
+            for index, url in self.iter_urls():
+                yield index, url, 0, (), None
+            return
+        positions = [self.url_position] + self.mirror_positions + [self.priority_position, self.checksum_position]
+        width = 1 + len(self.mirror_positions)
+        # 没有的列不读取，对应的值为None
+        present = [position for position in positions if position is not None]
+        for index, row in enumerate(self._iter_columns(present)):
+            cells = iter(row)
+            values = [next(cells) if position is not None else None for position in positions]
+            urls = [normalize_url(value) for value in values[:width]]
+            urls = [url for i, url in enumerate(urls) if url and url not in urls[:i]]
+            if not urls:
+                continue
+            priority = parse_priority(values[width])
+            checksum = parse_checksum(values[width + 1], self.checksum_algorithm)
+            yield index, urls[0], priority, tuple(urls[1:]), checksum
+
+    def close(self):
+        if self._workbook is None:
+            return
+        if self._xls:
+            self._workbook.release_resources()
+        else:
+            self._workbook.close()
+        self._workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+HTTP连接池
+所有下载共享一个保持长连接的会话，每个主机一个连接池，并统计连接复用情况
+"""
+
+import threading
+
+import transfer_timing
+
+# 同时缓存连接池的主机数
+DEFAULT_MAX_HOSTS = 32
+
+
+class PooledSession:
+    """按主机复用连接的共享会话，连接池大小与下载并发数一致"""
+
+    def __init__(self, pool_size, max_hosts=DEFAULT_MAX_HOSTS):
+        # requests导入较慢，第一次下载时才加载，不拖慢程序启动
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.pool_size = max(1, int(pool_size))
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+        )
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        # 新建的连接记录DNS、连接和TLS握手的耗时，见transfer_timing
+        transfer_timing.install(self.adapter.poolmanager)
+
+        # 连接池被淘汰或关闭前把它的计数累加到这里，保证统计不丢失
+        self._lock = threading.Lock()
+        self._retired = {}
+        pools = self.adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
+            self._accumulate(self._retired, pool)
+            if dispose:
+                dispose(pool)
+
+        pools.dispose_func = retire
+
+    def _accumulate(self, totals, pool):
+        with self._lock:
+            host = totals.setdefault(pool.host, {'requests': 0, 'connections': 0})
+            host['requests'] += pool.num_requests
+            host['connections'] += pool.num_connections
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def stats(self):
+        """
+        返回连接复用统计
+        requests为发出的请求数，connections为新建的连接数，其余请求都复用了已有连接
+        """
+        with self._lock:
+            per_host = {host: dict(counts) for host, counts in self._retired.items()}
+        pools = self.adapter.poolmanager.pools
+        with pools.lock:
+            live = [pools[key] for key in pools.keys()]
+        for pool in live:
+            host = per_host.setdefault(pool.host, {'requests': 0, 'connections': 0})
+            host['requests'] += pool.num_requests
+            host['connections'] += pool.num_connections
+
+        total_requests = sum(counts['requests'] for counts in per_host.values())
+        total_connections = sum(counts['connections'] for counts in per_host.values())
+        reused = max(0, total_requests - total_connections)
+        return {
+            'requests': total_requests,
+            'connections': total_connections,
+            'reused': reused,
+            'reuse_rate': reused / total_requests if total_requests else 0.0,
+            'hosts': per_host,
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Excel解析结果缓存
+以 (文件路径, 大小, 修改时间) 为键缓存解析出的数据，预览和下载共用；
+会话内保存在内存中，可选地以pickle二进制格式保存到磁盘，再次打开未修改的文件时无需重新解析
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# 内存中最多缓存的条目数
+DEFAULT_MAX_ENTRIES = 8
+# 磁盘上最多保留的缓存文件数，超出时删除最久未修改的
+DEFAULT_MAX_DISK_FILES = 64
+# 超过该行数的URL列解析结果不缓存，避免大表格长期占用内存
+MAX_CACHED_ROWS = 500000
+# 预览缓存的是全部列，按单元格数限制：超过的表格每次预览重新读取，不写入磁盘也不留在内存中
+MAX_CACHED_CELLS = 1000000
+# 缓存格式版本，解析结果的结构变化时递增以丢弃旧缓存
+# 3: URL列的缓存行增加了优先级、镜像和校验值
+# 4: 不再把"摘要"列和值不是摘要的列当作校验列
+CACHE_VERSION = 4
+
+
+def default_cache_dir():
+    """磁盘缓存目录，可通过环境变量 DOWNLOAD_RENAME_CACHE_DIR 指定"""
+    return os.environ.get('DOWNLOAD_RENAME_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'download_rename'
+    )
+
+
+class ParseCache:
+    """Excel解析结果的两级缓存（内存LRU + 可选的磁盘），可在多个线程间共享"""
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES, max_disk_files=DEFAULT_MAX_DISK_FILES):
+        # cache_dir为None时只在内存中缓存
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_files = max_disk_files
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path):
+        """读取文件前调用，文件内容变化后大小或修改时间不同，旧缓存自然失效"""
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _disk_path(self, key, kind):
+        digest = hashlib.sha1(repr((CACHE_VERSION, key, kind)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pickle")
+
+    def get(self, key, kind):
+        """返回缓存的解析结果，没有时返回None；kind区分同一文件的不同解析结果（如预览和URL列）"""
+        with self._lock:
+            value = self._memory.get((key, kind))
+            if value is not None:
+                self._memory.move_to_end((key, kind))
+                return value
+
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key, kind), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        self._remember(key, kind, value)
+        return value
+
+    def put(self, key, kind, value):
+        self._remember(key, kind, value)
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._disk_path(key, kind)
+            # 先写临时文件再重命名，避免中断时留下不完整的缓存
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            self._prune_disk()
+        except OSError:
+            # 磁盘缓存只是加速手段，写入失败不影响使用
+            pass
+
+    def _prune_disk(self):
+        files = [
+            os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.pickle')
+        ]
+        if len(files) <= self.max_disk_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk_files]:
+            os.remove(path)
+
+    def _remember(self, key, kind, value):
+        with self._lock:
+            self._memory[(key, kind)] = value
+            self._memory.move_to_end((key, kind))
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
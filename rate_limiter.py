@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+按主机限速
+每个主机一个令牌桶（每秒请求数）加一个在途请求数上限，可按域名分别配置
+"""
+
+import threading
+import time
+
+# 未单独配置的主机使用的默认限制
+DEFAULT_RATE = 8.0
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+class HostLimit:
+    """单个主机的限制：每秒请求数和最大在途请求数"""
+
+    def __init__(self, rate=DEFAULT_RATE, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        if rate <= 0 or max_in_flight < 1:
+            raise ValueError("每秒请求数必须大于0，最大并发数至少为1")
+        self.rate = float(rate)
+        self.max_in_flight = int(max_in_flight)
+
+    def __repr__(self):
+        return f"HostLimit(rate={self.rate:g}, max_in_flight={self.max_in_flight})"
+
+
+class TokenBucket:
+    """令牌桶，容量为1秒的令牌量（至少1个），调用方负责加锁"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """距离下一个令牌可用还需等待的秒数，0表示现在就有"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _HostState:
+    def __init__(self, limit):
+        self.limit = limit
+        self.bucket = TokenBucket(limit.rate)
+        self.in_flight = 0
+
+
+class HostRateLimiter:
+    """
+    按主机限速器
+    try_acquire不阻塞，由调度方决定先派发哪个主机的任务，不同主机之间互不影响
+    """
+
+    def __init__(self, limits=None, default=None):
+        self.limits = {host.lower().lstrip('.'): limit for host, limit in (limits or {}).items()}
+        self.default = default or HostLimit()
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def limit_for(self, host):
+        """按域名匹配限制，配置 example.com 同时适用于它的子域名"""
+        host = (host or '').lower()
+        parts = host.split('.')
+        for i in range(len(parts)):
+            limit = self.limits.get('.'.join(parts[i:]))
+            if limit is not None:
+                return limit
+        return self.default
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.limit_for(host))
+        return state
+
+    def try_acquire(self, host):
+        """
+        尝试为主机占用一个请求名额
+        返回 (是否成功, 建议多少秒后重试)；因在途请求已满而失败时重试时间为None，需等有请求结束
+        """
+        with self._lock:
+            state = self._state(host)
+            if state.in_flight >= state.limit.max_in_flight:
+                return False, None
+            delay = state.bucket.delay()
+            if delay > 0:
+                return False, delay
+            state.bucket.take()
+            state.in_flight += 1
+            return True, 0.0
+
+    def release(self, host):
+        """请求结束后归还在途名额"""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None and state.in_flight > 0:
+                state.in_flight -= 1
+
+
+def parse_host_limits(text):
+    """
+    解析限速配置，格式为 "域名=每秒请求数/最大并发"，多条用分号或换行分隔
+    域名写 * 表示默认限制，例如 "*=8/4; cdn.example.com=50/16; slow.example.org=0.5/1"
+    返回 (limits, default)
+    """
+    limits = {}
+    default = None
+    for item in text.replace('\n', ';').split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            host, value = item.split('=', 1)
+            rate, _, max_in_flight = value.partition('/')
+            limit = HostLimit(float(rate), int(max_in_flight) if max_in_flight.strip() else DEFAULT_MAX_IN_FLIGHT)
+        except ValueError as e:
+            raise ValueError(f"无法解析限速配置 '{item}': {e}")
+        host = host.strip()
+        if host == '*':
+            default = limit
+        else:
+            limits[host] = limit
+    return limits, default
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+重试和熔断
+临时性错误（5xx、429、408、连接中断、超时、内容校验失败）按指数退避重试，服务器给出Retry-After时遵守；
+同一主机连续失败达到阈值后熔断，该主机余下的行直接判为失败，冷却后放行一个请求探测主机是否恢复
+"""
+
+import email.utils
+import random
+import threading
+import time
+
+from checksum import ChecksumMismatch
+
+# 默认连接超时和读取超时（秒）：连接不上的主机很快放弃，慢速的大文件下载不会被误判超时
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+# 每一行临时性错误的最多重试次数
+DEFAULT_RETRIES = 3
+# 指数退避：第n次重试前等待 RETRY_BASE_DELAY * 2^(n-1) 秒（加随机抖动），不超过RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# 服务器要求的Retry-After超过这个秒数时按这个值等待
+RETRY_AFTER_LIMIT = 300.0
+# 需要重试的HTTP状态码
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+# 这些状态码说明主机正常工作，只是暂时拒绝请求，不计入熔断
+ALIVE_STATUSES = frozenset((408, 429))
+
+# 同一主机连续这么多次临时性失败后熔断
+DEFAULT_FAILURE_THRESHOLD = 5
+# 熔断后的冷却时间（秒），探测失败时加倍，不超过MAX_COOLDOWN
+DEFAULT_COOLDOWN = 30.0
+MAX_COOLDOWN = 600.0
+
+
+def error_status(error):
+    """HTTP错误的状态码，不是HTTP错误时返回None"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_transient(error):
+    """临时性错误：重试可能成功"""
+    if isinstance(error, ChecksumMismatch):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status in RETRY_STATUSES
+    # 只有发出过请求才会走到这里，此时requests已经导入
+    import requests
+    import urllib3
+
+    # 流式读取时连接中断或读取超时抛出的是urllib3或系统的异常，不会被requests包装
+    return isinstance(error, (
+        requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+        urllib3.exceptions.HTTPError, ConnectionError, TimeoutError,
+    ))
+
+
+def is_host_failure(error):
+    """主机无法正常服务（连不上、超时、5xx），计入熔断；内容校验失败不计入"""
+    if isinstance(error, ChecksumMismatch):
+        return False
+    return is_transient(error) and error_status(error) not in ALIVE_STATUSES
+
+
+def retry_after(error):
+    """解析错误响应中的Retry-After（秒数或HTTP日期），没有时返回None"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after', '').strip() if response is not None else ''
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def retry_delay(error, attempt):
+    """第attempt次重试（从1开始）前等待的秒数"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    # 抖动，避免同时失败的请求同时重试
+    delay *= random.uniform(0.5, 1.0)
+    requested = retry_after(error)
+    if requested is not None:
+        delay = max(delay, min(requested, RETRY_AFTER_LIMIT))
+    return delay
+
+
+class _Circuit:
+    def __init__(self):
+        self.failures = 0
+        self.open_until = None
+        self.cooldown = 0.0
+        self.probing = False
+
+
+class CircuitBreaker:
+    """
+    按主机熔断，线程安全
+    连续失败达到阈值后断开：冷却期内allow()返回False；冷却后只放行一个探测请求，成功则恢复，失败则冷却时间加倍
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def allow(self, host):
+        """主机是否可以发送请求"""
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None or circuit.open_until is None:
+                return True
+            if circuit.probing or time.monotonic() < circuit.open_until:
+                return False
+            circuit.probing = True
+            return True
+
+    def cancel_probe(self, host):
+        """allow()放行的探测请求最终没有发出时调用，下次allow()再放行"""
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is not None:
+                circuit.probing = False
+
+    def is_open(self, host):
+        with self._lock:
+            circuit = self._hosts.get(host)
+            return circuit is not None and circuit.open_until is not None
+
+    def failures(self, host):
+        with self._lock:
+            circuit = self._hosts.get(host)
+            return circuit.failures if circuit else 0
+
+    def record_success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            circuit = self._hosts.setdefault(host, _Circuit())
+            circuit.failures += 1
+            if circuit.probing:
+                # 探测失败，继续断开更长时间
+                circuit.probing = False
+                circuit.cooldown = min(circuit.cooldown * 2, MAX_COOLDOWN)
+                circuit.open_until = time.monotonic() + circuit.cooldown
+            elif circuit.open_until is None and circuit.failures >= self.failure_threshold:
+                circuit.cooldown = self.cooldown
+                circuit.open_until = time.monotonic() + circuit.cooldown
@@ -17,6 +17,7 @@ setup(
     entry_points={
         "console_scripts": [
             "download_rename_app=download_rename_app:main",
+            "download_rename_cli=download_rename_cli:main",
         ],
     },
     classifiers=[
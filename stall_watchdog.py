@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+传输停滞监测
+读取超时只限制两次收到数据之间的间隔，服务器每隔几秒发送少量数据时，一个下载会一直占着名额；
+监测线程定期计算每个传输最近一段时间的平均速度，低于下限时断开它的连接，由引擎重新排队（从断点续传）
+"""
+
+import socket
+import threading
+import time
+from collections import deque
+
+# 默认速度下限（字节/秒）和判定时间（秒）：连续60秒平均低于10KB/s视为停滞
+DEFAULT_MIN_RATE = 10 * 1024
+DEFAULT_STALL_WINDOW = 60.0
+# 监测线程的检查间隔（秒）
+CHECK_INTERVAL = 1.0
+
+
+class StalledTransfer(ConnectionError):
+    """传输速度长时间低于下限，连接已被断开；属于临时性错误，会重试"""
+
+
+def abort_response(response):
+    """
+    从其他线程中断正在读取的响应：关闭底层socket的读写，阻塞在读取上的线程会立即出错返回
+    取不到socket时直接关闭响应
+    """
+    raw = getattr(response, 'raw', None)
+    connection = getattr(raw, 'connection', None) or getattr(raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        response.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class Transfer:
+    """一个正在进行的传输，每读到一块数据调用add()；等待带宽限制的时间不计入速度"""
+
+    def __init__(self, watchdog, response):
+        self.watchdog = watchdog
+        self.response = response
+        self.received = 0
+        self.stalled = False
+        self._throttled = 0.0
+        self._waiting_since = None
+        # (不含等待带宽的时间, 已收到的字节数)，由监测线程记录
+        self._history = deque([(self.clock(), 0)])
+
+    def clock(self):
+        """不含等待带宽限制的时间"""
+        now = time.monotonic()
+        waiting = now - self._waiting_since if self._waiting_since is not None else 0.0
+        return now - self._throttled - waiting
+
+    def add(self, count):
+        self.received += count
+
+    def begin_wait(self):
+        self._waiting_since = time.monotonic()
+
+    @property
+    def throttled(self):
+        """已经等待带宽限制的秒数"""
+        return self._throttled
+
+    def end_wait(self):
+        if self._waiting_since is not None:
+            self._throttled += time.monotonic() - self._waiting_since
+            self._waiting_since = None
+
+    def check(self):
+        """由监测线程调用：最近window秒的平均速度低于下限时返回True"""
+        now = self.clock()
+        self._history.append((now, self.received))
+        window = self.watchdog.window
+        # 保留窗口起点之前最近的一个记录
+        while len(self._history) > 1 and self._history[1][0] <= now - window:
+            self._history.popleft()
+        since, received = self._history[0]
+        if now - since < window:
+            return False
+        return (self.received - received) / (now - since) < self.watchdog.min_rate
+
+    def __enter__(self):
+        self.watchdog._register(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.watchdog._unregister(self)
+        if self.stalled:
+            raise StalledTransfer(
+                f"传输过慢：{self.watchdog.window:g} 秒内平均速度低于 {self.watchdog.min_rate / 1024:g} KB/s，已断开重试"
+            ) from exc_value
+        return False
+
+
+class StallWatchdog:
+    """
+    监测多个传输的速度，线程安全
+    有传输时才运行监测线程，没有传输时线程退出；min_rate为0时不监测
+    """
+
+    def __init__(self, min_rate=DEFAULT_MIN_RATE, window=DEFAULT_STALL_WINDOW, interval=CHECK_INTERVAL):
+        self.min_rate = min_rate
+        self.window = window
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._transfers = set()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.min_rate and self.window)
+
+    def watch(self, response):
+        """返回监测response的Transfer，用with包住读取过程；停滞被断开时在退出with时抛出StalledTransfer"""
+        return Transfer(self, response)
+
+    def _register(self, transfer):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._transfers.add(transfer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _unregister(self, transfer):
+        with self._lock:
+            self._transfers.discard(transfer)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._transfers:
+                    self._thread = None
+                    return
+                transfers = list(self._transfers)
+            for transfer in transfers:
+                if transfer.stalled or not transfer.check():
+                    continue
+                with self._lock:
+                    # 传输已结束时连接可能已归还连接池给其他请求使用，不能再断开
+                    if transfer in self._transfers:
+                        transfer.stalled = True
+                        abort_response(transfer.response)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+流式写入
+响应体每收到一块就写入文件，每次只取已经到达的数据（能读入每个线程复用的缓冲区时不产生新的bytes对象）；
+块大小随传输速度自适应，已知长度时预先分配磁盘空间
+"""
+
+import errno
+import os
+import threading
+import time
+
+# 自适应块大小的范围
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+# 每次读取的目标耗时（秒）：读得快时加大块，读得慢时减小块，使块大小大致等于这段时间内能收到的数据量
+TARGET_READ_TIME = 0.1
+
+_local = threading.local()
+
+
+def _buffer(size):
+    """当前线程复用的缓冲区，不够大时换成更大的"""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _local.buffer = bytearray(size)
+    return buffer
+
+
+def _reader(raw):
+    """
+    返回 read(size)，每次返回不超过size字节的数据，读完时返回空；
+    只取已经到达的数据、不等凑满size，传输停滞被断开时已收到的数据已经写入文件，续传从实际收到的位置继续：
+        有readinto1时读入当前线程复用的缓冲区
+        没有时用read1，每次产生一个bytes对象；urllib3 2.x属于这种，它的readinto也是先read出bytes再复制，
+        读入复用的缓冲区省不下这次分配
+        都没有时用readinto，要等凑满一块才返回
+    """
+    readinto1 = getattr(raw, 'readinto1', None)
+    read1 = getattr(raw, 'read1', None)
+    if readinto1 is None and read1 is not None:
+        return read1
+    readinto = readinto1 or raw.readinto
+
+    def read_buffer(size):
+        view = memoryview(_buffer(size))[:size]
+        return view[:readinto(view)]
+
+    return read_buffer
+
+
+def preallocate(f, size):
+    """
+    把文件预先分配到size字节，减少碎片，磁盘空间不足时在开始下载前就报错
+    文件系统不支持时忽略
+    """
+    position = f.tell()
+    if size <= position or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), position, size - position)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+
+
+def is_encoded(response):
+    """响应体经过压缩等编码时需要由requests解码，不能直接读取原始数据"""
+    return response.headers.get('content-encoding', 'identity').lower() not in ('', 'identity')
+
+
+def stream_to_file(response, f, hasher=None, truncate=True, on_read=None, timing=None):
+    """
+    把响应体从f的当前位置开始写入，返回写入的字节数；hasher不为None时同时计算摘要
+    truncate为True时，结束时（包括出错）把文件截断到实际写入的位置，预分配而未写入的部分不会被续传当作已下载的内容；
+    分段下载时各段写入同一文件的不同位置，不能截断
+    on_read不为None时每读到一块数据调用 on_read(字节数)，用于带宽限制（在其中阻塞）和速度监测
+    timing不为None时把写文件的耗时记入 timing.add('disk', 秒数)
+    """
+    def timed_write(data):
+        began = time.perf_counter()
+        f.write(data)
+        timing.add('disk', time.perf_counter() - began)
+
+    write = f.write if timing is None else timed_write
+
+    start = f.tell()
+    written = 0
+    try:
+        if is_encoded(response):
+            for chunk in response.iter_content(chunk_size=MAX_CHUNK_SIZE):
+                write(chunk)
+                written += len(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                if on_read:
+                    on_read(len(chunk))
+            return written
+
+        length = response.headers.get('content-length', '')
+        if length.isdigit():
+            preallocate(f, start + int(length))
+
+        read = _reader(response.raw)
+        chunk_size = MIN_CHUNK_SIZE
+        while True:
+            began = time.monotonic()
+            data = read(chunk_size)
+            count = len(data)
+            if not count:
+                break
+            write(data)
+            if hasher:
+                hasher.update(data)
+            written += count
+            if on_read:
+                on_read(count)
+
+            elapsed = time.monotonic() - began
+            # 只取已到达的数据时很少正好读满一块，收到超过半块就说明数据到达得比读取快
+            if count > chunk_size // 2 and elapsed < TARGET_READ_TIME / 2:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+            elif elapsed > TARGET_READ_TIME * 2:
+                chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+        return written
+    finally:
+        if truncate:
+            f.truncate(start + written)
@@ -8,6 +8,11 @@ import tkinter as tk
 from tkinter import messagebox
 import sys
 import os
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 def test_tkinter():
     """测试tkinter是否正常工作"""
@@ -24,6 +29,78 @@ def test_tkinter():
         print(f"tkinter测试失败: {e}")
         return False
 
+def test_virtual_table():
+    """测试虚拟表格按页读取、淘汰旧页、复用行、限制滚动范围和后台加载时重新读取最后一页（没有显示器时跳过）"""
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"⚠️ 没有显示器，跳过虚拟表格测试: {e}")
+        return True
+    try:
+        from types import SimpleNamespace
+        from virtual_table import VirtualTable
+        
+        root.withdraw()
+        data = [(f"a{i}", f"b{i}") for i in range(300)]
+        loaded = 250
+        fetched = []
+        
+        def fetch(start, stop):
+            fetched.append((start, stop))
+            return data[start:min(stop, loaded)]
+            
+        def shown():
+            return [table.tree.item(item, "values")[0] for item in table.tree.get_children()]
+            
+        table = VirtualTable(root, height=10, page_size=100, max_pages=2)
+        table.set_source(["A", "B"], loaded, fetch)
+        slots = table.tree.get_children()
+        assert len(slots) == 10 and shown()[0] == "a0" and fetched == [(0, 100)]
+        
+        # 滚动时原地更新已有的行，跨页时读取下一页
+        table.scroll_to(95)
+        assert table.tree.get_children() == slots
+        assert shown() == [f"a{i}" for i in range(95, 105)]
+        assert fetched == [(0, 100), (100, 200)]
+        # 最多保留2页，最久未用的页被淘汰，再次用到时重新读取
+        table.scroll_to(205)
+        assert list(table._pages) == [1, 2], list(table._pages)
+        table.scroll_to(0)
+        assert fetched[-1] == (0, 100)
+        
+        # 滚动范围限制在 [0, 行数 - 一屏行数]
+        table.scroll_to(10000)
+        assert table.first == loaded - 10 and shown()[-1] == f"a{loaded - 1}"
+        table.scroll(-10000)
+        assert table.first == 0
+        
+        # 后台继续加载：原来只取到一部分的最后一页被丢弃并重新读取
+        loaded = 120
+        table.set_source(["A", "B"], loaded, fetch)
+        table.scroll_to(110)
+        assert shown()[-1] == "a119" and fetched[-1] == (100, 120)
+        loaded = 300
+        table.set_row_count(loaded)
+        assert fetched[-1] == (100, 200)
+        table.scroll_to(120)
+        assert shown() == [f"a{i}" for i in range(120, 130)]
+        
+        # 控件高度变化时调整一屏的行数，多余的行被删除
+        table._on_configure(SimpleNamespace(height=table.row_height * 6 + 4))
+        assert table.visible_rows == 5 and len(table.tree.get_children()) == 5
+        table.set_row_count(3)
+        assert table.first == 0 and shown() == ["a0", "a1", "a2"]
+        table.clear()
+        assert table.tree.get_children() == ()
+        
+        print("✅ 虚拟表格工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 虚拟表格测试失败: {e!r}")
+        return False
+    finally:
+        root.destroy()
+
 def test_imports():
     """测试必要的导入"""
     try:
@@ -41,6 +118,28 @@ def test_file_structure():
     """测试文件结构"""
     required_files = [
         "download_rename_app.py",
+        "download_engine.py",
+        "http_pool.py",
+        "rate_limiter.py",
+        "download_journal.py",
+        "content_store.py",
+        "excel_reader.py",
+        "parse_cache.py",
+        "virtual_table.py",
+        "ui_events.py",
+        "download_job.py",
+        "download_report.py",
+        "download_rename_cli.py",
+        "benchmark_startup.py",
+        "benchmark_download.py",
+        "batch_queue.py",
+        "stream_writer.py",
+        "bandwidth.py",
+        "retry_policy.py",
+        "stall_watchdog.py",
+        "transfer_timing.py",
+        "checksum.py",
+        "durability.py",
         "requirements.txt",
         "README.md"
     ]
@@ -57,6 +156,1703 @@ def test_file_structure():
         print("✅ 所有必需文件都存在")
         return True
 
+class QuietHandler(SimpleHTTPRequestHandler):
+    """不输出访问日志、支持长连接的静态文件处理器"""
+    
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+class RangeHandler(QuietHandler):
+    """支持单段Range请求和ETag条件请求的静态文件处理器，记录收到的Range请求头"""
+    
+    range_requests = []
+    get_requests = []
+    # 从这些位置开始的Range请求只发送一半内容就断开连接（只断开一次），用于测试重试
+    cut_ranges = set()
+    
+    def do_GET(self):
+        self.get_requests.append(self.path)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        
+        etag = f'"{len(data)}-{int(os.path.getmtime(path))}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        
+        start, end = 0, len(data)
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            self.range_requests.append(byte_range)
+            first, last = byte_range.split("=", 1)[1].split("-", 1)
+            start = int(first)
+            end = int(last) + 1 if last else len(data)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if byte_range and start in self.cut_ranges:
+            self.cut_ranges.discard(start)
+            self.wfile.write(data[start:(start + end) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:end])
+
+def start_test_server(directory, handler=QuietHandler):
+    """在本地随机端口启动静态文件服务器"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_download_engine():
+    """测试并发下载引擎的命名和逐行结果"""
+    try:
+        from download_engine import DownloadEngine, DownloadTask
+        from rate_limiter import HostLimit, HostRateLimiter
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(5):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(os.urandom(1024 * (i + 1)))
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            try:
+                tasks = [DownloadTask(i, f"{base}/file{i}.pdf") for i in range(5)]
+                tasks.append(DownloadTask(5, f"{base}/missing.pdf"))
+                engine = DownloadEngine(dst, "051", workers=3, rate_limiter=HostRateLimiter(default=HostLimit(1000, 3)))
+                results = engine.run(tasks)
+                stats = engine.connection_stats()
+            finally:
+                server.shutdown()
+                server.server_close()
+            
+            by_index = {result.task.index: result for result in results}
+            assert len(results) == 6
+            assert not by_index[5].success
+            for i in range(5):
+                assert by_index[i].filename == f"051_{i:03d}.pdf"
+                assert os.path.getsize(os.path.join(dst, f"051_{i:03d}.pdf")) == 1024 * (i + 1)
+            # 连接数不超过并发数，其余请求复用长连接
+            assert stats["requests"] == 6
+            assert stats["connections"] <= 3
+            assert stats["reused"] == stats["requests"] - stats["connections"]
+                
+        print("✅ 并发下载引擎工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 下载引擎测试失败: {e!r}")
+        return False
+
+def test_rate_limiter():
+    """测试按主机限速的配置解析和令牌桶"""
+    try:
+        from rate_limiter import HostRateLimiter, parse_host_limits
+        
+        limits, default = parse_host_limits("*=10/2; example.com=1/1")
+        limiter = HostRateLimiter(limits, default)
+        assert limiter.limit_for("cdn.example.com").max_in_flight == 1
+        assert limiter.limit_for("other.org").rate == 10
+        
+        # 在途请求数达到上限后必须等待释放
+        assert limiter.try_acquire("a.example.com") == (True, 0.0)
+        assert limiter.try_acquire("a.example.com") == (False, None)
+        limiter.release("a.example.com")
+        # 令牌用完后返回需要等待的时间
+        acquired, delay = limiter.try_acquire("a.example.com")
+        assert not acquired and 0 < delay <= 1
+        # 其他主机不受影响
+        assert limiter.try_acquire("other.org")[0]
+        
+        try:
+            parse_host_limits("example.com=abc")
+            raise AssertionError("无效配置应报错")
+        except ValueError:
+            pass
+            
+        print("✅ 主机限速工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 主机限速测试失败: {e!r}")
+        return False
+
+def test_resume_download():
+    """测试断点续传和下载日志跳过已完成的行"""
+    try:
+        from download_engine import DownloadEngine, DownloadTask
+        from download_journal import DownloadJournal
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            data = os.urandom(100 * 1024)
+            with open(os.path.join(src, "big.zip"), "wb") as f:
+                f.write(data)
+            server = start_test_server(src, RangeHandler)
+            url = f"http://127.0.0.1:{server.server_address[1]}/big.zip"
+            
+            # 模拟上次运行中断：日志中有未完成记录，.part 中已有前40KB；另一行已经完成
+            journal = DownloadJournal(dst, "051")
+            journal.mark_started(0, url)
+            with open(os.path.join(dst, "051_000.part"), "wb") as f:
+                f.write(data[:40 * 1024])
+            with open(os.path.join(dst, "051_001.zip"), "wb") as f:
+                f.write(data)
+            journal.mark_done(1, url, "051_001.zip", len(data))
+                
+            try:
+                RangeHandler.range_requests.clear()
+                tasks = [DownloadTask(0, url), DownloadTask(1, url)]
+                results = {r.task.index: r for r in DownloadEngine(dst, "051", journal=journal).run(tasks)}
+                assert results[0].success and not results[0].skipped, results[0].error
+                assert RangeHandler.range_requests == [f"bytes={40 * 1024}-"]
+                with open(os.path.join(dst, "051_000.zip"), "rb") as f:
+                    assert f.read() == data
+                assert not os.path.exists(os.path.join(dst, "051_000.part"))
+                # 上次已完成的行直接跳过
+                assert results[1].skipped and results[1].filename == "051_001.zip"
+                
+                # 整批完成后日志清空，下次运行重新检查每一行
+                assert journal.completed_filename(0, url) is None
+            finally:
+                journal.close()
+                server.shutdown()
+                server.server_close()
+                
+        print("✅ 断点续传工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 断点续传测试失败: {e!r}")
+        return False
+
+def test_conditional_resync():
+    """测试再次运行时通过ETag条件请求跳过未变化的文件"""
+    try:
+        from download_engine import DownloadEngine, DownloadTask
+        from download_journal import MetadataCache
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for name in ("report.pdf", "other.pdf", "third.pdf"):
+                with open(os.path.join(src, name), "wb") as f:
+                    f.write(os.urandom(8 * 1024))
+            server = start_test_server(src, RangeHandler)
+            url = f"http://127.0.0.1:{server.server_address[1]}/report.pdf"
+            other = f"http://127.0.0.1:{server.server_address[1]}/other.pdf"
+            third = f"http://127.0.0.1:{server.server_address[1]}/third.pdf"
+            cache = MetadataCache(dst)
+            
+            try:
+                # 同一行此前是另一个URL，之后下载的文件覆盖了它：旧URL的记录不再指向这个文件（大小相同也不行）
+                DownloadEngine(dst, "051", metadata_cache=cache).run([DownloadTask(0, other), DownloadTask(4, third)])
+                assert cache.get(other).filename == "051_000.pdf" and cache.get(third).filename == "051_004.pdf"
+                first = DownloadEngine(dst, "051", metadata_cache=cache).run([DownloadTask(0, url)])
+                assert first[0].success and not first[0].unchanged
+                assert cache.get(url).etag
+                mtime = os.path.getmtime(os.path.join(dst, "051_000.pdf"))
+                
+                # 第二次运行：未变化的文件不重写，同一批中相同URL的另一行直接复用
+                second = DownloadEngine(dst, "051", metadata_cache=cache).run([DownloadTask(0, url), DownloadTask(4, url)])
+                second = {result.task.index: result for result in second}
+                assert second[0].unchanged and second[4].duplicate_of == 0
+                assert os.path.getmtime(os.path.join(dst, "051_000.pdf")) == mtime
+                assert os.path.getsize(os.path.join(dst, "051_004.pdf")) == 8 * 1024
+                assert cache.get(other) is None
+                # 第4行复制了第0行的文件，原来下载到第4行的URL的记录也被删除
+                assert cache.get(third) is None
+            finally:
+                cache.close()
+                server.shutdown()
+                server.server_close()
+                
+        print("✅ 条件请求工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 条件请求测试失败: {e!r}")
+        return False
+
+def test_duplicate_urls():
+    """测试重复URL只下载一次，以及内容相同的文件按内容去重"""
+    try:
+        from content_store import ContentStore
+        from download_engine import DownloadEngine, DownloadTask
+        from rate_limiter import HostLimit, HostRateLimiter
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            data = os.urandom(16 * 1024)
+            for name in ("logo.png", "logo-copy.png"):
+                with open(os.path.join(src, name), "wb") as f:
+                    f.write(data)
+            server = start_test_server(src, RangeHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            store = ContentStore(dst)
+            
+            try:
+                RangeHandler.get_requests.clear()
+                tasks = [DownloadTask(i, f"{base}/logo.png") for i in range(4)]
+                tasks.append(DownloadTask(4, f"{base}/logo-copy.png"))
+                results = DownloadEngine(dst, "051", workers=2, content_store=store).run(tasks)
+            finally:
+                server.shutdown()
+                server.server_close()
+                
+            assert all(result.success for result in results)
+            assert RangeHandler.get_requests.count("/logo.png") == 1
+            assert sum(result.duplicate_of is not None for result in results) == 3
+            inodes = {os.stat(os.path.join(dst, f"051_{i:03d}.png")).st_ino for i in range(5)}
+            assert len(inodes) == 1
+            assert store.deduplicated == 1 and store.saved_bytes == len(data)
+
+        # 只记住最近完成的URL：不收集结果时，占用的内存不随行数增长
+        import tracemalloc
+        import download_engine
+
+        class StubEngine(DownloadEngine):
+            downloaded = None
+
+            def _fetch(self, task, attempt):
+                if self.downloaded is not None:
+                    self.downloaded.append(task.url)
+                return download_engine.DownloadResult(task, filename=f"x{task.index}.bin", size=1)
+
+        def peak_memory(rows):
+            tracemalloc.start()
+            try:
+                engine.run((DownloadTask(i, f"http://example.com/{i}") for i in range(rows)), collect_results=False)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        limit = download_engine.FINISHED_URL_LIMIT
+        download_engine.FINISHED_URL_LIMIT = 100
+        try:
+            with tempfile.TemporaryDirectory() as dst:
+                engine = StubEngine(dst, "052", workers=2, rate_limiter=HostRateLimiter(default=HostLimit(1e6, 2)))
+                small, large = peak_memory(2000), peak_memory(20000)
+                assert large < small * 1.5, (small, large)
+
+                # 最近完成的URL再出现时复用文件，超出记录范围的重新下载
+                engine.downloaded = []
+                urls = [f"http://example.com/{i}" for i in range(150)]
+                urls += ["http://example.com/149", "http://example.com/0"]
+                results = engine.run([DownloadTask(i, url) for i, url in enumerate(urls)])
+                results = {result.task.index: result for result in results}
+                assert results[150].duplicate_of == 149 and results[151].duplicate_of is None
+                assert engine.downloaded.count("http://example.com/0") == 2
+        finally:
+            download_engine.FINISHED_URL_LIMIT = limit
+
+        print("✅ 重复链接去重工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 重复链接去重测试失败: {e!r}")
+        return False
+
+def test_excel_reader():
+    """测试流式读取的URL和行号与pandas一致"""
+    try:
+        import openpyxl
+        import pandas as pd
+        from excel_reader import ExcelUrlReader
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["名称", "备注", "下载链接", "其他"])
+            ws.append(["a", "x", "http://example.com/a.pdf", 1])
+            ws.append([None, None, None, None])
+            ws.append(["c", "y", "  https://example.com/c.jpg  ", 2])
+            ws.append(["d", "z", "ftp://example.com/d", 3])
+            ws.append(["e", None, "not a url", None])
+            ws.append([None, None, "http://example.com/f.zip", None])
+            wb.save(path)
+            
+            df = pd.read_excel(path)
+            expected = []
+            for index, row in df.iterrows():
+                url = str(row["下载链接"]).strip()
+                if url and url != "nan" and (url.startswith("http://") or url.startswith("https://")):
+                    expected.append((index, url))
+                    
+            with ExcelUrlReader(path) as reader:
+                assert reader.url_column == "下载链接"
+                assert list(reader.iter_urls()) == expected
+                
+            # 预览时逐行读取全部列，行数与pandas一致
+            with ExcelUrlReader(path) as reader:
+                assert reader.columns == [str(col) for col in df.columns]
+                assert reader.estimated_rows == len(df)
+                rows = list(reader.iter_rows())
+                assert len(rows) == len(df)
+                assert all(len(row) == len(df.columns) for row in rows)
+                assert rows[0] == ("a", "x", "http://example.com/a.pdf", 1)
+                
+        print("✅ 流式读取Excel工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 流式读取Excel测试失败: {e!r}")
+        return False
+
+def test_pipelined_feed():
+    """测试解析尚未结束时下载已经开始，且解析结果总数在结束后可得"""
+    try:
+        from download_engine import DownloadEngine, DownloadTask, TaskFeed
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(6):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(b"x" * 100)
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            first_result = threading.Event()
+            started_early = []
+            
+            def slow_parser():
+                yield DownloadTask(0, f"{base}/file0.pdf")
+                # 在第一个下载完成前不继续解析
+                started_early.append(first_result.wait(5))
+                for i in range(1, 6):
+                    yield DownloadTask(i, f"{base}/file{i}.pdf")
+                    
+            feed = TaskFeed(slow_parser(), maxsize=2)
+            assert feed.total is None
+            try:
+                results = DownloadEngine(dst, "051", workers=2).run(feed, on_result=lambda r: first_result.set())
+            finally:
+                server.shutdown()
+                server.server_close()
+                
+            assert started_early == [True]
+            assert feed.total == 6 and len(results) == 6
+            assert all(result.success for result in results)
+            
+        print("✅ 解析与下载流水线工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 流水线测试失败: {e!r}")
+        return False
+
+def test_parse_cache():
+    """测试解析缓存按路径、大小和修改时间失效，并能从磁盘恢复"""
+    try:
+        from parse_cache import ParseCache
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "051.xlsx")
+            with open(path, "wb") as f:
+                f.write(b"v1")
+            cache_dir = os.path.join(tmp, "cache")
+            
+            key = ParseCache.key(path)
+            ParseCache(cache_dir).put(key, "urls", ("URL", [(0, "http://example.com/a")]))
+            # 新的缓存实例（相当于重新启动程序）从磁盘读取
+            fresh = ParseCache(cache_dir)
+            assert fresh.get(key, "urls") == ("URL", [(0, "http://example.com/a")])
+            assert fresh.get(key, "preview") is None
+            # 缓存格式版本变化后，旧版本写入磁盘的缓存不再使用
+            import parse_cache
+            version = parse_cache.CACHE_VERSION
+            parse_cache.CACHE_VERSION = version + 1
+            try:
+                assert ParseCache(cache_dir).get(key, "urls") is None
+            finally:
+                parse_cache.CACHE_VERSION = version
+            
+            # 文件修改后键变化，旧缓存不再命中
+            with open(path, "wb") as f:
+                f.write(b"version 2")
+            assert fresh.get(ParseCache.key(path), "urls") is None
+            
+            # 只用内存缓存时不写磁盘
+            memory_only = ParseCache(None)
+            memory_only.put(key, "urls", "value")
+            assert memory_only.get(key, "urls") == "value"
+            assert len(os.listdir(cache_dir)) == 1
+            
+            # 图形界面的预览在后台线程中读取缓存；超过单元格数上限的表格不缓存
+            import openpyxl
+            import download_rename_app
+            from types import SimpleNamespace
+            from ui_events import UiEventChannel
+            
+            path = os.path.join(tmp, "preview.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["URL", "名称", "备注"])
+            for i in range(10):
+                ws.append([f"http://example.com/{i}", f"n{i}", None])
+            wb.save(path)
+            key = ParseCache.key(path)
+            app = SimpleNamespace(ui_events=UiEventChannel(), parse_cache=ParseCache(None))
+            
+            def load():
+                download_rename_app.DownloadRenameApp.load_preview(app, path, key, 1, threading.Event())
+                return [args[1:] for kind, args in app.ui_events.drain() if kind == "preview"]
+                
+            limit = download_rename_app.MAX_CACHED_CELLS
+            download_rename_app.MAX_CACHED_CELLS = 29
+            try:
+                assert [kind for kind, _ in load()] == ["head", "done"]
+                assert app.parse_cache.get(key, "preview") is None
+            finally:
+                download_rename_app.MAX_CACHED_CELLS = limit
+            events = load()
+            assert app.parse_cache.get(key, "preview") is not None
+            # 缓存命中时不再读取文件
+            os.remove(path)
+            cached = load()
+            assert [kind for kind, _ in cached] == ["head", "done"], cached
+            assert cached[0][1][1] == events[0][1][1] and cached[1][1] == events[1][1]
+            
+        print("✅ 解析缓存工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 解析缓存测试失败: {e!r}")
+        return False
+
+def test_ui_events():
+    """测试界面事件通道合并状态事件并保留其余事件的顺序"""
+    try:
+        from ui_events import UiEventChannel
+        
+        channel = UiEventChannel(coalesce=("status", "progress"))
+        
+        def worker(n):
+            for i in range(500):
+                channel.post("status", f"{n}:{i}")
+                channel.post("progress", i, 500)
+                
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        channel.post("message", "showinfo", "完成", "a")
+        channel.post("status", "最后")
+        channel.post("message", "showinfo", "完成", "b")
+        
+        # 4000个事件合并为一次界面更新
+        events = channel.drain()
+        assert events == [
+            ("progress", (499, 500)),
+            ("message", ("showinfo", "完成", "a")),
+            ("status", ("最后",)),
+            ("message", ("showinfo", "完成", "b")),
+        ]
+        assert channel.drain() == []
+        
+        print("✅ 界面事件通道工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 界面事件通道测试失败: {e!r}")
+        return False
+
+def test_cli():
+    """测试命令行模式不加载tkinter，能下载并写出JSON和CSV报告"""
+    try:
+        import csv
+        import json
+        import subprocess
+        import openpyxl
+        from download_rename_cli import main as cli_main
+        
+        # 在新进程中检查导入命令行模块不会加载tkinter
+        code = "import sys, download_rename_cli; sys.exit('tkinter' in sys.modules)"
+        assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__))).returncode == 0
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(3):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(b"x" * 100)
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["名称", "下载链接"])
+            for i in range(3):
+                ws.append([f"f{i}", f"{base}/file{i}.pdf"])
+            ws.append(["missing", f"{base}/missing.pdf"])
+            wb.save(path)
+            
+            out = os.path.join(dst, "out")
+            json_report = os.path.join(dst, "report.json")
+            csv_report = os.path.join(dst, "report.csv")
+            try:
+                code = cli_main([path, "-o", out, "-j", "2", "-q", "--no-parse-cache", "--report", json_report])
+                # 再次运行：失败的行重新尝试，CSV报告每行一条记录
+                cli_main([path, "-o", out, "-q", "--no-parse-cache", "--report", csv_report])
+            finally:
+                server.shutdown()
+                
+            # 有失败的行时退出码为1
+            assert code == 1
+            assert sorted(name for name in os.listdir(out) if not name.startswith(".")) == [
+                "051_000.pdf", "051_001.pdf", "051_002.pdf"
+            ]
+            with open(json_report, encoding="utf-8") as f:
+                report = json.load(f)
+            assert report["summary"]["totals"]["downloaded"] == 3
+            statuses = {row["row"]: row["status"] for row in report["rows"]}
+            assert statuses == {0: "downloaded", 1: "downloaded", 2: "downloaded", 3: "failed"}
+            
+            with open(csv_report, encoding="utf-8-sig", newline="") as f:
+                rows = list(csv.DictReader(f))
+            assert len(rows) == 4
+            assert rows[3]["status"] == "failed"
+            
+        print("✅ 命令行模式工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 命令行模式测试失败: {e!r}")
+        return False
+
+def test_lazy_imports():
+    """测试启动时不加载requests、pandas、openpyxl等较慢的依赖"""
+    try:
+        import subprocess
+        
+        heavy = ("requests", "pandas", "numpy", "openpyxl", "xlrd")
+        for module in ("download_rename_app", "download_rename_cli"):
+            code = f"import sys, {module}; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+            result = subprocess.run(
+                [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True
+            )
+            assert result.stdout.strip() == "", f"{module} 启动时加载了 {result.stdout.strip()}"
+            
+        print("✅ 启动时未加载较慢的依赖")
+        return True
+    except Exception as e:
+        print(f"❌ 延迟导入测试失败: {e!r}")
+        return False
+
+def test_batch_queue():
+    """测试多个工作簿共享并发名额同时下载，各自使用自己的文件名前缀"""
+    try:
+        import openpyxl
+        from batch_queue import JOB_DONE, JOB_FAILED, BatchQueue, WorkerBudget, find_workbooks
+        
+        # 名额在进行中的任务之间平分，没有其他任务等待时可以用满
+        budget = WorkerBudget(4)
+        big, small = object(), object()
+        budget.register(big)
+        assert all(budget.try_acquire(big) for _ in range(4))
+        budget.register(small)
+        assert not budget.try_acquire(small)
+        budget.release(big)
+        budget.release(big)
+        # small在等待名额，big已用满平分的份额，空出的名额留给small
+        assert not budget.try_acquire(big)
+        assert budget.try_acquire(small)
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(10):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(b"x" * 100)
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            books = os.path.join(src, "books")
+            os.makedirs(books)
+            for name, files in (("big", range(8)), ("small", range(8, 10))):
+                wb = openpyxl.Workbook()
+                ws = wb.active
+                ws.append(["URL"])
+                for i in files:
+                    ws.append([f"{base}/file{i}.pdf"])
+                wb.save(os.path.join(books, f"{name}.xlsx"))
+            # Excel打开文件时留下的临时文件不算
+            open(os.path.join(books, "~$big.xlsx"), "wb").close()
+            assert [os.path.basename(p) for p in find_workbooks([books])] == ["big.xlsx", "small.xlsx"]
+            
+            out = os.path.join(dst, "out")
+            os.makedirs(out)
+            batch = BatchQueue(out, workers=3)
+            for path in find_workbooks([books]):
+                batch.add(path)
+            # 文件名前缀与已有工作簿相同的直接标记为出错
+            conflict = batch.add(os.path.join(src, "big.xls"))
+            assert conflict.state == JOB_FAILED
+            
+            finished_jobs = []
+            try:
+                counts = batch.run(on_job=lambda job: finished_jobs.append((job.excel_filename, job.state)))
+            finally:
+                server.shutdown()
+                
+            assert counts["downloaded"] == 10 and counts["failed"] == 0
+            assert batch.total == 10 and batch.finished == 10
+            assert ("small", JOB_DONE) in finished_jobs and ("big", JOB_DONE) in finished_jobs
+            names = sorted(name for name in os.listdir(out) if not name.startswith("."))
+            assert names == sorted([f"big_{i:03d}.pdf" for i in range(8)] + ["small_000.pdf", "small_001.pdf"])
+            # 队列结束后不能再加入
+            assert batch.add(os.path.join(books, "small.xlsx")) is None
+            assert batch.budget.in_use == 0
+            
+        print("✅ 多工作簿下载队列工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 多工作簿下载队列测试失败: {e!r}")
+        return False
+
+def test_stream_writer():
+    """测试复用缓冲区写入、只取已到达的数据、预分配和出错时截断到已写入的位置"""
+    try:
+        import hashlib
+        import io
+        from stream_writer import MIN_CHUNK_SIZE, stream_to_file
+        
+        class FakeResponse:
+            def __init__(self, data, fail_after=None):
+                self.headers = {"content-length": str(len(data))}
+                self.raw = self
+                self._stream = io.BytesIO(data)
+                self._fail_after = fail_after
+                
+            def readinto(self, buffer):
+                if self._fail_after is not None and self._stream.tell() >= self._fail_after:
+                    raise ConnectionError("连接中断")
+                return self._stream.readinto(buffer)
+                
+        data = os.urandom(MIN_CHUNK_SIZE * 5 + 123)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.part")
+            hasher = hashlib.sha256()
+            with open(path, "wb") as f:
+                assert stream_to_file(FakeResponse(data), f, hasher) == len(data)
+            with open(path, "rb") as f:
+                assert f.read() == data
+            assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+            
+            # 中途出错：预分配的空间被截掉，文件中只有已写入的内容，可以从这里续传
+            with open(path, "wb") as f:
+                try:
+                    stream_to_file(FakeResponse(data, fail_after=MIN_CHUNK_SIZE * 2), f)
+                    assert False, "应当抛出异常"
+                except ConnectionError:
+                    pass
+            written = os.path.getsize(path)
+            assert MIN_CHUNK_SIZE * 2 <= written < len(data)
+            with open(path, "rb") as f:
+                assert f.read() == data[:written]
+                
+            # 从断点位置继续写
+            with open(path, "r+b") as f:
+                f.seek(written)
+                stream_to_file(FakeResponse(data[written:]), f)
+            with open(path, "rb") as f:
+                assert f.read() == data
+
+            # readinto1每次只返回已到达的部分数据：读入同一个复用的缓冲区，出错前收到的数据全部保留
+            class PartialResponse(FakeResponse):
+                buffers = set()
+
+                def readinto1(self, buffer):
+                    self.buffers.add(id(buffer.obj))
+                    return self.readinto(buffer[:1000])
+
+            with open(path, "wb") as f:
+                try:
+                    stream_to_file(PartialResponse(data, fail_after=12345), f)
+                    assert False, "应当抛出异常"
+                except ConnectionError:
+                    pass
+            assert os.path.getsize(path) == 13000
+            assert len(PartialResponse.buffers) == 1
+
+            # 只有read1时（urllib3 2.x）每次收到多于半块，块大小逐渐加大
+            class Read1Response(FakeResponse):
+                sizes = []
+
+                def read1(self, size):
+                    self.sizes.append(size)
+                    return self._stream.read(size * 3 // 4)
+
+            with open(path, "wb") as f:
+                assert stream_to_file(Read1Response(data * 20), f) == len(data) * 20
+            with open(path, "rb") as f:
+                assert f.read() == data * 20
+            assert max(Read1Response.sizes) > MIN_CHUNK_SIZE
+
+        print("✅ 流式写入工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 流式写入测试失败: {e!r}")
+        return False
+
+class ConcurrencyHandler(RangeHandler):
+    """记录同时处理的请求数的峰值，每个请求先等待一会儿，使并发的请求有重叠"""
+    
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    
+    @classmethod
+    def reset(cls):
+        cls.active = cls.peak = 0
+    
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(0.05)
+            super().do_GET()
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+class SlowRangeHandler(RangeHandler):
+    """每0.05秒发送8KB（约160KB/s），从fail_start开始的Range请求返回404，sent记录发送的响应体字节数"""
+
+    fail_start = None
+    sent = 0
+
+    def do_GET(self):
+        if self.headers.get("Range", "").startswith(f"bytes={self.fail_start}-"):
+            self.send_error(404)
+            return
+        super().do_GET()
+
+    def end_headers(self):
+        super().end_headers()
+        self.wfile = SlowWriter(self.wfile, type(self))
+
+class SlowWriter:
+    """分成8KB的小块慢慢写入，把写出的字节数累加到owner.sent，客户端断开后不再写"""
+
+    def __init__(self, wfile, owner):
+        self._wfile = wfile
+        self._owner = owner
+
+    def write(self, data):
+        for offset in range(0, len(data), 8192):
+            time.sleep(0.05)
+            piece = data[offset:offset + 8192]
+            try:
+                self._wfile.write(piece)
+            except OSError:
+                # 客户端已断开
+                return
+            self._owner.sent += len(piece)
+
+    def __getattr__(self, name):
+        return getattr(self._wfile, name)
+
+def test_segmented_download():
+    """测试大文件分段并行下载，某一段连接中断时从该段已写入的位置重试"""
+    try:
+        from download_engine import DownloadEngine, DownloadTask
+        from rate_limiter import HostLimit, HostRateLimiter
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            data = os.urandom(1024 * 1024)
+            small = os.urandom(1000)
+            with open(os.path.join(src, "big.zip"), "wb") as f:
+                f.write(data)
+            with open(os.path.join(src, "small.zip"), "wb") as f:
+                f.write(small)
+            server = start_test_server(src, ConcurrencyHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            try:
+                RangeHandler.range_requests.clear()
+                # 第三段中途断开一次
+                RangeHandler.cut_ranges = {len(data) // 2}
+                # 两个下载加上大文件的另外三段，主机的最大并发要够5个
+                engine = DownloadEngine(
+                    dst, "051", workers=2, segments=4, segment_threshold=256 * 1024,
+                    rate_limiter=HostRateLimiter(default=HostLimit(1000, 5)),
+                )
+                results = engine.run([DownloadTask(0, f"{base}/big.zip"), DownloadTask(1, f"{base}/small.zip")])
+                ranges = list(RangeHandler.range_requests)
+                
+                # 主机最多2个并发：各段也占用名额，任何时候不超过2个请求
+                ConcurrencyHandler.reset()
+                engine = DownloadEngine(
+                    dst, "052", workers=2, segments=4, segment_threshold=256 * 1024,
+                    rate_limiter=HostRateLimiter(default=HostLimit(100, 2)),
+                )
+                limited = engine.run([DownloadTask(i, f"{base}/big.zip?{i}") for i in range(4)])
+            finally:
+                server.shutdown()
+            
+            assert all(result.success for result in limited), [result.error for result in limited]
+            for result in limited:
+                with open(os.path.join(dst, result.filename), "rb") as f:
+                    assert f.read() == data
+            assert ConcurrencyHandler.peak <= 2, ConcurrencyHandler.peak
+                
+            assert all(result.success for result in results), [result.error for result in results]
+            with open(os.path.join(dst, "051_000.zip"), "rb") as f:
+                assert f.read() == data
+            with open(os.path.join(dst, "051_001.zip"), "rb") as f:
+                assert f.read() == small
+            # 一段返回404：其余各段立即停止，不等各自的范围慢慢下载完
+            server = start_test_server(src, SlowRangeHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            try:
+                SlowRangeHandler.fail_start = len(data) // 2
+                SlowRangeHandler.sent = 0
+                engine = DownloadEngine(dst, "053", segments=4, segment_threshold=256 * 1024, retries=0)
+                began = time.monotonic()
+                failed = engine.run([DownloadTask(0, f"{base}/big.zip")])
+                elapsed = time.monotonic() - began
+            finally:
+                server.shutdown()
+            assert not failed[0].success and "404" in str(failed[0].error), failed[0].error
+            # 按限速每段要1.6秒
+            assert elapsed < 0.8, elapsed
+            assert SlowRangeHandler.sent < len(data) // 2, SlowRangeHandler.sent
+            assert not [name for name in os.listdir(dst) if name.startswith("053")]
+
+            quarter = len(data) // 4
+            # 小文件不分段；大文件四段，断开的那一段从中间继续
+            assert sorted(ranges) == sorted([
+                f"bytes=0-{quarter - 1}",
+                f"bytes={quarter}-{2 * quarter - 1}",
+                f"bytes={2 * quarter}-{3 * quarter - 1}",
+                f"bytes={2 * quarter + quarter // 2}-{3 * quarter - 1}",
+                f"bytes={3 * quarter}-{len(data) - 1}",
+            ]), ranges
+            
+        print("✅ 分段下载工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 分段下载测试失败: {e!r}")
+        return False
+
+def test_bandwidth_priority():
+    """测试全局带宽限制、运行中修改限速，以及按优先级分配带宽、并发名额和派发顺序"""
+    try:
+        import openpyxl
+        from bandwidth import BandwidthLimiter, parse_bandwidth, parse_rate
+        from batch_queue import WorkerBudget
+        from download_engine import DownloadEngine, DownloadTask
+        from excel_reader import ExcelUrlReader
+        
+        assert parse_rate("500K") == 500 * 1024 and parse_rate("1.5MB/s") == 1.5 * 1024 ** 2 and parse_rate("") == 0
+        assert parse_bandwidth("10M") == (10 * 1024 ** 2, [])
+        assert parse_bandwidth("09:00-18:00=2M; *=0") == (0, [(540, 1080, 2 * 1024 ** 2)])
+        for text in ("10X", "9-18=2M", "25:00-06:00=1M"):
+            try:
+                parse_bandwidth(text)
+                assert False, text
+            except ValueError:
+                pass
+                
+        # 跨过午夜的时段
+        night = BandwidthLimiter(1024, [(22 * 60, 6 * 60, 0)])
+        today = time.localtime()
+        at = lambda hour: time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hour, 30, 0, 0, 0, -1))
+        assert night.current_rate(at(23)) == 0 and night.current_rate(at(3)) == 0 and night.current_rate(at(12)) == 1024
+        
+        # 200KB/s：第一块立即通过（透支），之后每块等待透支的部分恢复
+        limiter = BandwidthLimiter(200 * 1024)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.consume(100 * 1024)
+        elapsed = time.monotonic() - start
+        assert 0.8 < elapsed < 2, elapsed
+        assert limiter.transferred == 300 * 1024
+        
+        # 等待中的线程里优先级高的先通过
+        limiter = BandwidthLimiter(1024 * 1024)
+        limiter.consume(300 * 1024)
+        order = []
+        consumer = lambda name, priority: threading.Thread(
+            target=lambda: (limiter.consume(300 * 1024, priority), order.append(name))
+        )
+        low, high = consumer("low", (0,)), consumer("high", (1,))
+        low.start()
+        time.sleep(0.05)
+        high.start()
+        low.join()
+        high.join()
+        assert order == ["high", "low"], order
+        
+        # 运行中取消限速，等待的线程立即继续
+        limiter = BandwidthLimiter(1024)
+        limiter.consume(100 * 1024)
+        waiter = threading.Thread(target=limiter.consume, args=(1024,))
+        waiter.start()
+        time.sleep(0.1)
+        limiter.set_limits(0)
+        waiter.join(timeout=2)
+        assert not waiter.is_alive()
+        
+        # 优先级高的引擎在等待时，空出的名额先给它
+        budget = WorkerBudget(2)
+        normal, urgent = object(), object()
+        budget.register(normal)
+        budget.register(urgent, priority=1)
+        assert budget.try_acquire(normal) and budget.try_acquire(normal)
+        assert not budget.try_acquire(urgent)
+        budget.release(normal)
+        assert not budget.try_acquire(normal)
+        assert budget.try_acquire(urgent)
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            # 识别优先级列
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["优先级", "名称", "URL"])
+            ws.append([None, "a", "http://example.com/a"])
+            ws.append(["是", "b", "http://example.com/b"])
+            ws.append([5, "c", "http://example.com/c"])
+            ws.append(["否", "d", "http://example.com/d"])
+            wb.save(path)
+            with ExcelUrlReader(path) as reader:
+                assert reader.priority_position == 0
+                assert list(reader.iter_url_rows()) == [
+                    (0, "http://example.com/a", 0, (), None), (1, "http://example.com/b", 1, (), None),
+                    (2, "http://example.com/c", 5, (), None), (3, "http://example.com/d", 0, (), None),
+                ]
+                
+            # 只有一个下载线程时，按优先级派发，相同优先级按行的顺序
+            for i in range(4):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(b"x" * 100)
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            tasks = [DownloadTask(i, f"{base}/file{i}.pdf", priority) for i, priority in enumerate((0, 1, 5, 0))]
+            try:
+                results = DownloadEngine(dst, "051", workers=1, bandwidth=BandwidthLimiter(1024 * 1024)).run(tasks)
+            finally:
+                server.shutdown()
+            assert [result.task.index for result in results] == [2, 1, 0, 3]
+            assert all(result.success for result in results)
+            
+        print("✅ 带宽限制和优先级调度工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 带宽限制和优先级测试失败: {e!r}")
+        return False
+
+class FlakyHandler(QuietHandler):
+    """前几次请求返回503（带Retry-After），之后正常返回文件；路径以 /down 开头的一直返回500"""
+    
+    failures = {}
+    requests_seen = []
+    
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        remaining = self.failures.get(self.path, 0)
+        if self.path.startswith("/down") or remaining:
+            self.failures[self.path] = remaining - 1
+            self.send_response(500 if self.path.startswith("/down") else 503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        super().do_GET()
+
+def test_retry_breaker():
+    """测试临时性错误的退避重试、分开的连接/读取超时和按主机熔断"""
+    try:
+        import socket
+        import retry_policy
+        from download_engine import DownloadEngine, DownloadTask
+        from retry_policy import CircuitBreaker, is_transient
+        
+        assert is_transient(ConnectionResetError()) and not is_transient(ValueError())
+        
+        # 连续失败后熔断，冷却后只放行一个探测请求，探测失败则冷却时间加倍
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=0.1)
+        breaker.record_failure("a")
+        assert breaker.allow("a")
+        breaker.record_failure("a")
+        assert not breaker.allow("a") and breaker.allow("b")
+        time.sleep(0.15)
+        assert breaker.allow("a") and not breaker.allow("a")
+        breaker.record_failure("a")
+        time.sleep(0.15)
+        assert not breaker.allow("a")
+        breaker.record_success("a")
+        assert breaker.allow("a") and not breaker.is_open("a")
+        
+        base_delay = retry_policy.RETRY_BASE_DELAY
+        retry_policy.RETRY_BASE_DELAY = 0.01
+        try:
+            with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+                for name in ("flaky.pdf", "gone.pdf"):
+                    with open(os.path.join(src, name), "wb") as f:
+                        f.write(b"x" * 100)
+                server = start_test_server(src, FlakyHandler)
+                base = f"http://127.0.0.1:{server.server_address[1]}"
+                FlakyHandler.failures = {"/flaky.pdf": 2}
+                FlakyHandler.requests_seen = []
+                
+                # 没有服务在监听的端口：连接立即被拒绝
+                probe = socket.socket()
+                probe.bind(("127.0.0.1", 0))
+                dead = f"http://127.0.0.1:{probe.getsockname()[1]}"
+                probe.close()
+                
+                tasks = [DownloadTask(0, f"{base}/flaky.pdf"), DownloadTask(1, f"{base}/down.pdf")]
+                engine = DownloadEngine(
+                    dst, "051", workers=2, timeout=(2, 5), retries=3, breaker=CircuitBreaker(failure_threshold=10)
+                )
+                try:
+                    results = {result.task.index: result for result in engine.run(tasks)}
+                finally:
+                    server.shutdown()
+                    
+                # 503两次后成功
+                assert results[0].success, results[0].error
+                assert FlakyHandler.requests_seen.count("/flaky.pdf") == 3
+                # 一直500：重试3次后失败
+                assert not results[1].success and "已重试 3 次" in results[1].error
+                assert FlakyHandler.requests_seen.count("/down.pdf") == 4
+                
+                # 宕机的主机熔断后，其余的行直接失败，不再逐个等待
+                tasks = [DownloadTask(i, f"{dead}/file{i}.pdf") for i in range(20)]
+                engine = DownloadEngine(
+                    dst, "052", workers=2, timeout=(2, 5), retries=3, breaker=CircuitBreaker(failure_threshold=3)
+                )
+                start = time.monotonic()
+                dead_results = engine.run(tasks)
+                assert not any(result.success for result in dead_results)
+                assert sum("暂停访问" in result.error for result in dead_results) >= 10
+                assert time.monotonic() - start < 10
+        finally:
+            retry_policy.RETRY_BASE_DELAY = base_delay
+            
+        print("✅ 重试和熔断工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 重试和熔断测试失败: {e!r}")
+        return False
+
+class TrickleHandler(RangeHandler):
+    """trickle中的路径第一次请求时只发送开头一小段，之后每0.2秒发送10字节，直到连接被断开"""
+    
+    trickle = set()
+    
+    def do_GET(self):
+        if self.path not in self.trickle:
+            super().do_GET()
+            return
+        self.trickle.discard(self.path)
+        with open(self.translate_path(self.path), "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{len(data)}-{int(os.path.getmtime(self.translate_path(self.path)))}"')
+        self.end_headers()
+        try:
+            self.wfile.write(data[:1000])
+            for position in range(1000, len(data), 10):
+                self.wfile.flush()
+                time.sleep(0.2)
+                self.wfile.write(data[position:position + 10])
+        except OSError:
+            pass
+        self.close_connection = True
+
+def test_stall_watchdog():
+    """测试速度长时间低于下限的下载被断开并从断点重试，等待带宽限制的时间不算作停滞"""
+    try:
+        import retry_policy
+        from bandwidth import BandwidthLimiter
+        from download_engine import DownloadEngine, DownloadTask
+        from download_journal import DownloadJournal
+        
+        base_delay = retry_policy.RETRY_BASE_DELAY
+        retry_policy.RETRY_BASE_DELAY = 0.01
+        try:
+            with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+                data = os.urandom(200 * 1024)
+                with open(os.path.join(src, "slow.zip"), "wb") as f:
+                    f.write(data)
+                server = start_test_server(src, TrickleHandler)
+                base = f"http://127.0.0.1:{server.server_address[1]}"
+                TrickleHandler.trickle = {"/slow.zip"}
+                RangeHandler.range_requests.clear()
+                try:
+                    journal = DownloadJournal(dst, "051")
+                    engine = DownloadEngine(dst, "051", workers=1, journal=journal, min_rate=10 * 1024, stall_window=1)
+                    start = time.monotonic()
+                    results = engine.run([DownloadTask(0, f"{base}/slow.zip")])
+                    elapsed = time.monotonic() - start
+                    journal.close()
+                    
+                    # 带宽限制使速度低于下限，但等待带宽的时间不计入，不会被断开
+                    bandwidth = BandwidthLimiter(100 * 1024)
+                    throttled = DownloadEngine(
+                        dst, "052", workers=1, min_rate=1024 * 1024, stall_window=0.5, bandwidth=bandwidth
+                    ).run([DownloadTask(0, f"{base}/slow.zip")])
+                finally:
+                    server.shutdown()
+                    
+                assert results[0].success, results[0].error
+                with open(os.path.join(dst, results[0].filename), "rb") as f:
+                    assert f.read() == data
+            assert elapsed < 10, elapsed
+            # 断开后用Range请求从已收到的位置继续
+            assert len(RangeHandler.range_requests) == 1, RangeHandler.range_requests
+            assert int(RangeHandler.range_requests[0].split("=")[1].split("-")[0]) >= 1000
+            assert throttled[0].success, throttled[0].error
+            assert len(RangeHandler.range_requests) == 1, RangeHandler.range_requests
+        finally:
+            retry_policy.RETRY_BASE_DELAY = base_delay
+            
+        print("✅ 停滞监测工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 停滞监测测试失败: {e!r}")
+        return False
+
+class DelayHandler(QuietHandler):
+    """delays中的路径先等待指定的秒数再响应"""
+    
+    delays = {}
+    requested = []
+    
+    def do_GET(self):
+        self.requested.append(self.path)
+        time.sleep(self.delays.get(self.path, 0))
+        super().do_GET()
+
+def test_hedged_mirrors():
+    """测试镜像列的识别、主链接响应慢时对冲请求镜像、主链接失败时改用镜像"""
+    try:
+        import openpyxl
+        import socket
+        from download_engine import DownloadEngine, DownloadTask
+        from download_job import WorkbookDownload
+        from excel_reader import ExcelUrlReader
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            # 第一个URL列为主链接，列名写明镜像/备用的列为镜像；主链接为空时使用镜像；其他URL列不使用
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["镜像", "URL", "名称", "备用URL", "缩略图URL"])
+            ws.append(["http://m.example.com/a", "http://example.com/a", "a", "http://b.example.com/a", "http://t/a"])
+            ws.append([None, "http://example.com/b", "b", "http://example.com/b", None])
+            ws.append(["http://m.example.com/c", None, "c", "无效", None])
+            ws.append([None, None, "d", None, "http://t/d"])
+            wb.save(path)
+            with ExcelUrlReader(path) as reader:
+                assert reader.url_column == "URL"
+                assert reader.mirror_positions == [0, 3]
+                assert list(reader.iter_url_rows()) == [
+                    (0, "http://example.com/a", 0, ("http://m.example.com/a", "http://b.example.com/a"), None),
+                    (1, "http://example.com/b", 0, (), None),
+                    (2, "http://m.example.com/c", 0, (), None),
+                ]
+                
+            data = os.urandom(50 * 1024)
+            for name in ("slow.zip", "fast.zip"):
+                with open(os.path.join(src, name), "wb") as f:
+                    f.write(data)
+            server = start_test_server(src, DelayHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            # 镜像用另一个主机名访问同一个服务器，与主链接分别计算名额和连接池
+            mirror = f"http://localhost:{server.server_address[1]}"
+            DelayHandler.delays = {"/slow.zip": 3}
+            
+            # 没有服务在监听的端口：连接立即被拒绝
+            probe = socket.socket()
+            probe.bind(("127.0.0.1", 0))
+            dead = f"http://127.0.0.1:{probe.getsockname()[1]}"
+            probe.close()
+            
+            try:
+                # 主链接响应慢：对冲请求镜像，镜像先响应
+                start = time.monotonic()
+                hedged = DownloadEngine(dst, "051", workers=1, hedge_delay=0.2).run(
+                    [DownloadTask(0, f"{base}/slow.zip", mirrors=(f"{mirror}/fast.zip",))]
+                )
+                hedged_elapsed = time.monotonic() - start
+                # 主链接连不上或返回404：改用镜像，不计入重试次数
+                failed_over = DownloadEngine(dst, "052", workers=2, hedge_delay=0, retries=0).run([
+                    DownloadTask(0, f"{dead}/a.zip", mirrors=(f"{base}/fast.zip",)),
+                    DownloadTask(1, f"{base}/missing.zip", mirrors=(f"{base}/fast.zip",)),
+                ])
+            finally:
+                server.shutdown()
+                
+            assert hedged[0].success, hedged[0].error
+            assert hedged_elapsed < 2.5, hedged_elapsed
+            assert hedged[0].task.source == f"{mirror}/fast.zip"
+            assert hedged[0].task.url == f"{base}/slow.zip"
+            with open(os.path.join(dst, hedged[0].filename), "rb") as f:
+                assert f.read() == data
+            for result in failed_over:
+                assert result.success, result.error
+                assert result.task.attempts == 0
+            
+            # 商品页响应慢也不会对冲到缩略图：第二个普通URL列从不被请求
+            server = start_test_server(src, DelayHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            path = os.path.join(src, "cat.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["商品链接", "缩略图URL"])
+            ws.append([f"{base}/slow.zip", f"{base}/fast.zip"])
+            ws.append([None, f"{base}/fast.zip"])
+            wb.save(path)
+            DelayHandler.delays = {"/slow.zip": 0.5}
+            DelayHandler.requested.clear()
+            results = []
+            try:
+                download = WorkbookDownload(path, dst, hedge_delay=0.1)
+                download.run(on_result=lambda result, status: results.append(result))
+            finally:
+                server.shutdown()
+            assert [result.task.index for result in results] == [0], results
+            assert "/fast.zip" not in DelayHandler.requested, DelayHandler.requested
+            with open(os.path.join(dst, results[0].filename), "rb") as f:
+                assert f.read() == data
+                
+        print("✅ 镜像和对冲请求工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 镜像和对冲请求测试失败: {e!r}")
+        return False
+
+def test_transfer_timing():
+    """测试每次下载各阶段的计时、按主机汇总的分位数报告和Prometheus文件"""
+    try:
+        import csv
+        import json
+        import openpyxl
+        from download_rename_cli import main as cli_main
+        from transfer_timing import PHASES, TransferTiming, format_prometheus, percentile, summarize
+        
+        assert percentile([1, 2, 3, 4, 5], 50) == 3
+        assert percentile([0, 10], 95) == 9.5
+        assert percentile([7], 99) == 7
+        
+        timings = []
+        for seconds in (0.1, 0.2, 0.3):
+            timing = TransferTiming("a.example.com")
+            timing.add("transfer", seconds)
+            timing.bytes = 100
+            timing.status = 200
+            timings.append(timing)
+        summary = summarize(timings)["a.example.com"]
+        assert summary["count"] == 3 and summary["bytes"] == 300 and summary["statuses"] == {200: 3}
+        assert abs(summary["phases"]["transfer"]["p50"] - 0.2) < 1e-9
+        metrics = format_prometheus(timings)
+        assert 'download_rename_transfers_total{host="a.example.com"} 3' in metrics
+        assert 'download_rename_phase_seconds{host="a.example.com",phase="transfer",quantile="0.5"} 0.200000' in metrics
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(3):
+                with open(os.path.join(src, f"file{i}.pdf"), "wb") as f:
+                    f.write(os.urandom(64 * 1024))
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["URL"])
+            for i in range(3):
+                ws.append([f"{base}/file{i}.pdf"])
+            ws.append([f"{base}/missing.pdf"])
+            wb.save(path)
+            
+            out = os.path.join(dst, "out")
+            report = os.path.join(dst, "report.json")
+            timing_report = os.path.join(dst, "timing.csv")
+            metrics_path = os.path.join(dst, "download.prom")
+            try:
+                cli_main([
+                    path, "-o", out, "-j", "2", "-q", "--no-parse-cache", "--report", report,
+                    "--timing-report", timing_report, "--metrics", metrics_path,
+                ])
+            finally:
+                server.shutdown()
+                
+            # 每一行记录状态码、字节数和各阶段耗时；新建的连接有连接耗时
+            with open(report, encoding="utf-8") as f:
+                rows = {row["row"]: row for row in json.load(f)["rows"]}
+            assert [rows[i]["http_status"] for i in range(4)] == [200, 200, 200, 404]
+            assert all(rows[i]["bytes"] == 64 * 1024 and rows[i]["transfer_ms"] >= 0 for i in range(3))
+            assert sum(rows[i]["connect_ms"] > 0 for i in range(4)) >= 1
+            assert all(rows[i]["retries"] == 0 and rows[i]["host"] == "127.0.0.1" for i in range(4))
+            
+            with open(timing_report, encoding="utf-8-sig", newline="") as f:
+                summary_rows = list(csv.DictReader(f))
+            assert {row["phase"] for row in summary_rows} == set(PHASES) | {"total"}
+            assert all(row["host"] == "127.0.0.1" and row["count"] == "4" for row in summary_rows)
+            assert float(next(row for row in summary_rows if row["phase"] == "total")["p99_ms"]) > 0
+            
+            with open(metrics_path, encoding="utf-8") as f:
+                metrics = f.read()
+            assert 'download_rename_responses_total{host="127.0.0.1",status="404"} 1' in metrics
+            assert 'download_rename_bytes_total{host="127.0.0.1"} 196608' in metrics
+            
+        print("✅ 传输计时和运行报告工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 传输计时测试失败: {e!r}")
+        return False
+
+def test_benchmark_download():
+    """测试模拟源站的Range和出错比例、基准测试的结果保存和退化比较"""
+    try:
+        import json
+        import urllib.request
+        from urllib.error import HTTPError
+        from benchmark_download import SimulatedOrigin, main as benchmark_main, parse_sizes
+        
+        assert parse_sizes("64K")(None) == 64 * 1024
+        assert 1024 <= parse_sizes("uniform:1K:2K")(__import__("random").Random(1)) <= 2048
+        
+        with SimulatedOrigin("uniform:1K:100K", seed=3) as origin:
+            size = origin.size_of(5)
+            assert size == SimulatedOrigin("uniform:1K:100K", seed=3).size_of(5)
+            with urllib.request.urlopen(origin.url(5)) as response:
+                body = response.read()
+            assert len(body) == size and response.headers["Accept-Ranges"] == "bytes"
+            request = urllib.request.Request(origin.url(5), headers={"Range": "bytes=100-199"})
+            with urllib.request.urlopen(request) as response:
+                assert response.status == 206 and response.read() == body[100:200]
+            origin.error_rate = 1.0
+            try:
+                urllib.request.urlopen(origin.url(5))
+                assert False, "应返回503"
+            except HTTPError as e:
+                assert e.code == 503
+                
+        with tempfile.TemporaryDirectory() as folder:
+            saved = os.path.join(folder, "bench.json")
+            args = ["--rows", "20", "40", "--latency", "0", "--sizes", "8K", "-j", "2"]
+            assert benchmark_main(args + ["--json", saved]) == 0
+            with open(saved, encoding="utf-8") as f:
+                results = json.load(f)
+            assert [scenario["rows"] for scenario in results["scenarios"]] == [20, 40]
+            for scenario in results["scenarios"]:
+                assert scenario["failed"] == 0
+                assert scenario["bytes"] == scenario["expected_bytes"] == scenario["rows"] * 8 * 1024
+                assert scenario["rows_per_sec"] > 0 and scenario["parse_seconds"] > 0
+                
+            # 基准结果快得多时判为退化，退出码为1
+            for scenario in results["scenarios"]:
+                scenario["rows_per_sec"] *= 100
+            faster = os.path.join(folder, "faster.json")
+            with open(faster, "w", encoding="utf-8") as f:
+                json.dump(results, f)
+            assert benchmark_main(args + ["--compare", faster]) == 1
+            
+        print("✅ 下载基准测试工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 下载基准测试失败: {e!r}")
+        return False
+
+class CorruptHandler(QuietHandler):
+    """corrupt中的路径第一次请求时返回内容被改动过的文件"""
+    
+    corrupt = set()
+    
+    def do_GET(self):
+        if self.path not in self.corrupt:
+            super().do_GET()
+            return
+        self.corrupt.discard(self.path)
+        with open(self.translate_path(self.path), "rb") as f:
+            data = bytearray(f.read())
+        data[0] ^= 0xFF
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def test_checksum_verification():
+    """测试下载时计算摘要、按校验列校验、校验失败时重试"""
+    try:
+        import hashlib
+        import openpyxl
+        import retry_policy
+        from checksum import parse_checksum
+        from download_engine import DownloadEngine, DownloadTask
+        from download_journal import DownloadJournal
+        from excel_reader import ExcelUrlReader
+        
+        sha = hashlib.sha256(b"abc").hexdigest()
+        md5 = hashlib.md5(b"abc").hexdigest()
+        assert parse_checksum(sha.upper()) == ("sha256", sha)
+        assert parse_checksum(f"SHA-256:{sha}") == ("sha256", sha)
+        assert parse_checksum(md5) == ("md5", md5)
+        assert parse_checksum(f"md5={md5}", "sha256") == ("md5", md5)
+        assert parse_checksum("  ") is None
+        assert parse_checksum("不是摘要") == ("", "不是摘要")
+        assert parse_checksum(md5, "sha256") == ("", md5)
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["URL", "名称", "SHA-256"])
+            ws.append(["http://example.com/a", "a", sha])
+            ws.append(["http://example.com/b", "b", None])
+            wb.save(path)
+            with ExcelUrlReader(path) as reader:
+                assert reader.checksum_position == 2 and reader.checksum_algorithm == "sha256"
+                assert list(reader.iter_url_rows()) == [
+                    (0, "http://example.com/a", 0, (), ("sha256", sha)), (1, "http://example.com/b", 0, (), None),
+                ]
+
+            # "摘要"是说明文字列，值不是摘要的Hash列也不是校验列；hashtag不算校验列名
+            path = os.path.join(src, "052.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["名称", "摘要", "Hash", "hashtag", "下载链接", "MD5"])
+            ws.append(["合同", "2024年第一季度合同扫描件", "见附件", md5, "http://example.com/a", md5])
+            wb.save(path)
+            with ExcelUrlReader(path) as reader:
+                assert reader.checksum_position == 5 and reader.checksum_algorithm == "md5"
+            ws.delete_cols(6)
+            wb.save(path)
+            with ExcelUrlReader(path) as reader:
+                assert reader.checksum_position is None
+                rows = list(reader.iter_url_rows())
+            assert rows == [(0, "http://example.com/a", 0, (), None)]
+            with open(os.path.join(src, "a.pdf"), "wb") as f:
+                f.write(b"abc")
+            server = start_test_server(src)
+            try:
+                url = f"http://127.0.0.1:{server.server_address[1]}/a.pdf"
+                results = DownloadEngine(dst, "052").run([DownloadTask(0, url, checksum=rows[0][4])])
+            finally:
+                server.shutdown()
+                server.server_close()
+            assert results[0].success, results[0].error
+
+            files = {}
+            for i in range(4):
+                files[i] = os.urandom(32 * 1024)
+                with open(os.path.join(src, f"file{i}.bin"), "wb") as f:
+                    f.write(files[i])
+            server = start_test_server(src, CorruptHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            CorruptHandler.corrupt = {"/file1.bin", "/file2.bin"}
+            wrong = hashlib.sha256(b"wrong").hexdigest()
+            tasks = [
+                DownloadTask(0, f"{base}/file0.bin", checksum=("md5", hashlib.md5(files[0]).hexdigest())),
+                # 第一次收到的内容有误，重试后校验通过
+                DownloadTask(1, f"{base}/file1.bin", checksum=("sha256", hashlib.sha256(files[1]).hexdigest())),
+                # 没有校验值：只记录摘要，内容有误也无从发现
+                DownloadTask(2, f"{base}/file2.bin"),
+                DownloadTask(3, f"{base}/file3.bin", checksum=("sha256", wrong)),
+                # 与第0行的URL相同，按本行的校验值检查第0行的文件
+                DownloadTask(4, f"{base}/file0.bin", checksum=("sha256", wrong)),
+            ]
+            base_delay = retry_policy.RETRY_BASE_DELAY
+            retry_policy.RETRY_BASE_DELAY = 0.01
+            journal = DownloadJournal(dst, "051")
+            completed = {}
+            
+            def on_result(result):
+                # 整批结束后日志中已完成的记录会被清除，在每一行完成时读取
+                completed[result.task.index] = journal.completed(result.task.index, result.task.url)
+                
+            try:
+                engine = DownloadEngine(dst, "051", workers=2, journal=journal, retries=2)
+                results = {result.task.index: result for result in engine.run(tasks, on_result=on_result)}
+            finally:
+                retry_policy.RETRY_BASE_DELAY = base_delay
+                journal.close()
+                server.shutdown()
+                
+            for i in (0, 1):
+                assert results[i].success, results[i].error
+                assert results[i].digest == "sha256:" + hashlib.sha256(files[i]).hexdigest()
+            assert results[1].task.attempts == 1
+            assert completed[1] == (results[1].filename, results[1].digest)
+            assert results[2].success and results[2].digest != "sha256:" + hashlib.sha256(files[2]).hexdigest()
+            assert not results[3].success and "校验失败" in results[3].error and "已重试 2 次" in results[3].error
+            assert not os.path.exists(os.path.join(dst, "051_003.part"))
+            assert not results[4].success and "校验失败" in results[4].error
+            
+        print("✅ 校验和工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 校验和测试失败: {e!r}")
+        return False
+
+class TruncatedHandler(QuietHandler):
+    """声明的长度比实际发送的多，发送一半后断开连接"""
+    
+    def do_GET(self):
+        with open(self.translate_path(self.path), "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[:len(data) // 2])
+        self.close_connection = True
+
+def test_durability():
+    """测试先写临时文件再原子重命名，以及file、batch、none三种落盘策略的fsync次数"""
+    try:
+        import durability
+        from download_engine import DownloadEngine, DownloadTask
+        from download_journal import DownloadJournal
+        from durability import DurabilityPolicy
+        
+        try:
+            DurabilityPolicy("always")
+            assert False, "未知策略应报错"
+        except ValueError:
+            pass
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            for i in range(5):
+                with open(os.path.join(src, f"file{i}.bin"), "wb") as f:
+                    f.write(os.urandom(16 * 1024))
+            # 真正调用一次fsync，确认文件和目录都能同步
+            durability.fsync_path(os.path.join(src, "file0.bin"))
+            durability.fsync_path(src, directory=True)
+            
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            real_fsync_path = durability.fsync_path
+            synced = []
+            durability.fsync_path = lambda path, directory=False: synced.append((os.path.basename(path), directory))
+            runs = {}
+            try:
+                for policy, sync_every in (("file", 1), ("batch", 2), ("none", 1)):
+                    folder = os.path.join(dst, policy)
+                    os.makedirs(folder)
+                    synced.clear()
+                    tasks = [DownloadTask(i, f"{base}/file{i}.bin") for i in range(5)]
+                    # 与第0行的URL相同，硬链接生成的文件也按策略同步
+                    tasks.append(DownloadTask(5, f"{base}/file0.bin"))
+                    engine = DownloadEngine(folder, "051", workers=2, durability=DurabilityPolicy(policy, sync_every))
+                    results = engine.run(tasks)
+                    assert all(result.success for result in results)
+                    runs[policy] = list(synced)
+            finally:
+                durability.fsync_path = real_fsync_path
+                server.shutdown()
+                server.server_close()
+            
+            # file：每个文件重命名前同步 .part 的内容，重命名后同步目录
+            files = sorted(name for name, directory in runs["file"] if not directory)
+            assert files == [f"051_{i:03d}.part" for i in range(5)] + ["051_005.bin.part"], files
+            assert sum(directory for _, directory in runs["file"]) == 6
+            # batch：6个文件各同步一次，每2个文件同步一次目录
+            files = sorted(name for name, directory in runs["batch"] if not directory)
+            assert files == [f"051_{i:03d}.bin" for i in range(6)], files
+            assert runs["batch"].count(("batch", True)) == 3, runs["batch"]
+            assert runs["none"] == []
+            
+            # 传输中断：不会出现最终文件名的文件
+            server = start_test_server(src, TruncatedHandler)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            folder = os.path.join(dst, "truncated")
+            os.makedirs(folder)
+            try:
+                engine = DownloadEngine(folder, "051", retries=0, durability=DurabilityPolicy("file"))
+                results = engine.run([DownloadTask(0, f"{base}/file0.bin")])
+            finally:
+                server.shutdown()
+                server.server_close()
+            assert not results[0].success, results[0].filename
+            leftover = [name for name in os.listdir(folder) if not name.endswith(".part")]
+            assert leftover == [], leftover
+            
+            # 下载日志中已完成、但文件大小与记录不符（如落盘前断电）的行重新下载
+            folder = os.path.join(dst, "none")
+            journal = DownloadJournal(folder, "051")
+            try:
+                journal.mark_done(0, f"{base}/file0.bin", "051_000.bin", 16 * 1024)
+                assert journal.completed(0, f"{base}/file0.bin") == ("051_000.bin", None)
+                with open(os.path.join(folder, "051_000.bin"), "r+b") as f:
+                    f.truncate(0)
+                assert journal.completed(0, f"{base}/file0.bin") is None
+            finally:
+                journal.close()
+            
+        print("✅ 原子重命名和落盘策略工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 落盘策略测试失败: {e!r}")
+        return False
+
+def test_failure_list():
+    """测试图形界面下载完成时列出失败的行，并把全部失败的行写入下载文件夹中的报告"""
+    try:
+        import csv
+        import openpyxl
+        from types import SimpleNamespace
+        from batch_queue import BatchQueue
+        from download_rename_app import FAILURE_REPORT_FILENAME, DownloadRenameApp, describe_failures
+        from ui_events import UiEventChannel
+        
+        with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+            with open(os.path.join(src, "a.pdf"), "wb") as f:
+                f.write(b"pdf")
+            server = start_test_server(src)
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            path = os.path.join(src, "051.xlsx")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(["URL"])
+            ws.append([f"{base}/a.pdf"])
+            ws.append([f"{base}/missing.pdf"])
+            wb.save(path)
+            
+            # 不创建窗口，只用下载线程用到的属性运行图形界面的下载流程
+            app = SimpleNamespace(ui_events=UiEventChannel(), is_downloading=True)
+            app.batch_status = lambda batch: ""
+            app.report_failures = lambda batch, failures: DownloadRenameApp.report_failures(app, batch, failures)
+            try:
+                batch = BatchQueue(dst, retries=0)
+                batch.add(path)
+                DownloadRenameApp.download_batch(app, batch)
+                messages = [args for kind, args in app.ui_events.drain() if kind == "message"]
+                with open(os.path.join(dst, FAILURE_REPORT_FILENAME), encoding="utf-8-sig") as f:
+                    rows = list(csv.DictReader(f))
+                
+                # 再次运行没有失败的行：上次的报告被删除
+                ws.delete_rows(3)
+                wb.save(path)
+                batch = BatchQueue(dst, retries=0)
+                batch.add(path)
+                DownloadRenameApp.download_batch(app, batch)
+            finally:
+                server.shutdown()
+                
+            assert len(messages) == 1 and messages[0][0] == "showinfo", messages
+            assert f"051.xlsx 第1行: {base}/missing.pdf - " in messages[0][2], messages[0][2]
+            assert [(row["row"], row["url"], row["status"]) for row in rows] == [("1", f"{base}/missing.pdf", "failed")]
+            assert "404" in rows[0]["error"]
+            assert not os.path.exists(os.path.join(dst, FAILURE_REPORT_FILENAME))
+            
+        records = [{"workbook": "051.xlsx", "row": i, "url": f"u{i}", "error": "e"} for i in range(12)]
+        lines = describe_failures(records, limit=10).split("\n")
+        assert len(lines) == 11 and lines[0] == "051.xlsx 第0行: u0 - e" and "另有 2 行" in lines[-1]
+        
+        print("✅ 失败行列表工作正常")
+        return True
+    except Exception as e:
+        print(f"❌ 失败行列表测试失败: {e!r}")
+        return False
+
 def main():
     """主测试函数"""
     print("🧪 开始测试应用程序...")
@@ -65,6 +1861,30 @@ def main():
     tests = [
         ("文件结构检查", test_file_structure),
         ("包导入测试", test_imports),
+        ("下载引擎测试", test_download_engine),
+        ("主机限速测试", test_rate_limiter),
+        ("断点续传测试", test_resume_download),
+        ("条件请求测试", test_conditional_resync),
+        ("重复链接测试", test_duplicate_urls),
+        ("流式读取测试", test_excel_reader),
+        ("流水线测试", test_pipelined_feed),
+        ("解析缓存测试", test_parse_cache),
+        ("界面事件测试", test_ui_events),
+        ("失败行列表测试", test_failure_list),
+        ("命令行测试", test_cli),
+        ("延迟导入测试", test_lazy_imports),
+        ("多工作簿队列测试", test_batch_queue),
+        ("流式写入测试", test_stream_writer),
+        ("分段下载测试", test_segmented_download),
+        ("带宽和优先级测试", test_bandwidth_priority),
+        ("重试和熔断测试", test_retry_breaker),
+        ("停滞监测测试", test_stall_watchdog),
+        ("镜像对冲测试", test_hedged_mirrors),
+        ("传输计时测试", test_transfer_timing),
+        ("下载基准测试", test_benchmark_download),
+        ("校验和测试", test_checksum_verification),
+        ("落盘策略测试", test_durability),
+        ("虚拟表格测试", test_virtual_table),
         ("tkinter测试", test_tkinter),
     ]
     
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+传输计时
+记录每次下载在DNS解析、建立连接、TLS握手、等待首字节、传输、写磁盘和等待带宽上各花了多少时间，
+以及字节数、HTTP状态码和重试次数；按主机汇总为p50/p95/p99，写成JSON、CSV报告或Prometheus文本格式
+"""
+
+import os
+import socket
+import threading
+import time
+
+# 各阶段：DNS解析、建立TCP连接、TLS握手、发出请求到收到响应头、接收响应体、写磁盘、等待带宽限制
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'disk', 'throttle')
+PERCENTILES = (50, 95, 99)
+# 下载报告中每一行的计时字段和汇总报告中每一行的字段，耗时单位为毫秒
+TIMING_FIELDS = ('host', 'http_status', 'retries', 'bytes') + tuple(f'{phase}_ms' for phase in PHASES)
+SUMMARY_FIELDS = ('host', 'phase', 'count') + tuple(f'p{p}_ms' for p in PERCENTILES) + ('max_ms',)
+# Prometheus指标名前缀
+METRIC_PREFIX = 'download_rename'
+
+_pool_classes = None
+
+
+class TransferTiming:
+    """
+    一次下载的计时，线程安全（分段下载时各段同时记入）
+    分段下载时transfer为各段并行传输的总时长，disk和throttle为各段之和
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.bytes = 0
+        self.status = None
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def record_response(self, response):
+        """记录状态码、新建连接的DNS/连接/TLS耗时和等待首字节的时间；复用的连接只有等待首字节的时间"""
+        self.status = response.status_code
+        setup = pop_connection_setup(response)
+        for phase, seconds in setup.items():
+            self.add(phase, seconds)
+        # requests的elapsed是从发出请求到解析完响应头，包含建立连接
+        elapsed = response.elapsed.total_seconds() if response.elapsed else 0.0
+        self.add('ttfb', max(0.0, elapsed - sum(setup.values())))
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def as_record(self):
+        """报告中每一行的计时字段，耗时单位为毫秒"""
+        record = {'host': self.host, 'http_status': self.status, 'retries': self.retries, 'bytes': self.bytes}
+        record.update({f'{phase}_ms': round(self.phases[phase] * 1000, 3) for phase in PHASES})
+        return record
+
+
+def pop_connection_setup(response):
+    """取出响应所用连接新建时的各阶段耗时，复用的连接和取不到连接时返回空字典"""
+    connection = getattr(getattr(response, 'raw', None), 'connection', None)
+    setup = getattr(connection, 'setup_timing', None)
+    if not setup:
+        return {}
+    connection.setup_timing = None
+    return setup
+
+
+def _timed_connection(base, secure):
+    """给urllib3的连接类加上计时：记录新建连接时DNS解析、TCP连接和TLS握手（secure为True时）的耗时"""
+
+    class TimedConnection(base):
+        setup_timing = None
+
+        def _new_conn(self):
+            host = self._dns_host
+            began = time.perf_counter()
+            try:
+                infos = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+            except OSError:
+                # 由urllib3按它的方式报告解析失败
+                return super()._new_conn()
+            resolved = time.perf_counter()
+            # 依次尝试解析出的地址，与urllib3的create_connection一致
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            try:
+                for position, address in enumerate(addresses):
+                    self._dns_host = address
+                    try:
+                        sock = super()._new_conn()
+                        break
+                    except Exception:
+                        if position == len(addresses) - 1:
+                            raise
+            finally:
+                self._dns_host = host
+            self.setup_timing = {'dns': resolved - began, 'connect': time.perf_counter() - resolved}
+            return sock
+
+        def connect(self):
+            began = time.perf_counter()
+            super().connect()
+            setup = self.setup_timing
+            if setup is not None and secure:
+                setup['tls'] = max(0.0, time.perf_counter() - began - setup['dns'] - setup['connect'])
+
+    TimedConnection.__name__ = 'Timed' + base.__name__
+    return TimedConnection
+
+
+def install(pool_manager):
+    """让urllib3的PoolManager新建的连接记录建立连接各阶段的耗时"""
+    global _pool_classes
+    if _pool_classes is None:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = _timed_connection(HTTPConnection, False)
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = _timed_connection(HTTPSConnection, True)
+
+        _pool_classes = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+    pool_manager.pool_classes_by_scheme = dict(_pool_classes)
+
+
+def percentile(values, p):
+    """已排序的values的第p百分位数（线性插值）"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(timings):
+    """
+    按主机汇总，返回 {主机: {'count', 'bytes', 'retries', 'statuses', 'phases'}}，
+    phases为 {阶段: {'count', 'sum', 'p50', 'p95', 'p99', 'max'}}（秒），另有total为每次下载的总耗时
+    """
+    hosts = {}
+    for timing in timings:
+        host = hosts.setdefault(timing.host, {'count': 0, 'bytes': 0, 'retries': 0, 'statuses': {}, 'samples': {}})
+        host['count'] += 1
+        host['bytes'] += timing.bytes
+        host['retries'] += timing.retries
+        if timing.status is not None:
+            host['statuses'][timing.status] = host['statuses'].get(timing.status, 0) + 1
+        for phase, seconds in list(timing.phases.items()) + [('total', timing.total)]:
+            host['samples'].setdefault(phase, []).append(seconds)
+
+    for host in hosts.values():
+        phases = {}
+        for phase, samples in host.pop('samples').items():
+            samples.sort()
+            stats = {'count': len(samples), 'sum': sum(samples)}
+            stats.update({f'p{p}': percentile(samples, p) for p in PERCENTILES})
+            stats['max'] = samples[-1]
+            phases[phase] = stats
+        host['phases'] = phases
+    return hosts
+
+
+def summary_rows(summary):
+    """把summarize()的结果展开为每个主机、每个阶段一行，耗时单位为毫秒"""
+    rows = []
+    for host, stats in sorted(summary.items()):
+        for phase, values in stats['phases'].items():
+            row = {'host': host, 'phase': phase, 'count': values['count']}
+            row.update({f'p{p}_ms': round(values[f'p{p}'] * 1000, 3) for p in PERCENTILES})
+            row['max_ms'] = round(values['max'] * 1000, 3)
+            rows.append(row)
+    return rows
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(timings):
+    """按Prometheus文本格式输出各主机的下载次数、字节数、重试次数、状态码和各阶段耗时的分位数"""
+    summary = summarize(timings)
+    lines = []
+    for key, metric, description in (
+        ('count', 'transfers_total', 'Downloads finished per host.'),
+        ('bytes', 'bytes_total', 'Bytes received per host.'),
+        ('retries', 'retries_total', 'Retries per host.'),
+    ):
+        name = f'{METRIC_PREFIX}_{metric}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        lines += [f'{name}{{host="{_label(host)}"}} {stats[key]}' for host, stats in summary.items()]
+
+    name = f'{METRIC_PREFIX}_responses_total'
+    lines += [f'# HELP {name} HTTP responses per host and status code.', f'# TYPE {name} counter']
+    for host, stats in summary.items():
+        for status, count in sorted(stats['statuses'].items()):
+            lines.append(f'{name}{{host="{_label(host)}",status="{status}"}} {count}')
+
+    name = f'{METRIC_PREFIX}_phase_seconds'
+    lines += [f'# HELP {name} Time spent in each phase of a download.', f'# TYPE {name} summary']
+    for host, stats in summary.items():
+        for phase, values in stats['phases'].items():
+            labels = f'host="{_label(host)}",phase="{phase}"'
+            for p in PERCENTILES:
+                lines.append(f'{name}{{{labels},quantile="{p / 100:g}"}} {values[f"p{p}"]:.6f}')
+            lines.append(f'{name}_sum{{{labels}}} {values["sum"]:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {values["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, timings):
+    """写出Prometheus文本格式文件，先写临时文件再重命名，node exporter不会读到写了一半的文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(format_prometheus(timings))
+    os.replace(tmp, path)
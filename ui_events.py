@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+界面事件通道
+工作线程不直接操作Tk控件，而是把界面更新放入线程安全的队列；
+Tk主循环按固定间隔一次取出全部事件，同一类状态只保留最新的一条，
+下载再快，每一帧也只更新一次界面
+"""
+
+import queue
+
+# 主循环处理界面事件的间隔（毫秒）
+DEFAULT_TICK_MS = 50
+
+
+class UiEventChannel:
+    """
+    工作线程到Tk主循环的事件通道
+    coalesce中的事件类型只保留最新的一条（如状态文字、进度），其余事件按发送顺序全部保留（如提示框）
+    """
+
+    def __init__(self, coalesce=()):
+        self.coalesce = frozenset(coalesce)
+        self._queue = queue.SimpleQueue()
+
+    def post(self, kind, *args):
+        """任意线程调用，不阻塞"""
+        self._queue.put((kind, args))
+
+    def drain(self):
+        """主线程调用，取出当前全部事件并合并，返回 [(类型, 参数), ...]"""
+        events = []
+        latest = {}
+        while True:
+            try:
+                kind, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind in self.coalesce:
+                # 丢弃同类的旧事件，新事件放在最后发生的位置
+                if kind in latest:
+                    events[latest[kind]] = None
+                latest[kind] = len(events)
+            events.append((kind, args))
+        return [event for event in events if event is not None]
+
+    def attach(self, root, handler, tick_ms=DEFAULT_TICK_MS):
+        """在Tk主循环中每隔tick_ms取出事件，逐个交给handler(类型, *参数)处理"""
+        def tick():
+            try:
+                for kind, args in self.drain():
+                    handler(kind, *args)
+            finally:
+                root.after(tick_ms, tick)
+
+        root.after(tick_ms, tick)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+虚拟化表格
+Treeview中只保留一屏的行，滚动时按页从数据源取数据并原地更新，行数再多也能立即显示
+"""
+
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+
+# 每次从数据源读取的行数
+DEFAULT_PAGE_SIZE = 200
+# 内存中保留的页数
+DEFAULT_MAX_PAGES = 8
+# 无法从样式读取行高时使用的默认值（像素）
+DEFAULT_ROW_HEIGHT = 20
+
+
+class VirtualTable:
+    """
+    虚拟化的表格视图
+    数据源通过 set_source(columns, row_count, fetch) 提供，fetch(start, stop) 返回这一段行的值列表
+    """
+
+    def __init__(self, parent, height=15, page_size=DEFAULT_PAGE_SIZE, max_pages=DEFAULT_MAX_PAGES):
+        self.tree = ttk.Treeview(parent, height=height, show='headings', selectmode='browse')
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.visible_rows = height
+
+        self.columns = []
+        self.row_count = 0
+        self.first = 0
+        self._fetch = None
+        self._pages = OrderedDict()
+
+        style_height = ttk.Style().lookup('Treeview', 'rowheight')
+        try:
+            self.row_height = int(style_height) or DEFAULT_ROW_HEIGHT
+        except (TypeError, ValueError):
+            self.row_height = DEFAULT_ROW_HEIGHT
+
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(3))
+        self.tree.bind('<Prior>', lambda event: self._on_key(-self.visible_rows))
+        self.tree.bind('<Next>', lambda event: self._on_key(self.visible_rows))
+        self.tree.bind('<Up>', self._on_up)
+        self.tree.bind('<Down>', self._on_down)
+        self.tree.bind('<Configure>', self._on_configure)
+
+    def set_source(self, columns, row_count, fetch):
+        """设置新的数据源，滚动位置回到开头"""
+        self.columns = list(columns)
+        self.row_count = row_count
+        self._fetch = fetch
+        self._pages.clear()
+        self.first = 0
+
+        items = self.tree.get_children()
+        if items:
+            self.tree.delete(*items)
+        self.tree['columns'] = self.columns
+        for col in self.columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=150, minwidth=100)
+        self._render()
+
+    def set_row_count(self, row_count):
+        """数据源在后台继续加载时更新总行数"""
+        # 原来的最后一页可能只取到了一部分，丢弃后重新读取
+        self._pages.pop(self.row_count // self.page_size, None)
+        self.row_count = row_count
+        self._render()
+
+    def set_headings(self, headings):
+        """修改列标题，例如显示列统计"""
+        for col, text in zip(self.columns, headings):
+            self.tree.heading(col, text=text)
+
+    def clear(self):
+        self.set_source([], 0, None)
+
+    def scroll(self, rows):
+        self.scroll_to(self.first + rows)
+
+    def scroll_to(self, first):
+        first = max(0, min(int(first), self.row_count - self.visible_rows))
+        if first != self.first:
+            self.first = first
+            self._render()
+
+    def _row(self, index):
+        page_number = index // self.page_size
+        page = self._pages.get(page_number)
+        if page is None:
+            start = page_number * self.page_size
+            page = self._fetch(start, min(start + self.page_size, self.row_count))
+            self._pages[page_number] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_number)
+        offset = index - page_number * self.page_size
+        return page[offset] if offset < len(page) else []
+
+    def _render(self):
+        self.first = max(0, min(self.first, self.row_count - self.visible_rows))
+        shown = min(self.visible_rows, self.row_count - self.first) if self._fetch else 0
+        items = self.tree.get_children()
+
+        # 复用已有的行，只更新内容
+        for slot in range(shown):
+            values = self._row(self.first + slot)
+            if slot < len(items):
+                self.tree.item(items[slot], values=values)
+            else:
+                self.tree.insert('', 'end', iid=f"slot{slot}", values=values)
+        if len(items) > shown:
+            self.tree.delete(*items[shown:])
+
+        if self.row_count:
+            self.scrollbar.set(self.first / self.row_count, (self.first + shown) / self.row_count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_scrollbar(self, action, *args):
+        if action == 'moveto':
+            self.scroll_to(float(args[0]) * self.row_count)
+        elif action == 'scroll':
+            amount, unit = int(args[0]), args[1]
+            self.scroll(amount * (self.visible_rows if unit == 'pages' else 1))
+
+    def _on_mousewheel(self, event):
+        # Windows上每格为120，macOS上为较小的整数
+        step = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self.scroll(-step * 3)
+        return 'break'
+
+    def _on_key(self, rows):
+        self.scroll(rows)
+        return 'break'
+
+    def _on_up(self, event):
+        items = self.tree.get_children()
+        if items and self.tree.focus() == items[0]:
+            return self._on_key(-1)
+        return None
+
+    def _on_down(self, event):
+        items = self.tree.get_children()
+        if items and self.tree.focus() == items[-1]:
+            return self._on_key(1)
+        return None
+
+    def _on_configure(self, event):
+        # 根据控件实际高度调整一屏显示的行数（减去表头高度）
+        visible = max(1, (event.height - self.row_height - 4) // self.row_height)
+        if visible != self.visible_rows:
+            self.visible_rows = visible
+            self._render()